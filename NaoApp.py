@@ -1,6 +1,5 @@
 'Autor: Rupert Wieser -- Naotilus -- 20220219'
 import datetime
-import http.client
 from math import ceil
 from copy import copy
 from json import dumps, loads
@@ -11,6 +10,16 @@ from typing import Union
 from urllib.parse import quote
 from naoconnect.Param import Param
 from naoconnect.TinyDb import TinyDb
+from naoconnect.nao.connection_pool import get_connection_pool
+from naoconnect.nao.telegraf import TelegrafSendResult, TelegrafStreamBody, gzip_telegraf_body, telegraf_headers, telegraf_url
+from naoconnect.nao.congestion import TelegrafCongestionControl
+from naoconnect.nao.token_manager import get_token_manager
+from naoconnect.nao.metadata_cache import NaoMetadataCache
+from naoconnect.nao.query_cache import NaoQueryCache
+from naoconnect.nao.spool import TelegrafSpool
+from naoconnect.nao.ring_buffer import DROP_OLDEST, TelegrafRingBuffer
+from naoconnect.nao.priority import LANE_BACKFILL, TelegrafPriorityScheduler
+from naoconnect.nao.memory_governor import DEFAULT_LINE_BYTES, TelegrafMemoryGovernor, get_memory_governor, telegraf_nbytes
 
 
 class NaoApp(Param):
@@ -61,17 +70,26 @@ class NaoApp(Param):
     STANDARD_LOGGINGINTERVAL = 60
     STANDARD_DATA_PER_FUNC_CALL = 200000
     STADARTD_DATA_PER_TELEGRAF = 10000
+    STATUS_CODES_AUTH = (401, 403)
 
-    def __init__(self, host, email, password, DataFromDb=False, DataForLogging=False, DataForListener=False, tiny_db_name="nao.json", error_log=False, break_hour:datetime.time=datetime.time(hour=23), local=False): # type: ignore
+    def __init__(self, host, email, password, DataFromDb=False, DataForLogging=False, DataForListener=False, tiny_db_name="nao.json", error_log=False, break_hour:datetime.time=datetime.time(hour=23), local=False, pool_size:int=None, gzip_level:int=None, congestion_control:TelegrafCongestionControl=None, metadata_cache:NaoMetadataCache=None, query_cache:NaoQueryCache=None, spool:TelegrafSpool=None, buffer_max_bytes:int=TelegrafRingBuffer.DEFAULT_MAX_BYTES, buffer_drop:str=DROP_OLDEST, memory_governor:TelegrafMemoryGovernor=None, priority_scheduler:TelegrafPriorityScheduler=None): # type: ignore
         self.auth = {
             NaoApp.NAME_HOST:host,
             NaoApp.NAME_PAYLOAD:NaoApp.NAME_EMAIL+"="+quote(email)+"&"+NaoApp.NAME_PASSWD+"="+quote(password)
         }
         self.error_log = error_log
-        self.__conneciton = None # type: ignore
+        self._pool = get_connection_pool(host, local=local, pool_size=pool_size)
+        self._tokens = get_token_manager(host, email, password, local=local)
         self.headers = {"Authorization": "", 'Content-Type': 'text/plain', 'Cookie': ""}
         self.db = TinyDb(tiny_db_name)
         self.local=local
+        self.gzip_level=gzip_level
+        self.congestion_control=congestion_control
+        self.metadata_cache=metadata_cache
+        self.query_cache=query_cache
+        self.spool=spool
+        self.memory_governor=memory_governor or get_memory_governor()
+        self.priority_scheduler=priority_scheduler
         self.DataFromDb = DataFromDb
         self.DataForLogging = DataForLogging
         self.DataForListener = DataForListener
@@ -79,7 +97,7 @@ class NaoApp(Param):
         self.end_transfer = False
         self.end_confirmation = False
         self.sending_counter = 0
-        self.logging_data = []
+        self.logging_data = TelegrafRingBuffer(max_lines=NaoApp.STANDARD_DATA_PER_FUNC_CALL, max_bytes=buffer_max_bytes, drop=buffer_drop)
         self.logging_data_add = self.logging_data.extend
         self.exit_hour = break_hour
         self.endwithexit = False
@@ -89,59 +107,144 @@ class NaoApp(Param):
         [ '<twin>,instance=<insatance>, <measurement>=<value> <timestamp>' ] 
                                       or
           '<twin>,instance=<insatance>, <measurement>=<value> <timestamp>'
+
+        Mit spool werden Blöcke, die NAO wegen eines vorübergehenden Fehlers
+        nicht annimmt, auf die Festplatte geschrieben und mit 204 quittiert;
+        nach dem nächsten erfolgreichen Senden werden sie gedrosselt nachgesendet.
+
+        Mit priority_scheduler wird jeder Block nach dem Alter seiner
+        Zeitstempel als aktuell ("live") oder Nachladung ("backfill") eingereiht.
         '''
+        status = self.__sendTelegrafBlocks(payload)
+        if status == 204 and self.spool and self.spool.pending_lines and self.spool.online:
+            self.replaySpool()
+        return(status)
+
+    def replaySpool(self, max_lines:int=None) -> int:
+        ''' Sendet gepufferte Blöcke aus dem spool nach; Rückgabe ist die Anzahl angenommener Zeilen. '''
+        if not self.spool:
+            return(0)
+        return(self.spool.replay(self.__sendSpooled, max_lines=max_lines))
+
+    def __sendSpooled(self, lines, precision=None) -> bool:
+        for idx in range(0, len(lines), NaoApp.STADARTD_DATA_PER_TELEGRAF):
+            if self._sendTelegrafData(lines[idx:idx+NaoApp.STADARTD_DATA_PER_TELEGRAF], precision, LANE_BACKFILL) != 204:
+                return(False)
+        return(True)
+
+    def __sendTelegrafBlock(self, payload):
+        if not self.spool:
+            return(self._sendTelegrafData(payload))
+        if self.spool.online:
+            try:
+                status = self._sendTelegrafData(payload)
+            except Exception:
+                status = TelegrafSendResult.STATUS_ERROR
+            if status == 204 or not self.spool.transient(status):
+                return(status)
+            self.spool.set_offline()
+        self.spool.append(payload)
+        return(204)
+
+    def __sendTelegrafBlocks(self, payload):
         if type(payload) != list:
-            return(self._sendTelegrafData(payload=payload))
+            return(self.__sendTelegrafBlock(payload))
+        elif self.congestion_control:
+            start = 0
+            while start < len(payload):
+                stop = start + self.congestion_control.chunk_size
+                sta = self.__sendTelegrafBlock(payload[start:stop])
+                if sta != 204:
+                    return(sta)
+                start = stop
+            return(sta)
         else:
             if len(payload) > NaoApp.STADARTD_DATA_PER_TELEGRAF:
                 last_idx = 0
                 for idx in range(int(ceil(len(payload)/NaoApp.STADARTD_DATA_PER_TELEGRAF))-1):
                     last_idx = idx
-                    sta = self._sendTelegrafData(payload[int(idx*NaoApp.STADARTD_DATA_PER_TELEGRAF):int(idx*NaoApp.STADARTD_DATA_PER_TELEGRAF)+NaoApp.STADARTD_DATA_PER_TELEGRAF])
+                    sta = self.__sendTelegrafBlock(payload[int(idx*NaoApp.STADARTD_DATA_PER_TELEGRAF):int(idx*NaoApp.STADARTD_DATA_PER_TELEGRAF)+NaoApp.STADARTD_DATA_PER_TELEGRAF])
                     if sta != 204:
                         return(sta)
                     sleep(1+idx*0.07)
-                return(self._sendTelegrafData(payload[int(last_idx*NaoApp.STADARTD_DATA_PER_TELEGRAF):]))
+                return(self.__sendTelegrafBlock(payload[int(last_idx*NaoApp.STADARTD_DATA_PER_TELEGRAF):]))
             else:
-                return(self._sendTelegrafData(payload))
+                return(self.__sendTelegrafBlock(payload))
 
-    def _sendTelegrafData(self, payload):
+    def _sendTelegrafData(self, payload, precision=None, lane=None):
+        nbytes = 0
+        if self.priority_scheduler:
+            lane = lane or self.priority_scheduler.classify(payload, precision)
+            nbytes = sum(len(line)+1 for line in payload) if type(payload) == list else len(payload)
         if type(payload) == list:
-            payload = NaoApp.FORMAT_TELEGRAFFRAMESEPERATOR*len(payload) % tuple(payload)
-        try:
-            self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLTELEGRAF, payload, self.headers) # type: ignore
-            status = self.__conneciton.getresponse().status # type: ignore
-            self.__conneciton.close() # type: ignore
-        except:
+            payload = TelegrafStreamBody(payload, self.gzip_level)
+        elif self.gzip_level:
+            payload = gzip_telegraf_body(payload, self.gzip_level)
+        for attempt in range(2):
             self._loginNao()
-            self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLTELEGRAF, payload, self.headers) # type: ignore
-            status = self.__conneciton.getresponse().status # type: ignore
-            self.__conneciton.close() # type: ignore
+            try:
+                status = self.__postTelegraf(payload, precision, lane, nbytes)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if status not in NaoApp.STATUS_CODES_AUTH:
+                break
+            self._tokens.invalidate(self.headers[NaoApp.NAME_WEBAUTH])
         return(status)
 
+    def __postTelegraf(self, payload, precision=None, lane=None, nbytes=0) -> int:
+        request = lambda: self._pool.request(NaoApp.NAME_POST, telegraf_url(NaoApp.URLTELEGRAF, precision), payload, telegraf_headers(self.headers, self.gzip_level))
+        if self.congestion_control:
+            send = lambda: self.congestion_control.send(request)
+        else:
+            send = request
+        if self.priority_scheduler:
+            res, _ = self.priority_scheduler.send(lane, nbytes, send)
+        else:
+            res, _ = send()
+        return(res.status)
+
     def _sendDataToNaoJson(self, method, url, payload) -> dict:
-        header = copy(self.headers)
-        header[NaoApp.NAME_CONTENT_HEADER] = NaoApp.HEADER_JSON
+        cache = self.metadata_cache if self.metadata_cache and method == NaoApp.NAME_GET and self.metadata_cache.cacheable(url) else None
+        if cache:
+            data = cache.get(self.auth[NaoApp.NAME_HOST], url)
+            if data is not None:
+                return(loads(data))
+        query = payload if self.query_cache and method == NaoApp.NAME_POST and self.query_cache.cacheable(url) else None
+        if query is not None:
+            data = self.query_cache.get(self.auth[NaoApp.NAME_HOST], url, query)
+            if data is not None:
+                return(loads(data))
         if payload != None:
             payload = dumps(payload)
-        try:
-            self.__conneciton.request(method, url, payload, header) # type: ignore
-            data = self.__conneciton.getresponse().read() # type: ignore
-            self.__conneciton.close() # type: ignore
-        except:
+        for attempt in range(2):
             self._loginNao()
             header = copy(self.headers)
             header[NaoApp.NAME_CONTENT_HEADER] = NaoApp.HEADER_JSON
-            self.__conneciton.request(method, url, payload, header) # type: ignore
-            data = self.__conneciton.getresponse().read() # type: ignore
-            self.__conneciton.close() # type: ignore
+            try:
+                res, data = self._pool.request(method, url, payload, header)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if res.status not in NaoApp.STATUS_CODES_AUTH:
+                break
+            self._tokens.invalidate(header[NaoApp.NAME_WEBAUTH])
+        if self.metadata_cache and method != NaoApp.NAME_GET:
+            self.metadata_cache.invalidate(self.auth[NaoApp.NAME_HOST], url)
         if data == b'':
             return('') # type: ignore
         else:
             try:
-                return(loads(data))
+                ret = loads(data)
             except:
                 return(-1) # type: ignore
+            if cache and res.status < 300:
+                cache.put(self.auth[NaoApp.NAME_HOST], url, data)
+            if query is not None and res.status < 300:
+                self.query_cache.put(self.auth[NaoApp.NAME_HOST], url, query, data)
+            return(ret)
     
     def sendNewInstance(self, asset, name, discription, workspace, geolocation=None):
         data = {
@@ -235,9 +338,7 @@ class NaoApp(Param):
         start = time()
         while 1==1:
             sleep(self.transfer_config[NaoApp.TRANSFERINTERVAL]) # type: ignore
-            data = self.logging_data
-            self.logging_data = []
-            self.logging_data_add = self.logging_data.extend
+            data = self.logging_data.take()
             Thread(target=self.__DataTransferLoggingBuffer, args=(data,)).start()
             if time() - start > 800:
                 self._addAndUpdateTotalNumberOfSentData()
@@ -290,18 +391,25 @@ class NaoApp(Param):
                 sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
             if self.end_transfer: break
             if time() - start > self.transfer_config[NaoApp.MAXBUFFERTIME]:  # type: ignore
-                self.print("WARNING:" + str(len(data)) + " datasets destroyed")
+                # zurück in den begrenzten Puffer; bei Überlauf fallen dort je nach buffer_drop Zeilen heraus
+                # mit spool werden vorübergehende Fehler schon in sendTelegrafData gepuffert
+                dropped = self.logging_data.dropped
+                self.logging_data.requeue(data)
+                self.print("WARNING:" + str(len(data)) + " datasets requeued, " + str(self.logging_data.dropped - dropped) + " destroyed")
                 break 
-            # TODO: hier könnte noch ein Buffer auf Festplatte gebaut werden
 
     def __dataTransferFromDb(self):
         while 1==1:
             start = time()
+            # wartet, solange andere Konnektoren im Prozess das Speicherbudget ausschöpfen
+            lease = self.memory_governor.lease(self.transfer_config[NaoApp.DATAPERTELEGRAF]*DEFAULT_LINE_BYTES) # type: ignore
             try:    
                 data = self.DataFromDb.getTelegrafData(max_data_len=self.transfer_config[NaoApp.DATAPERTELEGRAF]) # type: ignore
                 data_len = len(data) 
+                lease.resize(telegraf_nbytes(data))
             except TimeoutError:
                 data = []
+                lease.release()
                 self.print("ERROR-FromDb: TimeoutError")
                 sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
                 self.DataFromDb.refreshConnection() # type: ignore
@@ -309,6 +417,7 @@ class NaoApp(Param):
             except Exception as e:
                 data = []
                 data_len = 0
+                lease.release()
                 self.print("ERROR-FromDb:" + str(e))
                 sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
                 self.DataFromDb.refreshConnection() # type: ignore
@@ -329,6 +438,7 @@ class NaoApp(Param):
                 self.print("ERROR-Nao:" + str(e))
                 sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
                 self.DataFromDb.refreshConnection() # type: ignore
+            lease.release()
             diff = time() - start
             if self.end_transfer:
                 self.DataFromDb.exit() # type: ignore
@@ -342,23 +452,22 @@ class NaoApp(Param):
             try: 
                 start = time() 
                 data = self.DataForListener.getTelegrafData() # type: ignore
-                data_len = len(data)
+                dropped = self.logging_data.dropped
                 self.logging_data_add(data)
-                if (len(self.logging_data)) > NaoApp.STANDARD_DATA_PER_FUNC_CALL:
-                    self.print("delteted data-len: " + str(int(len(self.logging_data)-NaoApp.STANDARD_DATA_PER_FUNC_CALL)))
-                    self.logging_data[int(len(self.logging_data)-NaoApp.STANDARD_DATA_PER_FUNC_CALL):]
+                if self.logging_data.dropped > dropped:
+                    self.print("delteted data-len: " + str(self.logging_data.dropped - dropped))
+                data = self.logging_data.take()
                 try:
-                    if self.logging_data != []:
-                        status = self.sendTelegrafData(self.logging_data)    
+                    if data != []:
+                        status = self.sendTelegrafData(data)    
                         if status == 204:
-                            self.sending_counter += data_len
-                            del self.logging_data
-                            self.logging_data = []
-                            self.logging_data_add = self.logging_data.extend
+                            self.sending_counter += len(data)
                         else:
+                            self.logging_data.requeue(data)
                             self.print("ERROR: nao.status=" + str(status))
                             self._loginNao()
                 except Exception as e:
+                    self.logging_data.requeue(data)
                     self.print("ERROR-Nao:" + str(e))
                     sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
                     self.DataForListener.refreshConnection() # type: ignore
@@ -415,61 +524,25 @@ class NaoApp(Param):
             number = number[0][NaoApp.NAME_COUNT]
         return(number)
 
-    def _loginNaoLocal(self):
+    def _loginNao(self):
+        '''
+        Token aus dem prozessweiten Token-Cache. Angemeldet wird nur, wenn noch kein
+        Token existiert, das JWT bald abläuft oder es nach 401/403 verworfen wurde.
+        '''
+        login_count = self._tokens.login_count
         try:
-            self.print(NaoApp.MESSAGELOGIN)
-            self.__conneciton = http.client.HTTPConnection(self.auth[NaoApp.NAME_HOST])
-            self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-            res = self.__conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.BEARER + data[NaoApp.NAME_TOKENAC]
+            self.headers[NaoApp.NAME_WEBAUTH] = self._tokens.authorization()
         except:
             try:
                 sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
                 self.print(NaoApp.MESSAGELOGIN)
-                self.__conneciton = http.client.HTTPConnection(self.auth[NaoApp.NAME_HOST])
-                self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-                res = self.__conneciton.getresponse()
-                data = loads(res.read().decode(NaoApp.NAME_UTF8))
-                self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.BEARER + data[NaoApp.NAME_TOKENAC]
-            except:
-                self.__conneciton = http.client.HTTPConnection(self.auth[NaoApp.NAME_HOST])
-                self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-                res = self.__conneciton.getresponse()
-                data = res.read().decode(NaoApp.NAME_UTF8)
-                self.print("ERROR login, data: " + str(data))
+                self.headers[NaoApp.NAME_WEBAUTH] = self._tokens.authorization()
+            except Exception as e:
+                self.print("ERROR login, data: " + str(e))
                 self.endwithexit = True
-
-    def _loginNaoCloud(self):
-        try:
+                return
+        if self._tokens.login_count != login_count:
             self.print(NaoApp.MESSAGELOGIN)
-            self.__conneciton = http.client.HTTPSConnection(self.auth[NaoApp.NAME_HOST])
-            self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-            res = self.__conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.BEARER + data[NaoApp.NAME_TOKENAC]
-        except:
-            try:
-                sleep(self.transfer_config[NaoApp.ERRORSLEEP]) # type: ignore
-                self.print(NaoApp.MESSAGELOGIN)
-                self.__conneciton = http.client.HTTPSConnection(self.auth[NaoApp.NAME_HOST])
-                self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-                res = self.__conneciton.getresponse()
-                data = loads(res.read().decode(NaoApp.NAME_UTF8))
-                self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.BEARER + data[NaoApp.NAME_TOKENAC]
-            except:
-                self.__conneciton = http.client.HTTPSConnection(self.auth[NaoApp.NAME_HOST])
-                self.__conneciton.request(NaoApp.NAME_POST, NaoApp.URLLOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.LOGINHEADER)
-                res = self.__conneciton.getresponse()
-                data = res.read().decode(NaoApp.NAME_UTF8)
-                self.print("ERROR login, data: " + str(data))
-                self.endwithexit = True
-
-    def _loginNao(self):
-        if self.local:
-            self._loginNaoLocal()
-        else:
-            self._loginNaoCloud()
 
     def print(self, log:str):
         if self.error_log:
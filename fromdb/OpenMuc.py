@@ -7,6 +7,8 @@ from random import random
 from copy import copy
 from naoconnect.TinyDb import TinyDb
 from naoconnect.Param import Param
+from naoconnect.nao.encoder import TelegrafEncoder
+from naoconnect.nao.coalesce import coalesce_lines
 
 class OpenMuc (Param):
     RESTCHANNELS = "/rest/channels/"
@@ -34,7 +36,7 @@ class OpenMuc (Param):
     SECTOMIL = 1000
     RESETTIME = 1600000000000
 
-    def __init__(self, host, port, username, password, tiny_db_name="muc.json"):
+    def __init__(self, host, port, username, password, tiny_db_name="muc.json", coalesce=True):
         self.playload = ""
         self.port = port
         self.host = host
@@ -44,6 +46,8 @@ class OpenMuc (Param):
         self.marker_timestamps = None
         self.error_cannels = []
         self.confirm_time = time()
+        self.encoder = TelegrafEncoder()
+        self.coalesce = coalesce
         self.headers = {OpenMuc.NAME_WEBAUTH: 'Basic '+b64encode(
             bytes(username+":"+password, OpenMuc.NAME_UTF8)
         ).decode("ascii")}
@@ -54,8 +58,8 @@ class OpenMuc (Param):
         ''' [ '<twin>,instance=<insatance>, <measurement>=<value> <timestamp>' ] '''
         print("getTelegrafData")
         self.marker_timestamps = copy(self.lasttimestamps)
-        data = []
-        data_add = data.append
+        self.encoder.take() # Reste eines abgebrochenen Aufrufs verwerfen
+        data_add = self.encoder.add_many
         count = 0
         for channelinfo in self.transfere:
 
@@ -96,13 +100,11 @@ class OpenMuc (Param):
             if timeout:
                 continue
             self.marker_timestamps[channelinfo[OpenMuc.CHANNEL]] = history[OpenMuc.RECORDS][-1][OpenMuc.NAME_TIMESTAP]
+            points = []
+            points_add = points.append
             for data_set in history[OpenMuc.RECORDS]:
                 if data_set[OpenMuc.FLAG] == OpenMuc.FLAG_VALID:
-                    count += 1
-                    data_add(OpenMuc.FORMAT_TELEGRAFFRAMESTRUCT % (
-                        channelinfo[OpenMuc.NAME_TELEGRAF][0], channelinfo[OpenMuc.NAME_TELEGRAF][1], channelinfo[OpenMuc.NAME_TELEGRAF][2],
-                        data_set[OpenMuc.NAME_VALUE], data_set[OpenMuc.NAME_TIMESTAP]*OpenMuc.MILTONANO
-                    ))
+                    points_add((data_set[OpenMuc.NAME_VALUE], data_set[OpenMuc.NAME_TIMESTAP]*OpenMuc.MILTONANO))
                 elif data_set[OpenMuc.FLAG] == OpenMuc.FLAG_DRIVER_UNKNOW or data_set[OpenMuc.FLAG] == OpenMuc.FLAG_NO_DEVICE_BUSY:
                     self.error_cannels.append(channelinfo[OpenMuc.CHANNEL] + data_set[OpenMuc.FLAG] )
                     print(channelinfo[OpenMuc.CHANNEL], "error")
@@ -112,10 +114,16 @@ class OpenMuc (Param):
                 else:
                     self.error_cannels.append(channelinfo[OpenMuc.CHANNEL] + data_set[OpenMuc.FLAG] )
                     break
+            count += data_add(
+                channelinfo[OpenMuc.NAME_TELEGRAF][0], channelinfo[OpenMuc.NAME_TELEGRAF][1], channelinfo[OpenMuc.NAME_TELEGRAF][2],
+                points
+            )
             print(count)
             if count >= max_data_len: break
         self._disconnect()
-        return(data) 
+        # Kanäle einer Instanz mit gleichem Zeitstempel als eine Zeile
+        if self.coalesce: return(coalesce_lines(self.encoder.take_lines()))
+        return(self.encoder.take_lines())
 
     def confirmTransfer(self):
         self.lasttimestamps = self.marker_timestamps
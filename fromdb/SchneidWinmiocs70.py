@@ -6,6 +6,11 @@ from typing import Dict, Union
 import pandas as pd
 from datetime import datetime, timedelta
 from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.watermarks import newer_watermark
+from naoconnect.nao.frame_encoder import encode_frame
+from naoconnect.nao.coalesce import coalesce_lines
+from naoconnect.nao.priority import LANE_BACKFILL
+from naoconnect.nao.memory_governor import DEFAULT_LINE_BYTES, TelegrafMemoryGovernor, get_memory_governor, telegraf_nbytes
 from time import sleep, time
 import sys
 import csv
@@ -120,6 +125,8 @@ class SchneidParamWinmiocs70():
     DEFAULT_ERROR_SLEEP_SECOND = 300
     DEFAULT_BREAK_TELEGRAF_LEN = 50000
     DEFAULT_FIRST_TIME_SCHNEID = datetime(2014,1,1)
+    DEFAULT_META_PATCH_WORKERS = 8
+    DEFAULT_META_PATCH_RATE = 20
 
 
 
@@ -886,6 +893,7 @@ class SchneidMeta(SchneidParamWinmiocs70):
         asset_meta = self._getAssetMetaQuery()
         if len(asset_meta) > 0:
             meta_postgres = self.postgres.getMetaDataGroupedById()
+            patches = []
             for instance in instances:
                 instance_anid = instance[SchneidMeta.NAME_NAME].split("_")
                 if len(instance_anid)==2: instance_anid=instance_anid[0]
@@ -894,7 +902,8 @@ class SchneidMeta(SchneidParamWinmiocs70):
                 try: data = meta_postgres[int(instance_anid)]
                 except: continue
                 if not asset_meta.get(instance[SchneidMeta.NAME_ASSET_ID]): continue
-                if len(data)>0:self._patchStationMeta(data,instance,asset_meta[instance[SchneidMeta.NAME_ASSET_ID]], number=1)
+                if len(data)>0:self._patchStationMeta(data,instance,asset_meta[instance[SchneidMeta.NAME_ASSET_ID]], number=1, pending=patches)
+            self._sendMetaPatches(patches)
 
     def patchLastDataPointMeta(self):
         asset_meta = self.driver_db.getAssetLastValueMeta()
@@ -1019,9 +1028,9 @@ class SchneidMeta(SchneidParamWinmiocs70):
                 instance_id=instance_id
             )
 
-    def _patchStationMeta(self, data, instance, name_dp, number):
+    def _patchStationMeta(self, data, instance, name_dp, number, pending:list=None):
+        patches = [] if pending is None else pending
         for idx in data:
-            sleep(0.05)
             if idx not in name_dp: continue
             if data[idx]=="" or data[idx]==None: continue
             meta = self.labled_nao.getInstanceMetaByPosInstance(instance[SchneidMeta.NAME__ID],name_dp[idx],idx)
@@ -1043,17 +1052,32 @@ class SchneidMeta(SchneidParamWinmiocs70):
                     dat = None
             else: dat = str(data[idx])
             if meta[0][SchneidMeta.NAME_VALUE]!=dat:
-                res = self.nao.patchInstanceMeta(
-                    instance_id=instance["_id"],
-                    meta_id=meta[0][SchneidMeta.NAME_ID],
-                    value=dat
-                )
-                if isinstance(res,dict):
-                    if "_id" in res:
-                        self.labled_nao.patchInstanceMetaValueByPosInstance(instance[SchneidMeta.NAME__ID],name_dp[idx],idx, dat)
-                        print("patch meta")
-                    else: print("can't patch")
-                else: print("can't patch")
+                patches.append((instance[SchneidMeta.NAME__ID], meta[0][SchneidMeta.NAME_ID], dat, name_dp[idx], idx))
+        if pending is None: self._sendMetaPatches(patches)
+
+    def _sendMetaPatches(self, patches:list):
+        '''
+        patches = [ (instance_id, meta_id, value, pos, dp) ]
+        Patcht alle Attribute gebündelt über NaoApp.patchInstanceMetaMany und trägt
+        die angenommenen Werte anschließend in die lokale Labling-DB ein. Die erste
+        Ausnahme wird danach weitergereicht, wie beim einzelnen patchInstanceMeta.
+        '''
+        if len(patches)==0: return
+        # je Attribut nur der zuletzt gesammelte Wert, parallele Patches haben keine Reihenfolge
+        patches = list({(patch[0], patch[1]): patch for patch in patches}.values())
+        outcomes = self.nao.patchInstanceMetaMany(
+            [patch[:3] for patch in patches],
+            max_workers=SchneidMeta.DEFAULT_META_PATCH_WORKERS,
+            rate_limit=SchneidMeta.DEFAULT_META_PATCH_RATE
+        )
+        errors = []
+        for patch, outcome in zip(patches, outcomes):
+            if outcome.ok:
+                self.labled_nao.patchInstanceMetaValueByPosInstance(patch[0],patch[3],patch[4], patch[2])
+                print("patch meta")
+            elif outcome.error is not None: errors.append(outcome.error)
+            else: print("can't patch")
+        if errors: raise errors[0]
 
     def patchSyncStatus(self):
         data = self.labled_points.getNoSincPoints()
@@ -1091,9 +1115,12 @@ class SchneidMeta(SchneidParamWinmiocs70):
 class SchneidTransferCsv(SchneidParamWinmiocs70):
 
     def __init__(self,interval:timedelta,SyncStatus:SyncronizationStatus,NaoApp:NaoApp,SchneidCSV:SchneidCsvWinmiocs70,
-                 wrong_units:dict={}) -> None:
+                 wrong_units:dict={}, precision:str=None, coalesce:bool=True, memory_governor:TelegrafMemoryGovernor=None) -> None:
         '''
         wrong_units is a fix for wrong units, {<instance_id>:{<sensor_id>:<float(factor)>}}
+        precision sends timestamps as "s", "ms" or "us" instead of nanoseconds (smaller payloads)
+        coalesce merges the sensors of an instance with the same timestamp into one line before sending
+        memory_governor limits the telegraf data held in memory across connectors (default: process-wide governor)
         '''
         self.sync_status = SyncStatus
         self.interval = interval
@@ -1103,12 +1130,16 @@ class SchneidTransferCsv(SchneidParamWinmiocs70):
         self.new_status = {}
         self.status_count = {}
         self.wrong_units = wrong_units
+        self.precision = precision
+        self.coalesce = coalesce
+        self.memory_governor = memory_governor or get_memory_governor()
 
     def startSyncronization(self, logfile=None, sleep_data_len=1, archiv_sync=False, transfer_sleeper_sec:int=None):
         if not transfer_sleeper_sec: transfer_sleeper_sec = SchneidTransferCsv.DEFAULT_TRASFER_SLEEPER_SECOND
         count = 0
         sync_timer = time()
         sync_break_archiv_sinc = False
+        lease = None
         while 1==1:
             try: 
                 if sync_break_archiv_sinc:
@@ -1118,11 +1149,21 @@ class SchneidTransferCsv(SchneidParamWinmiocs70):
                     self.status=self.getSyncStatus()
                     break
                 start_time = time()
+                # wartet, solange andere Konnektoren das Speicherbudget ausschöpfen
+                lease = self.memory_governor.lease(SchneidTransferCsv.DEFAULT_BREAK_TELEGRAF_LEN*DEFAULT_LINE_BYTES)
                 data_telegraf, sync_reset = self.getTelegrafData()
+                lease.resize(telegraf_nbytes(data_telegraf))
+                result = None
                 for idx in range(2):
-                    if len(data_telegraf)>0:ret=self.nao.sendTelegrafData(data_telegraf)
+                    if len(data_telegraf)>0:
+                        # der zweite Versuch sendet nur die noch nicht angenommenen Blöcke
+                        # die Archiv-Synchronisation läuft mit priority_scheduler in der Backfill-Spur
+                        if result is None:result=self.nao.sendTelegrafDataResumable(coalesce_lines(data_telegraf) if self.coalesce else data_telegraf, values_count=len(data_telegraf), precision=self.precision, lane=LANE_BACKFILL if archiv_sync else None)
+                        else:result=self.nao.resumeTelegrafData(result, values_count=len(data_telegraf))
+                        ret=result.status
                     else:ret=SchneidTransferCsv.STATUS_CODE_GOOD
                     if ret==SchneidTransferCsv.STATUS_CODE_GOOD:
+                        lease.release()
                         print(len(data_telegraf), " data posted; sec:",time()-start_time, datetime.now())
                         start_time = time()
                         count+=len(data_telegraf)
@@ -1146,6 +1187,7 @@ class SchneidTransferCsv(SchneidParamWinmiocs70):
             except:
                 if logfile: logfile(str(sys.exc_info()))
                 break
+        if lease: lease.release()
         if logfile:logfile(str(count)+" data sended")
 
     def setSyncStatus(self):
@@ -1312,22 +1354,15 @@ class SchneidTransferCsv(SchneidParamWinmiocs70):
     
     def _formatTimeseriesToTelegrafFrame(self, timeseries:pd.DataFrame, sensor_ids:list, instance_id:str, asset_id:str):
         if len(sensor_ids)!=len(timeseries.columns): raise ValueError("bug in numer of sensors for instance-id:"+instance_id)
-        telegraf_list = []
-        add_telegraf = telegraf_list.append
-        columns = list(timeseries.columns)
-        for row in range(len(timeseries)):
-            timestamp = str(int(pytz.timezone(SchneidTransferCsv.DEFAULT_SCHNEID_TIMEZONE).localize(timeseries.index[row]).astimezone(pytz.utc).replace(tzinfo=None).timestamp()*1e9))
-            for idx in range(len(sensor_ids)):
-                if isnan(timeseries[columns[idx]].iloc[row]):continue
-                if instance_id in self.wrong_units:
-                    if sensor_ids[idx] in self.wrong_units[instance_id]:
-                        value = timeseries[columns[idx]].iloc[row]*self.wrong_units[instance_id][sensor_ids[idx]]
-                    else:
-                        value = timeseries[columns[idx]].iloc[row]
-                else:
-                     value = timeseries[columns[idx]].iloc[row]
-                add_telegraf(f"{asset_id},instance={instance_id} {sensor_ids[idx]}={value} {timestamp}")
-        return(telegraf_list)  
+        return(encode_frame(
+            frame=timeseries,
+            series_ids=sensor_ids,
+            asset_id=asset_id,
+            instance_id=instance_id,
+            tz=SchneidTransferCsv.DEFAULT_SCHNEID_TIMEZONE,
+            scale=self.wrong_units.get(instance_id),
+            precision=self.precision
+        ))
         
 
 
@@ -1546,6 +1581,48 @@ class ControllerIdSyncTime():
                 last_time=self.default_start_time
             )
 
+
+    def bootstrapFromNao(self, naoapp:NaoApp, organization_id:str) -> int:
+        '''
+        Seeds sync points that are still at `default_start_time` with the last timestamp stored in NAO.
+
+        After the local sync file was lost, every controller would otherwise restart at
+        `default_start_time` and upload years of data again. The last timestamps are
+        requested in bulk; controllers without data in NAO keep their default time.
+
+        Args:
+            naoapp (NaoApp): Instance of the NAO application used for the bulk query.
+            organization_id (str): NAO organization the series belong to.
+
+        Returns:
+            int: Number of controllers whose synchronization time was moved forward.
+        '''
+        points = [
+            {
+                "id": str(controller_id),
+                "asset": sync_point.asset_id,
+                "instance": sync_point.instance_id,
+                "series": sync_point.series_id
+            }
+            for controller_id, sync_point in self.sync_dic.items()
+            if sync_point.last_time <= self.default_start_time
+        ]
+        if not points:
+            return(0)
+
+        last_times = naoapp.getLastTimestamps(organization_id, points)
+        seeded = 0
+        for controller_id, sync_point in self.sync_dic.items():
+            server_time = last_times.get(str(controller_id))
+            if server_time is None:
+                continue
+            # Zeitstempel der Sync-Datei sind naive UTC-Zeiten
+            last_time = newer_watermark(sync_point.last_time, server_time.replace(tzinfo=None))
+            if last_time is not sync_point.last_time:
+                sync_point.last_time = last_time
+                seeded += 1
+        return(seeded)
+
         
     def setMetaPoint(self, value:Union[str,int,float,None], attribute_id:str, asset_id:str, 
                  instance_id:str, self_id:str, controller_id:str) -> None:
@@ -1587,7 +1664,7 @@ class SchneidPostgresHeatMeterSerialSync(SchneidParamWinmiocs70):
     '''
     def __init__(self, path_and_file_sync_status:"str",NaoApp:NaoApp,SchneidPostgres:ScheindPostgresWinmiocs70,
                  LablingNaoInstance:LablingNao, serial_id:str, error_id:Union[str,None] = None, 
-                 attribute_id:Union[str,None] = None) -> None:
+                 attribute_id:Union[str,None] = None, organization_id:Union[str,None] = None) -> None:
         '''
         Initializes the synchronization manager with necessary configurations.
 
@@ -1599,6 +1676,8 @@ class SchneidPostgresHeatMeterSerialSync(SchneidParamWinmiocs70):
             serial_id (str): ID of the series to be synchronized.
             error_id (Union[str, None], optional): ID of the error series, if applicable.
             attribute_id (Union[str, None], optional): ID of the attribute for metadata synchronization.
+            organization_id (Union[str, None], optional): NAO organization ID. If set, controllers without a
+                local sync time continue at the last timestamp already stored in NAO.
         '''
         self.sync_file = path_and_file_sync_status
         self.serial_id = serial_id
@@ -1609,6 +1688,8 @@ class SchneidPostgresHeatMeterSerialSync(SchneidParamWinmiocs70):
         self.naolabiling = LablingNaoInstance
         self.sync_status = ControllerIdSyncTime(self.sync_file)
         self.checkLabledInstances()
+        if organization_id and self.sync_status.bootstrapFromNao(self.naoapp, organization_id):
+            self.sync_status.writeSyncStatus()
 
     
     def checkLabledInstances(self) -> None:
@@ -1687,21 +1768,25 @@ class SchneidPostgresHeatMeterSerialSync(SchneidParamWinmiocs70):
                 controller_id=controller_id,
                 start_time=sync_data.last_time
             )
-            dataframe["time2"] = dataframe["time"].astype(int)
             
             if len(dataframe) == 0: 
                 continue
 
-            telegraf_frame = dataframe[["time2", "serial"]].dropna().apply(
-                lambda row: f'{sync_data.asset_id},instance={sync_data.instance_id} {sync_data.series_id}={repr(int(row["serial"]))} {int(row["time2"])}',
-                axis=1
-            ).to_list()
+            frame = dataframe.set_index("time")
+            telegraf_frame = encode_frame(
+                frame=pd.DataFrame({"serial": pd.to_numeric(frame["serial"], errors="coerce")}),
+                series_ids={"serial": sync_data.series_id},
+                asset_id=sync_data.asset_id,
+                instance_id=sync_data.instance_id
+            )
 
             if self.error_id!=None:
-                telegraf_frame.extend(dataframe[["time2", "error"]].dropna().apply(
-                    lambda row: f'{sync_data.asset_id},instance={sync_data.instance_id} {sync_data.series_id}={repr(row["error"])} {int(row["time2"])}',
-                    axis=1
-                ).to_list())
+                telegraf_frame.extend(encode_frame(
+                    frame=pd.DataFrame({"error": pd.to_numeric(frame["error"], errors="coerce")}),
+                    series_ids={"error": sync_data.series_id},
+                    asset_id=sync_data.asset_id,
+                    instance_id=sync_data.instance_id
+                ))
             
             status = self.naoapp.sendTelegrafData(
                 payload=telegraf_frame
@@ -2,6 +2,8 @@ from dataclasses import dataclass
 from typing import List, Dict, Tuple
 from datetime import datetime
 
+from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.watermarks import newer_watermark
 from . import *
 
 
@@ -52,7 +54,9 @@ class SyncPlanner:
 
     def __init__(self, Mapper: AqotecNaoMapping, 
                  SyncManager: SyncStateManager,
-                 first_sinc_time:datetime=datetime(2017, 1, 1)) -> None:
+                 first_sinc_time:datetime=datetime(2017, 1, 1),
+                 nao:NaoApp=None,
+                 organization_id:str=None) -> None:
         '''
         Initializes the SyncPlanner with necessary mapping and state management.
 
@@ -61,6 +65,9 @@ class SyncPlanner:
             SyncManager (SyncStateManager): Tracks which (db, table, sensor) combinations have already been synchronized.
             first_sinc_time (datetime, optional): Default starting point for full syncs of new assets or sensors.
                                                 Defaults to January 1, 2017.
+            nao (NaoApp, optional): NAO client; together with `organization_id`, tables missing from the
+                                    local state are seeded via `bootstrapFromNao()` when jobs are planned.
+            organization_id (str, optional): NAO organization the series belong to.
 
         Notes:
             - `sync_jobs_unsynced` will hold jobs that need full sync (either new tables or newly added sensors).
@@ -70,10 +77,62 @@ class SyncPlanner:
         self.Mapper = Mapper
         self.SincManager = SyncManager
         self.first_sinc_time = first_sinc_time
+        self.nao = nao
+        self.organization_id = organization_id
         self.sync_jobs_unsynced:List[SyncJob] = []
         self.sync_jobs: List[SyncJob] = []
 
 
+    def bootstrapFromNao(self, nao:NaoApp, organization_id:str) -> int:
+        '''
+        Seeds the sync state of tables missing locally with the last timestamps stored in NAO.
+
+        After the local SQLite file was lost, every table would otherwise be planned as an
+        initial sync from `first_sinc_time`. Instead, the last timestamp of every mapped sensor
+        is requested in bulk. A table is registered with the sensors that already have data in
+        NAO and the earliest of their last timestamps; sensors without data in NAO stay unsynced
+        and are planned by `setJobsUnsynced()` as usual.
+
+        Runs automatically at the start of `setJobsUnsynced()` if the planner was created
+        with `nao` and `organization_id`; otherwise call it before `setJobsUnsynced()`.
+
+        Args:
+            nao (NaoApp): NAO client used for the bulk "last" query.
+            organization_id (str): NAO organization the series belong to.
+
+        Returns:
+            int: Number of tables seeded from NAO.
+        '''
+        entries = [entry for entry in self.Mapper.mapping if (entry.aqotec_db, entry.aqotec_table) not in self.SincManager.sync_states]
+        points = [
+            {
+                "id": f"{entry.aqotec_db}/{entry.aqotec_table}/{dp.dp_position}",
+                "asset": entry.asset_id,
+                "instance": entry.instance_id,
+                "series": dp.nao_sensor_id
+            }
+            for entry in entries for dp in entry.sensor_models
+        ]
+        if not points:
+            return 0
+
+        last_times = nao.getLastTimestamps(organization_id, points)
+        seeded = 0
+        for entry in entries:
+            synced = {
+                dp.dp_position: last_times[f"{entry.aqotec_db}/{entry.aqotec_table}/{dp.dp_position}"]
+                for dp in entry.sensor_models
+                if f"{entry.aqotec_db}/{entry.aqotec_table}/{dp.dp_position}" in last_times
+            }
+            if not synced:
+                continue
+            last_synced = newer_watermark(self.first_sinc_time, min(synced.values()))
+            self.SincManager.updateSyncedColumns(entry.aqotec_db, entry.aqotec_table, list(synced), last_synced)
+            self.SincManager.sync_states[(entry.aqotec_db, entry.aqotec_table)] = (last_synced, list(synced))
+            seeded += 1
+        return seeded
+
+
     def setJobsUnsynced(self) -> List[SyncJob]:
         '''
         Detects and generates sync jobs for assets or sensors that have never been synchronized.
@@ -87,6 +146,9 @@ class SyncPlanner:
         Returns:
             List[SyncJob]: List of unsynchronized job definitions.
         '''
+        if self.nao is not None and self.organization_id:
+            # after losing the local SQLite file, do not reload everything from first_sinc_time
+            self.bootstrapFromNao(self.nao, self.organization_id)
 
         for entry in self.Mapper.mapping:
             key = (entry.aqotec_db, entry.aqotec_table)
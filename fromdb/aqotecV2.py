@@ -1,10 +1,15 @@
 'Autor: Rupert Wieser -- Naotilus -- 20232209'
 import pyodbc
 from naoconnect.local_db import Driver, StationDatapoints, LablingNao, SyncronizationStatus
-from pandas import Series
+from pandas import DataFrame, Series
 from datetime import datetime, timedelta
 from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.gap_audit import BackfillQueue, counts_by_day, day_ranges, enqueue_gaps
+from naoconnect.nao.frame_encoder import encode_frame
+from naoconnect.nao.priority import LANE_BACKFILL
+from naoconnect.nao.memory_governor import DEFAULT_LINE_BYTES, TelegrafMemoryGovernor, get_memory_governor, telegraf_nbytes
 from time import sleep, time
+from zoneinfo import ZoneInfo
 import sys
 import pytz
 
@@ -40,6 +45,7 @@ class AqotecParams():
     QUERY_SELECT_LAST_TIME = "SELECT TOP 1 * FROM %s ORDER BY DP_Zeitstempel DESC"
     QUERY_NOTES = "SELECT * FROM tbl_Historie WHERE his_Zeitstempel > DATETIME2FROMPARTS%s ORDER BY his_Zeitstempel ASC"
     QUERY_TIMESERIES = "SELECT %s, DP_Zeitstempel FROM %s WHERE DP_Zeitstempel > DATETIME2FROMPARTS%s AND DP_Zeitstempel < DATETIME2FROMPARTS%s ORDER BY DP_Zeitstempel DESC"
+    QUERY_COUNT_PER_DAY = "SELECT CAST(DP_Zeitstempel AS date), %s FROM %s WHERE DP_Zeitstempel >= DATETIME2FROMPARTS%s AND DP_Zeitstempel < DATETIME2FROMPARTS%s GROUP BY CAST(DP_Zeitstempel AS date)"
     QUERY_META_CUSTOMER_SELECT = "SELECT %s FROM Tbl_Abnehmer WHERE AnID = %s"
     QUERY_META_CUSTOMER_SELECT_2 = "SELECT %s FROM Tbl_Station WHERE AnID = %s"
     NAME_ENDING_TABLE_ROW_META = "_b"
@@ -100,6 +106,8 @@ class AqotecParams():
     DEFAULT_AQOTEC_TIMEZONE = 'Europe/Berlin'
     DEFAULT_TRASFER_SLEEPER_SECOND = 60*2
     DEFAULT_ERROR_SLEEP_SECOND = 300
+    DEFAULT_META_PATCH_WORKERS = 8
+    DEFAULT_META_PATCH_RATE = 20
     STATUS_CODE_GOOD = 204
     ERROR_HANDLING_START_DP = "DP_"
     INSTANCE_NAME_ADDITIVE_SUBZ = "SubZ-"
@@ -434,6 +442,7 @@ class AqotecMetaV2(AqotecConnectorV2):
         instances = self.labled_nao.getInstances()
         # -------------- Stationsdaten --------------
         asset_meta, pos_dp = self._getAssetMetaQuery(number=2)
+        patches = []
         if len(asset_meta) > 0:
             name_db = ""
             for instance in instances:
@@ -446,7 +455,7 @@ class AqotecMetaV2(AqotecConnectorV2):
                 except: continue
                 cursor.execute(AqotecMetaV2.QUERY_META_CUSTOMER_SELECT_2%(asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]][:-1],instance[AqotecMetaV2.NAME_NAME].split("R")[-1]))
                 data = cursor.fetchall()
-                if len(data)>0:self._patchStationMeta(data[0],instance, pos_dp, asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]].split(","), number=2)
+                if len(data)>0:self._patchStationMeta(data[0],instance, pos_dp, asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]].split(","), number=2, pending=patches)
         # -------------- Kundendaten --------------
         asset_meta, pos_dp = self._getAssetMetaQuery()
         if len(asset_meta) > 0:
@@ -462,7 +471,7 @@ class AqotecMetaV2(AqotecConnectorV2):
                             pos_dp_anid.append(pos_dp[idx])
                             break
                     if len(pos_dp_anid) > 0:
-                        self._patchStationMeta([instance["name"].split("R")[-1]],instance, pos_dp_anid, meta_anid, number=1)
+                        self._patchStationMeta([instance["name"].split("R")[-1]],instance, pos_dp_anid, meta_anid, number=1, pending=patches)
                     continue
                 try: 
                     if instance[AqotecMetaV2.NAME_DATABASE]!=name_db:
@@ -473,11 +482,12 @@ class AqotecMetaV2(AqotecConnectorV2):
                 except: continue
                 cursor.execute(AqotecMetaV2.QUERY_META_CUSTOMER_SELECT%(asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]][:-1],instance[AqotecMetaV2.NAME_NAME].split("R")[-1]))
                 data = cursor.fetchall()
-                if len(data)>0:self._patchStationMeta(data[0],instance, pos_dp, asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]].split(","), number=1)
+                if len(data)>0:self._patchStationMeta(data[0],instance, pos_dp, asset_meta[instance[AqotecMetaV2.NAME_ASSET_ID]].split(","), number=1, pending=patches)
             cursor = self.conn.cursor()
 
             cursor.close()
             self.disconnetToDb()
+        self._sendMetaPatches(patches)
 
     def _getDatetimeToSqlStrTuble(self, time:datetime):
         return(str((time.year,time.month,time.day,time.hour,time.minute,time.second,0,0)))
@@ -722,9 +732,9 @@ class AqotecMetaV2(AqotecConnectorV2):
                 instance_id=instance_id
             )
 
-    def _patchStationMeta(self, data,instance,pos_meta,name_dp,number):
+    def _patchStationMeta(self, data,instance,pos_meta,name_dp,number,pending:list=None):
+        patches = [] if pending is None else pending
         for idx in range(len(data)):
-            sleep(0.05)
             if data[idx]=="" or data[idx]==None: continue
             meta = self.labled_nao.getInstanceMetaByPosInstance(instance[AqotecMetaV2.NAME__ID],pos_meta[idx],name_dp[idx])
             if meta==[]: 
@@ -745,9 +755,32 @@ class AqotecMetaV2(AqotecConnectorV2):
                     dat = None
             else: dat = str(data[idx])
             if meta[0][AqotecMetaV2.NAME_VALUE]!=dat:
-                self.nao.patchInstanceMeta(instance[AqotecMetaV2.NAME__ID],meta[0][AqotecMetaV2.NAME_ID],dat)
-                self.labled_nao.patchInstanceMetaValueByPosInstance(instance[AqotecMetaV2.NAME__ID],pos_meta[idx],name_dp[idx], dat)
+                patches.append((instance[AqotecMetaV2.NAME__ID],meta[0][AqotecMetaV2.NAME_ID],dat,pos_meta[idx],name_dp[idx]))
+        if pending is None: self._sendMetaPatches(patches)
+
+    def _sendMetaPatches(self, patches:list):
+        '''
+        patches = [ (instance_id, meta_id, value, pos, dp) ]
+        Patcht gebündelt über NaoApp.patchInstanceMetaMany, erfolgreiche Werte
+        landen danach in der lokalen Labling-DB. Die erste Ausnahme wird danach
+        weitergereicht, wie beim einzelnen patchInstanceMeta.
+        '''
+        if len(patches)==0: return
+        # je Attribut nur der zuletzt gesammelte Wert, parallele Patches haben keine Reihenfolge
+        patches = list({(patch[0], patch[1]): patch for patch in patches}.values())
+        outcomes = self.nao.patchInstanceMetaMany(
+            [patch[:3] for patch in patches],
+            max_workers=AqotecMetaV2.DEFAULT_META_PATCH_WORKERS,
+            rate_limit=AqotecMetaV2.DEFAULT_META_PATCH_RATE
+        )
+        errors = []
+        for patch, outcome in zip(patches, outcomes):
+            if outcome.ok:
+                self.labled_nao.patchInstanceMetaValueByPosInstance(patch[0],patch[3],patch[4], patch[2])
                 print("patch meta")
+            elif outcome.error is not None: errors.append(outcome.error)
+            else: print("can't patch")
+        if errors: raise errors[0]
 
     def patchSyncStatus(self):
         data = self.labled_points.getNoSincPoints()
@@ -776,11 +809,14 @@ class AqotecMetaV2(AqotecConnectorV2):
 
 class AqotecTransferV2(AqotecConnectorV2):
 
-    def __init__(self,host,port,user,password,SyncStatus:SyncronizationStatus,NaoApp:NaoApp,driver="{ODBC Driver 18 for SQL Server}") -> None:
+    def __init__(self,host,port,user,password,SyncStatus:SyncronizationStatus,NaoApp:NaoApp,driver="{ODBC Driver 18 for SQL Server}", precision:str=None,
+                 memory_governor:TelegrafMemoryGovernor=None) -> None:
         super().__init__(host, port, user, password, driver)
         self.sync_status = SyncStatus
         self.status = self.getSyncStatus()
         self.nao = NaoApp
+        self.precision = precision
+        self.memory_governor = memory_governor or get_memory_governor()
         self.new_status = {}
         self.status_count = {}
 
@@ -788,6 +824,8 @@ class AqotecTransferV2(AqotecConnectorV2):
         count = 0
         is_sinct = False
         sinc_timer = time()
+        pending = None
+        lease = None
         while 1==1:
             try:
                 if datetime.now().hour >= 23:
@@ -795,10 +833,24 @@ class AqotecTransferV2(AqotecConnectorV2):
                     self.status=self.getSyncStatus()
                     break
                 start_time = time()
-                data_telegraf, sinc_reset = self.getTelegrafData()
-                if len(data_telegraf)>0:ret=self.nao.sendTelegrafData(data_telegraf)
-                else:ret=AqotecTransferV2.STATUS_CODE_GOOD
+                if pending:
+                    # fehlgeschlagenen Block fortsetzen, nur die noch nicht angenommenen Zeilen senden
+                    result, sinc_reset = pending
+                    data_telegraf = result.payload
+                    ret=self.nao.resumeTelegrafData(result).status
+                else:
+                    # wartet, solange andere Konnektoren das Speicherbudget ausschöpfen
+                    lease = self.memory_governor.lease(AqotecTransferV2.DEFAULT_BREAK_TELEGRAF_LEN*DEFAULT_LINE_BYTES)
+                    data_telegraf, sinc_reset = self.getTelegrafData()
+                    lease.resize(telegraf_nbytes(data_telegraf))
+                    if len(data_telegraf)>0:
+                        result=self.nao.sendTelegrafDataResumable(data_telegraf, precision=self.precision)
+                        ret=result.status
+                    else:ret=AqotecTransferV2.STATUS_CODE_GOOD
+                pending = None
                 if ret==AqotecTransferV2.STATUS_CODE_GOOD:
+                    # ein zurückgehaltener Block (pending) bleibt reserviert, bis er angenommen ist
+                    lease.release()
                     print(len(data_telegraf), " data posted; sec:",time()-start_time, datetime.now())
                     start_time = time()
                     count+=len(data_telegraf)
@@ -814,10 +866,13 @@ class AqotecTransferV2(AqotecConnectorV2):
                         is_sinct = True
                         sleep(AqotecTransferV2.DEFAULT_TRASFER_SLEEPER_SECOND)
                 else:
+                    pending = (result, sinc_reset)
                     sleep(AqotecTransferV2.DEFAULT_ERROR_SLEEP_SECOND)
             except:
                 if logfile: logfile(str(sys.exc_info()))
+                if lease and not pending: lease.release()
                 sleep(AqotecTransferV2.DEFAULT_ERROR_SLEEP_SECOND)
+        if lease: lease.release()
         if logfile:logfile(str(count)+" data sended")
 
     def setSyncStatus(self):
@@ -1035,13 +1090,119 @@ class AqotecTransferV2(AqotecConnectorV2):
         if len(data)==0:return(None)
         return(data[0][1])
     
+    def auditGaps(self, start:datetime, stop:datetime, organization_id:str, backfill_queue:BackfillQueue=None, tolerance:int=0) -> BackfillQueue:
+        '''
+        Vergleicht je Datenpunkt und Tag (Aqotec-Ortszeit) die Anzahl der Werte in
+        Aqotec (inklusive Archiv) mit NAO und legt nur die Tage mit fehlenden Werten
+        als (database, table, column) in die backfill_queue. Geprüft werden nur
+        synchronisierte Datenpunkte und Tage bis zu ihrem Sync-Zeitpunkt.
+        '''
+        if backfill_queue is None: backfill_queue = BackfillQueue()
+        days = day_ranges(start, stop, ZoneInfo(AqotecTransferV2.DEFAULT_AQOTEC_TIMEZONE))
+        if len(days)==0: return(backfill_queue)
+        points = []
+        source = {}
+        self.connectToDb()
+        cursor = self.conn.cursor()
+        for database in self.status:
+            for status_instance in self.status[database]:
+                synced = {dp:id for item in status_instance[AqotecTransferV2.NAME_SYNCRONICZIED] for dp, id in item.items()}
+                if len(synced)==0 or not status_instance[AqotecTransferV2.NAME_TIME_SYNCRONICZIED]:continue
+                synced_until = datetime.fromisoformat(status_instance[AqotecTransferV2.NAME_TIME_SYNCRONICZIED])
+                table_days = [day for day in days if day[2].replace(tzinfo=None) <= synced_until]
+                if len(table_days)==0:continue
+                table = status_instance[AqotecTransferV2.NAME_TABLE]
+                counts = self._getCountsPerDay(database, table, list(synced), table_days[0][1].replace(tzinfo=None), table_days[-1][2].replace(tzinfo=None), cursor)
+                for dp, sensor_id in synced.items():
+                    key = (database, table, dp)
+                    points.append({
+                        "id": "/".join(key),
+                        "asset": status_instance[AqotecTransferV2.NAME_DB_ASSET_ID],
+                        "instance": status_instance[AqotecTransferV2.NAME_DB_INSTANCE_ID],
+                        "series": sensor_id
+                    })
+                    source[key] = (table_days, counts.get(dp, {}))
+        cursor.close()
+        self.disconnetToDb()
+        nao_counts = self.nao.getDailyCounts(organization_id, points, days)
+        for key, (table_days, source_counts) in source.items():
+            enqueue_gaps(backfill_queue, key, table_days, source_counts, nao_counts.get("/".join(key), {}), tolerance)
+        return(backfill_queue)
+
+    def backfillGaps(self, backfill_queue:BackfillQueue, max_jobs:int=None) -> int:
+        '''
+        Sendet die Werte der Tage aus der backfill_queue erneut an NAO, ohne den Sync-Status zu ändern.
+        Schlägt das Senden fehl, kommt der Tag zurück in die Warteschlange und es wird abgebrochen.
+        Rückgabe ist die Anzahl gesendeter Werte.
+        '''
+        instances = {(database, status_instance[AqotecTransferV2.NAME_TABLE]):status_instance for database in self.status for status_instance in self.status[database]}
+        sent = 0
+        done = 0
+        self.connectToDb()
+        cursor = self.conn.cursor()
+        try:
+            while max_jobs is None or done < max_jobs:
+                job = backfill_queue.pop()
+                if job is None: break
+                done += 1
+                database, table, dp = job.key
+                status_instance = instances.get((database, table))
+                sensor_id = {dp_s:id for item in status_instance[AqotecTransferV2.NAME_SYNCRONICZIED] for dp_s, id in item.items()}.get(dp) if status_instance else None
+                if sensor_id is None: continue
+                rows = {}
+                for database_to_use in (database+AqotecTransferV2.NAME_ENDING_ARCHIV, database):
+                    timeseries = self._getTimeseries(database_to_use, table, [dp], job.start.replace(tzinfo=None)-timedelta(seconds=1), job.stop.replace(tzinfo=None), cursor)
+                    if timeseries==-1: continue
+                    for row in timeseries: rows[row[-1]] = row
+                if len(rows)==0: continue
+                telegraf = self._formatTimeseriesToTelegrafFrame(
+                    timeseries=[rows[timestamp] for timestamp in sorted(rows)],
+                    sensor_ids=[sensor_id],
+                    instance_id=status_instance[AqotecTransferV2.NAME_DB_INSTANCE_ID],
+                    asset_id=status_instance[AqotecTransferV2.NAME_DB_ASSET_ID]
+                )
+                if len(telegraf)==0: continue
+                if self.nao.sendTelegrafDataResumable(telegraf, precision=self.precision, lane=LANE_BACKFILL).status!=AqotecTransferV2.STATUS_CODE_GOOD:
+                    backfill_queue.put(job)
+                    break
+                sent += len(telegraf)
+        finally:
+            cursor.close()
+            self.disconnetToDb()
+        return(sent)
+
+    def _getCountsPerDay(self, database:str, table:str, data_points:list, start_time:datetime, stop_time:datetime, cursor:pyodbc.Cursor) -> dict:
+        ret = {}
+        for database_to_use in (database+AqotecTransferV2.NAME_ENDING_ARCHIV, database):
+            try:
+                cursor.execute(AqotecTransferV2.QUREY_USE%(database_to_use))
+                cursor.execute(AqotecTransferV2.QUERY_COUNT_PER_DAY%(
+                    ",".join(f"COUNT({dp})" for dp in data_points),
+                    table,
+                    self._getDatetimeToSqlStrTuble(start_time),
+                    self._getDatetimeToSqlStrTuble(stop_time)
+                ))
+                data = cursor.fetchall()
+            except:
+                continue
+            for idx, dp in enumerate(data_points):
+                counts = counts_by_day((row[0], row[idx+1]) for row in data)
+                # Archiv und Live-Datenbank können sich überschneiden
+                dp_counts = ret.setdefault(dp, {})
+                for day in counts: dp_counts[day] = max(dp_counts.get(day, 0), counts[day])
+        return(ret)
+
     def _formatTimeseriesToTelegrafFrame(self, timeseries, sensor_ids, instance_id, asset_id):
-        telegraf_list = []
-        add_telegraf = telegraf_list.append
-        for row in timeseries:
-            timestamp = str(int(pytz.timezone(AqotecTransferV2.DEFAULT_AQOTEC_TIMEZONE).localize(row[-1]).astimezone(pytz.utc).replace(tzinfo=None).timestamp()*1e9))
-            for idx in range(len(row[:-1])):
-                if row[idx]==None:continue
-                add_telegraf(f"{asset_id},instance={instance_id} {sensor_ids[idx]}={row[idx]} {timestamp}")
-        return(telegraf_list)
+        if len(timeseries)==0: return([])
+        # Zeilen (werte..., zeit) aus pyodbc -> DataFrame mit Zeitindex
+        frame = DataFrame.from_records([tuple(row) for row in timeseries])
+        frame = frame.set_index(frame.columns[-1])
+        return(encode_frame(
+            frame=frame,
+            series_ids=dict(zip(frame.columns, sensor_ids)),
+            asset_id=asset_id,
+            instance_id=instance_id,
+            tz=AqotecTransferV2.DEFAULT_AQOTEC_TIMEZONE,
+            precision=self.precision
+        ))
         
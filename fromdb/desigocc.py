@@ -3,6 +3,11 @@ import pandas as pd
 import pyodbc
 from time import sleep
 from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.gap_audit import BackfillQueue, counts_by_day, day_ranges, enqueue_gaps
+from naoconnect.nao.frame_encoder import encode_frame
+from naoconnect.nao.coalesce import coalesce_lines
+from naoconnect.nao.priority import LANE_BACKFILL
+from naoconnect.nao.memory_governor import DEFAULT_LINE_BYTES, TelegrafMemoryGovernor, get_memory_governor, telegraf_nbytes
 from typing import Union
 import ftfy
 import numpy as np
@@ -17,6 +22,8 @@ class DesigoCC():
     SQL_CHECK_DATA_IN_DATABASE = "SELECT TOP (3) [HDB_DpIdTs] FROM [%s].[dbo].[TiSe];"
     SQL_SELECT_VALUE_FROM_DP = "SELECT [SourceTime], [Value] FROM [%s].[dbo].[TiSe] WHERE [HDB_DpIdTs]=%s AND [SourceTime] > '%s' ORDER BY [SourceTime] ASC"
     SQL_COUNT_DATAPOINT_VALUES_FROM_DB = "SELECT  COUNT(Value) AS count, [HDB_DpIdTs] FROM [%s].[dbo].[TiSe] GROUP BY [HDB_DpIdTs];"
+    SQL_COUNT_DATAPOINT_VALUES_PER_DAY = "SELECT [HDB_DpIdTs], CAST([SourceTime] AS date) AS day, COUNT(Value) AS count FROM [%s].[dbo].[TiSe] WHERE [SourceTime] >= '%s' AND [SourceTime] < '%s' GROUP BY [HDB_DpIdTs], CAST([SourceTime] AS date);"
+    SQL_SELECT_VALUE_FROM_DP_RANGE = "SELECT [SourceTime], [Value] FROM [%s].[dbo].[TiSe] WHERE [HDB_DpIdTs]=%s AND [SourceTime] >= '%s' AND [SourceTime] < '%s' ORDER BY [SourceTime] ASC"
     DATABASE_TIMESERIES_REGEX = r"HDB_S"
     MESSAGE_WARNING_WRONG_LABLING_POINT = 'WARNUNG: Ein Datenpunkt ist in der Desigo Oberfläche einer falschen Station zugeordnet:\nDer Datenpunkt "%s"\nist statt dem Asset(Name) "%s", dem Asset(Name) "%s" zugeordent.\nDieser Datenpunkt wird in NAO automatisch der richtigen Station zugewiesen.'
     MESSAGE_INFO_ASSET_CREATED = 'INFO: In NAO wurde automatisch eine neues Asset für %s mit dem Namen "%s" (ID:%s) angelegt.'
@@ -56,6 +63,7 @@ class DesigoCC():
     COLUMN_DEVICE = "device"
     COLUMN_WORKSPACE = "workspace"
     COLUMN_COUNT = "count"
+    COLUMN_DAY = "day"
     COLUMN_HDB_DP_ID_TS = "HDB_DpIdTs"
     COLUMN_VALUE = "Value"
     COLUMN_SOURCE_TIME = "SourceTime"
@@ -79,8 +87,11 @@ class DesigoCC():
     TELEGRAF_PUSH_LEN = 15000
     TELEGRAF_STATUS_CODE_GOOD = 204
 
-    def __init__(self,NaoAppInstance:NaoApp,nao_driver_file:str,nao_labling_file:str,nao_sync_status_file:str,sql_host:str,sql_user:str,sql_password:str,sql_port:str="1433",sql_driver:str="{ODBC Driver 18 for SQL Server}",regex_test_mode=False,first_sync_time:datetime=datetime(2018,1,1,0,0,0)) -> None:
+    def __init__(self,NaoAppInstance:NaoApp,nao_driver_file:str,nao_labling_file:str,nao_sync_status_file:str,sql_host:str,sql_user:str,sql_password:str,sql_port:str="1433",sql_driver:str="{ODBC Driver 18 for SQL Server}",regex_test_mode=False,first_sync_time:datetime=datetime(2018,1,1,0,0,0),organization_id:str=None,coalesce:bool=True,memory_governor:TelegrafMemoryGovernor=None) -> None:
         self.first_sync_time = first_sync_time
+        self.coalesce = coalesce
+        self.memory_governor = memory_governor or get_memory_governor()
+        self.organization_id = organization_id
         self.Nao = NaoAppInstance
         self.sql_driver = sql_driver
         self.sql_host = sql_host
@@ -154,11 +165,37 @@ class DesigoCC():
 
     def _patchSyncStatus(self) -> None:
         point_not_in_sync = list(set(self.activated_datapoints.keys())-set(self.nao_sync_status_dict.keys()))
+        last_times = self._getNaoLastTimes(point_not_in_sync)
         for point in point_not_in_sync:
-            self.nao_sync_status_dict[point] = self.first_sync_time.isoformat()
+            self.nao_sync_status_dict[point] = last_times.get(point, self.first_sync_time.isoformat())
         if len(point_not_in_sync)>0:
-            self.saveSyncStatus() 
-    
+            self.saveSyncStatus()
+
+    def _getNaoLastTimes(self, dp_points:list) -> dict:
+        '''
+        Letzter in NAO gespeicherter Zeitstempel je Datenpunkt (naive UTC, isoformat),
+        damit Punkte ohne lokalen Sync-Stand nicht ab first_sync_time neu geladen werden.
+        Ohne organization_id oder bei Fehlern leer.
+        '''
+        if not self.organization_id or len(dp_points)==0: return({})
+        points = [{
+            "id": str(dp_point),
+            "asset": self.activated_datapoints[dp_point][DesigoCC.NAME_ASSET_ID],
+            "instance": self.activated_datapoints[dp_point][DesigoCC.NAME_INSTANCE_ID],
+            "series": self.activated_datapoints[dp_point][DesigoCC.NAME_SENSOR_ID]
+        } for dp_point in dp_points]
+        try:
+            last_times = self.Nao.getLastTimestamps(self.organization_id, points)
+        except:
+            print("nao last timestamps faild, start at first_sync_time")
+            return({})
+        ret = {}
+        for dp_point in dp_points:
+            last_time = last_times.get(str(dp_point))
+            if last_time and last_time.replace(tzinfo=None) > self.first_sync_time:
+                ret[dp_point] = last_time.replace(tzinfo=None).isoformat()
+        return(ret)
+
     def _getActivatedDatapoints(self) -> dict:
         ret = {}
         for point in self.nao_labling_dic[DesigoCC.NAME_ACTIVATED_DATAPOINTS]:
@@ -561,20 +598,35 @@ class DesigoCC():
     def _getNewTimeseriesAsTelegrafFrame(self,dp_point:int) -> set:
         timeseries = self._getNewTimeseriesFromPoint(dp_point=dp_point)
         if len(timeseries) == 0: return(-1,[])
+        last_time = timeseries[DesigoCC.COLUMN_SOURCE_TIME].iloc[-1].isoformat()
+        return(last_time, self._formatTelegrafFrame(dp_point=dp_point, timeseries=timeseries))
+
+    def _formatTelegrafFrame(self, dp_point:int, timeseries:pd.DataFrame) -> list:
         instance_id = self.activated_datapoints[dp_point][DesigoCC.NAME_INSTANCE_ID]
         asset_id = self.activated_datapoints[dp_point][DesigoCC.NAME_ASSET_ID]
         sensor_id = self.activated_datapoints[dp_point][DesigoCC.NAME_SENSOR_ID]
-        last_time = timeseries[DesigoCC.COLUMN_SOURCE_TIME].iloc[-1].isoformat()
         if dp_point in self.timeseries_validator:
             timeseries = self._validateTimeseries(timeseries=timeseries, validator=self.timeseries_validator[dp_point])
-        timeseries[DesigoCC.COLUMN_SOURCE_TIME] = timeseries[DesigoCC.COLUMN_SOURCE_TIME].astype(int)
-        return(last_time, timeseries.apply(lambda row: f'{asset_id},instance={instance_id} {sensor_id}={repr(row[DesigoCC.COLUMN_VALUE])} {int(row[DesigoCC.COLUMN_SOURCE_TIME])}',axis=1).to_list())
+        return(encode_frame(
+            frame=timeseries.set_index(DesigoCC.COLUMN_SOURCE_TIME)[[DesigoCC.COLUMN_VALUE]],
+            series_ids={DesigoCC.COLUMN_VALUE: sensor_id},
+            asset_id=asset_id,
+            instance_id=instance_id
+        ))
     
-    def _sendNaoTelegraf(self, telegraf_frame:list) -> bool:
+    def _sendNaoTelegraf(self, telegraf_frame:list, lane:str=None) -> bool:
         is_push=False
+        result=None
+        values_count=len(telegraf_frame)
+        # Datenpunkte einer Instanz mit gleichem Zeitstempel als eine Zeile
+        if self.coalesce: telegraf_frame=coalesce_lines(telegraf_frame)
         for idx in range(3):
-            ret=self.Nao.sendTelegrafData(telegraf_frame,max_sleep=0.15)
-            if ret==DesigoCC.TELEGRAF_STATUS_CODE_GOOD:
+            # Wiederholungen senden nur die Blöcke, die NAO noch nicht angenommen hat
+            if result is None:
+                result=self.Nao.sendTelegrafDataResumable(telegraf_frame,max_sleep=0.15,values_count=values_count,lane=lane)
+            else:
+                result=self.Nao.resumeTelegrafData(result,max_sleep=0.15,values_count=values_count)
+            if result.status==DesigoCC.TELEGRAF_STATUS_CODE_GOOD:
                 is_push=True
                 break
             else:
@@ -599,44 +651,130 @@ class DesigoCC():
     def sicAllDatapoints(self) -> bool:
         telegraf_frame = []
         last_point_times = {}
+        # Anteil am prozessweiten Speicherbudget für den gerade gesammelten Block
+        lease = None
+        lease_bytes = 0
         self.connectToMsSql()
         points = []
-        for dp_point in self.nao_sync_status_dict:
-            # if dp_point in self.timeseries_validator:
-            #     if self.timeseries_validator[dp_point].get("factor"):
-            #         points.append(dp_point)
-            #     else: continue
-            # else:continue
-            print("------------------------------",dp_point,"--------------------------------")
-            if dp_point in self.sleep_point:
-                self.sleep_point.pop(dp_point)
-                continue
-            last_time, frame = self._getNewTimeseriesAsTelegrafFrame(dp_point=dp_point)
-            if last_time == -1: continue
-            last_point_times[dp_point] = last_time
-            telegraf_frame.extend(frame)
-            if len(telegraf_frame)<DesigoCC.TELEGRAF_PUSH_LEN:continue
+        try:
+            for dp_point in self.nao_sync_status_dict:
+                # if dp_point in self.timeseries_validator:
+                #     if self.timeseries_validator[dp_point].get("factor"):
+                #         points.append(dp_point)
+                #     else: continue
+                # else:continue
+                print("------------------------------",dp_point,"--------------------------------")
+                if dp_point in self.sleep_point:
+                    self.sleep_point.pop(dp_point)
+                    continue
+                if lease is None:
+                    lease = self.memory_governor.lease(DesigoCC.TELEGRAF_PUSH_LEN*DEFAULT_LINE_BYTES)
+                    lease_bytes = 0
+                last_time, frame = self._getNewTimeseriesAsTelegrafFrame(dp_point=dp_point)
+                if last_time == -1: continue
+                last_point_times[dp_point] = last_time
+                telegraf_frame.extend(frame)
+                lease_bytes += telegraf_nbytes(frame)
+                lease.resize(max(lease_bytes, lease.nbytes))
+                if len(telegraf_frame)<DesigoCC.TELEGRAF_PUSH_LEN:continue
+                if self._sendNaoTelegraf(telegraf_frame=telegraf_frame):
+                    telegraf_frame = []
+                    lease.release()
+                    lease = None
+                    for dd in last_point_times: self.nao_sync_status_dict[dd] = last_point_times[dd]
+                    last_point_times = {}
+                else:
+                    self.saveSyncStatus()  
+                    self.disconnetToMsSql()
+                    return(False)
+            if len(telegraf_frame)==0: 
+                self.saveSyncStatus()  
+                self.disconnetToMsSql()
+                return(True)
             if self._sendNaoTelegraf(telegraf_frame=telegraf_frame):
-                telegraf_frame = []
-                for dd in last_point_times: self.nao_sync_status_dict[dd] = last_point_times[dd]
-                last_point_times = {}
+                 for dd in last_point_times: self.nao_sync_status_dict[dd] = last_point_times[dd]
+                 self.saveSyncStatus()  
+                 self.disconnetToMsSql()
+                 return(True)
             else:
                 self.saveSyncStatus()  
                 self.disconnetToMsSql()
                 return(False)
-        if len(telegraf_frame)==0: 
-            self.saveSyncStatus()  
-            self.disconnetToMsSql()
-            return(True)
-        if self._sendNaoTelegraf(telegraf_frame=telegraf_frame):
-             for dd in last_point_times: self.nao_sync_status_dict[dd] = last_point_times[dd]
-             self.saveSyncStatus()  
-             self.disconnetToMsSql()
-             return(True)
-        else:
-            self.saveSyncStatus()  
+        finally:
+            if lease: lease.release()
+
+    def auditGaps(self, start:datetime, stop:datetime, backfill_queue:BackfillQueue=None, tolerance:int=0) -> BackfillQueue:
+        '''
+        Vergleicht je Datenpunkt und Tag (UTC) die Anzahl der Werte in TiSe mit NAO
+        und legt nur die Tage mit fehlenden Werten in die backfill_queue.
+        Geprüft werden nur Tage, die laut Sync-Status bereits übertragen sind.
+        '''
+        if not self.organization_id: raise(ValueError("organization_id is required for the gap audit"))
+        if backfill_queue is None: backfill_queue = BackfillQueue()
+        days = day_ranges(start, stop)
+        if len(days)==0: return(backfill_queue)
+        dp_points = [dp_point for dp_point in self.nao_sync_status_dict if dp_point in self.activated_datapoints]
+        source_counts = self._getDatapointCountsPerDay(days[0][1], days[-1][2])
+        nao_counts = self.Nao.getDailyCounts(self.organization_id, [{
+            "id": str(dp_point),
+            "asset": self.activated_datapoints[dp_point][DesigoCC.NAME_ASSET_ID],
+            "instance": self.activated_datapoints[dp_point][DesigoCC.NAME_INSTANCE_ID],
+            "series": self.activated_datapoints[dp_point][DesigoCC.NAME_SENSOR_ID]
+        } for dp_point in dp_points], days)
+        for dp_point in dp_points:
+            synced_until = datetime.fromisoformat(self.nao_sync_status_dict[dp_point])
+            enqueue_gaps(
+                queue=backfill_queue,
+                key=dp_point,
+                days=[day for day in days if day[2].replace(tzinfo=None) <= synced_until],
+                source_counts=source_counts.get(dp_point, {}),
+                nao_counts=nao_counts.get(str(dp_point), {}),
+                tolerance=tolerance
+            )
+        return(backfill_queue)
+
+    def backfillGaps(self, backfill_queue:BackfillQueue, max_jobs:int=None) -> int:
+        '''
+        Sendet die Werte der Tage aus der backfill_queue erneut an NAO.
+        Schlägt das Senden fehl, kommt der Tag zurück in die Warteschlange und es wird abgebrochen.
+        Rückgabe ist die Anzahl gesendeter Werte.
+        '''
+        sent = 0
+        done = 0
+        self.connectToMsSql()
+        try:
+            while max_jobs is None or done < max_jobs:
+                job = backfill_queue.pop()
+                if job is None: break
+                done += 1
+                timeseries = self._getTimeseriesFromRange(job.key, job.start.replace(tzinfo=None), job.stop.replace(tzinfo=None))
+                if len(timeseries)==0: continue
+                telegraf_frame = self._formatTelegrafFrame(dp_point=job.key, timeseries=timeseries)
+                if not self._sendNaoTelegraf(telegraf_frame=telegraf_frame, lane=LANE_BACKFILL):
+                    backfill_queue.put(job)
+                    break
+                sent += len(telegraf_frame)
+        finally:
             self.disconnetToMsSql()
-            return(False)
+        return(sent)
+
+    def _getDatapointCountsPerDay(self, start:datetime, stop:datetime) -> dict:
+        ret = {}
+        self.connectToMsSql()
+        for database in self.database_timeseries_list:
+            counts = pd.read_sql_query(DesigoCC.SQL_COUNT_DATAPOINT_VALUES_PER_DAY%(database,start.replace(tzinfo=None).isoformat(),stop.replace(tzinfo=None).isoformat()),con=self.conn,)
+            for dp_point, group in counts.groupby(DesigoCC.COLUMN_HDB_DP_ID_TS):
+                day_counts = counts_by_day(zip(pd.to_datetime(group[DesigoCC.COLUMN_DAY]), group[DesigoCC.COLUMN_COUNT]))
+                dp_counts = ret.setdefault(int(dp_point), {})
+                for day in day_counts: dp_counts[day] = dp_counts.get(day, 0) + day_counts[day]
+        self.disconnetToMsSql()
+        return(ret)
+
+    def _getTimeseriesFromRange(self, dp_point:int, start:datetime, stop:datetime) -> pd.DataFrame:
+        timeseries = [pd.read_sql_query(DesigoCC.SQL_SELECT_VALUE_FROM_DP_RANGE%(database,dp_point,start.isoformat(),stop.isoformat()),con=self.conn,) for database in self.database_timeseries_list]
+        timeseries = [frame for frame in timeseries if len(frame)>0]
+        if len(timeseries)==0: return(pd.DataFrame([]))
+        return(pd.concat(timeseries, ignore_index=True).sort_values(DesigoCC.COLUMN_SOURCE_TIME).drop_duplicates(DesigoCC.COLUMN_SOURCE_TIME))
 
 # regex_list = ["\\.FW_WMZ_Waermemenge$", "\\.CmnHtmHEg$"]
 # for regex in self.nao_driver_dic["sensors"]:
@@ -12,6 +12,8 @@ from numpy import nan, isnan
 import pandas as pd
 
 from naoconnect.NaoApp import NaoApp
+from naoconnect.nao.frame_encoder import encode_frame
+from naoconnect.nao.coalesce import coalesce_lines
 from naoconnect.Param import Param
 from naoconnect.TinyDb import TinyDb
 
@@ -291,8 +293,9 @@ StructDWDParser = _StructDWDHTMLParser()
 class DWDData10m(Param, ParamDWD10m):
     SEC_TO_NANO = 1000000000
 
-    def __init__(self, NaoAppLabling=None, auto_labling=False, host:str="opendata.dwd.de", path_labling_json:str="labling.json", path_transfer_conf:str="conf_dwd.json"):
+    def __init__(self, NaoAppLabling=None, auto_labling=False, host:str="opendata.dwd.de", path_labling_json:str="labling.json", path_transfer_conf:str="conf_dwd.json", coalesce:bool=True):
         self.labling_path = path_labling_json
+        self.coalesce = coalesce
         self.conf_path = path_transfer_conf
         self.host = host
         self.auto_labling = auto_labling
@@ -473,24 +476,22 @@ class DWDData10m(Param, ParamDWD10m):
         return(data_return)
 
     def _getTelegrafDataFromFrame(self, data:pd.DataFrame, sub_url, sub_url2, station_id):
-        data_return = []
-        add_data = data_return.append
         asset = self.labling[DWDData10m.NAME_ASSET]
         try:
             instance = self.labling[DWDData10m.NAME_INSTANCE][station_id]
         except:
             self._lablingOneNaoStation10mFromNotInMeta(station_id,sub_url2)
             instance = self.labling[DWDData10m.NAME_INSTANCE][station_id]
-        for sensor in self.labling[sub_url][sub_url2][DWDData10m.DWD_SENSOR]:
-            for timestamp_d in data.index:
-                if not isnan(data[sensor][timestamp_d]):
-                    add_data(self._buildTelegrafFrameForm(
-                        twin=asset,
-                        instance=instance,
-                        series=self.labling[sub_url][sub_url2][DWDData10m.DWD_SENSOR][sensor][DWDData10m.NAME_SERIES],
-                        value=data[sensor][timestamp_d],
-                        timestamp=timestamp_d.timestamp()*DWDData10m.SEC_TO_NANO
-                    ))  
+        sensors = self.labling[sub_url][sub_url2][DWDData10m.DWD_SENSOR]
+        # MESS_DATUM ist UTC
+        data_return = encode_frame(
+            frame=data,
+            series_ids={sensor: sensors[sensor][DWDData10m.NAME_SERIES] for sensor in sensors},
+            asset_id=asset,
+            instance_id=instance
+        )
+        # alle Sensoren einer Station und eines Zeitpunkts als eine Zeile
+        if self.coalesce: return(coalesce_lines(data_return))
         return(data_return)
 
     def _buildTelegrafFrameForm(self, twin, instance, series, value,timestamp):
@@ -1000,8 +1001,9 @@ StructDWDParser1h = _StructDWDHTMLParser1h()
 class DWDData1h(Param, ParamDWD1h):
     SEC_TO_NANO = 1000000000
 
-    def __init__(self, NaoAppLabling=None, auto_labling=False, host:str="opendata.dwd.de", path_labling_json:str="labling1h.json", path_transfer_conf:str="conf_dwd1h.json"):
+    def __init__(self, NaoAppLabling=None, auto_labling=False, host:str="opendata.dwd.de", path_labling_json:str="labling1h.json", path_transfer_conf:str="conf_dwd1h.json", coalesce:bool=True):
         self.labling_path = path_labling_json
+        self.coalesce = coalesce
         self.conf_path = path_transfer_conf
         self.host = host
         self.auto_labling = auto_labling
@@ -1213,6 +1215,8 @@ class DWDData1h(Param, ParamDWD1h):
             add_data(
                 list(data[DWDData1h.NAME_ASSET]+DWDData1h.FORMAT_TELEGRAFFRAMESTRUCT3+data[DWDData1h.NAME_INSTANCE]+" "+data[DWDData1h.NAME_SERIES]+"="+data[sensor]+" "+data[DWDData1h.NAME_TIME])
             )
+        # alle Sensoren einer Station und eines Zeitpunkts als eine Zeile
+        if self.coalesce: return(coalesce_lines(data_return))
         return(data_return)
 
     # def _buildTelegrafFrameForm(self, twin, instance, series, value,timestamp):
@@ -3,6 +3,7 @@ from copy import deepcopy
 from time import time
 from naoconnect.TinyDb import TinyDb
 from naoconnect.Param import Param
+from naoconnect.nao.encoder import TelegrafEncoder
 
 class Monisoft(Param):
     TABLE_HISTORY           = "T_History"
@@ -27,6 +28,7 @@ class Monisoft(Param):
         self.marker_timestamps = None
         self.transfere = self._getTransferChannels()
         self.confirm_time = time()
+        self.encoder = TelegrafEncoder()
         self.__con = None
         self.cur = None
 
@@ -61,8 +63,8 @@ class Monisoft(Param):
     def getTelegrafData(self, max_data_len=30000, maxtimerange=None): #{'monisoft_id': '1000500',  'interval': 60}
         ''' [ '<twin>,instance=<insatance>, <measurement>=<value> <timestamp>' ] '''
         try:
-            ret_data = []
-            ret_data_add = ret_data.append
+            self.encoder.take() # Reste eines abgebrochenen Aufrufs verwerfen
+            ret_data_add = self.encoder.add_many
             # sql cursor
             self.connectToDb()
             self._buildCursor()
@@ -81,12 +83,7 @@ class Monisoft(Param):
                 # build sql time formate and set max timerange
                 aftertimesql = self.marker_timestamps.get(str(index))
                 aftertimesql2 = self.marker_timestamps.get(str(index))+used_maxtimerange
-                # build sql formated format
-                telegraf_form = self._buildTelegrafFrameForm(
-                        twin=self.transfere[index][Monisoft.NAME_TELEGRAF][0],
-                        instance=self.transfere[index][Monisoft.NAME_TELEGRAF][1],
-                        series=self.transfere[index][Monisoft.NAME_TELEGRAF][2]
-                )
+                twin, instance, series = self.transfere[index][Monisoft.NAME_TELEGRAF][:3]
                 breaker = False
                 while 1==1:  
                     # get data from db
@@ -97,10 +94,11 @@ class Monisoft(Param):
                     result_sql = self.cur.fetchall()
                     for row in result_sql:
                         timestamp_list_add(row[Monisoft.POSITION_TIME])
-                        # form data for telegraf
-                        if row[Monisoft.POSITION_VALUE] != None:
-                            ret_data_add(telegraf_form%(float(row[Monisoft.POSITION_VALUE]), row[Monisoft.POSITION_TIME]*Monisoft.SECTONANO))
-                            data_len += 1
+                    # form data for telegraf
+                    data_len += ret_data_add(twin, instance, series, (
+                        (float(row[Monisoft.POSITION_VALUE]), row[Monisoft.POSITION_TIME]*Monisoft.SECTONANO)
+                        for row in result_sql if row[Monisoft.POSITION_VALUE] != None
+                    ))
                     try:
                         self.marker_timestamps[str(index)] = max(timestamp_list)
                     except:
@@ -128,7 +126,7 @@ class Monisoft(Param):
             pass
         self.cur.close()
         self.disconnetToDb()
-        return(ret_data)
+        return(self.encoder.take_lines())
 
     def _buildQuery(self,time1, time2, monisoft_id):
         return(" SELECT * FROM "+Monisoft.TABLE_HISTORY+" WHERE "+Monisoft.COLUMN_TIME+" > "+str(time1)+" AND  "+Monisoft.COLUMN_TIME+" < "+str(time2)+" AND "+Monisoft.COLUMN_ID+" = "+str(monisoft_id)+";")
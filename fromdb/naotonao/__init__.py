@@ -0,0 +1,9 @@
+from ._checkpoints import ReplicationCheckpoints
+from ._replicator import ReplicationPair, ReplicationSummary, NaoToNaoReplicator
+
+__all__ = [
+    'ReplicationCheckpoints',
+    'ReplicationPair',
+    'ReplicationSummary',
+    'NaoToNaoReplicator'
+]
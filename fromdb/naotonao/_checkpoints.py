@@ -0,0 +1,94 @@
+import sqlite3
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+
+class ReplicationCheckpoints:
+    '''
+    Persists the replication progress of each series in a local SQLite file.
+
+    Every series is identified by a key (see ReplicationPair.key). The file
+    stores how far that series has been copied (synced_until) and how many
+    values were copied in total. The replication can therefore be stopped at
+    any time and resumes at the last confirmed window.
+    '''
+
+    def __init__(self, db_path: str) -> None:
+        '''
+        Opens the SQLite file and ensures the replication_state table exists.
+
+        Args:
+            db_path (str): Path to the local SQLite file.
+        '''
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = Lock()
+        self._initTable()
+
+    def _initTable(self) -> None:
+        '''
+        Creates the replication_state table if it doesn't already exist.
+        '''
+        with self._lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS replication_state (
+                    series_key TEXT PRIMARY KEY,
+                    synced_until TEXT NOT NULL,
+                    copied INTEGER NOT NULL DEFAULT 0,
+                    updated TEXT NOT NULL
+                );
+            ''')
+            self.conn.commit()
+
+    def getCheckpoint(self, series_key: str) -> Optional[Tuple[datetime, int]]:
+        '''
+        Returns (synced_until, copied) for a series or None if it was never replicated.
+        '''
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT synced_until, copied FROM replication_state WHERE series_key = ?",
+                (series_key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0]), row[1]
+
+    def getAllCheckpoints(self) -> Dict[str, Tuple[datetime, int]]:
+        '''
+        Returns {series_key: (synced_until, copied)} for all series.
+        '''
+        with self._lock:
+            rows = self.conn.execute("SELECT series_key, synced_until, copied FROM replication_state").fetchall()
+        return {key: (datetime.fromisoformat(synced_until), copied) for key, synced_until, copied in rows}
+
+    def updateCheckpoint(self, series_key: str, synced_until: datetime, copied: int) -> None:
+        '''
+        Marks a series as copied up to synced_until and adds copied to its counter.
+
+        Args:
+            series_key (str): Key of the replicated series.
+            synced_until (datetime): End of the last window confirmed by the target.
+            copied (int): Number of values written in that window.
+        '''
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO replication_state (series_key, synced_until, copied, updated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(series_key) DO UPDATE SET
+                    synced_until = excluded.synced_until,
+                    copied = replication_state.copied + excluded.copied,
+                    updated = excluded.updated;
+            ''', (series_key, synced_until.isoformat(), copied, datetime.now().isoformat()))
+            self.conn.commit()
+
+    def resetCheckpoint(self, series_key: str) -> None:
+        '''
+        Removes the checkpoint so the series is copied again from the start.
+        '''
+        with self._lock:
+            self.conn.execute("DELETE FROM replication_state WHERE series_key = ?", (series_key,))
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,239 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from time import sleep
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.bulk import RateLimiter
+from naoconnect.nao.connection_pool import get_connection_pool
+from naoconnect.nao.raw_timeseries import split_time_range
+
+from ._checkpoints import ReplicationCheckpoints
+
+
+@dataclass(frozen=True)
+class ReplicationPair:
+    '''
+    One series to copy: source point on the source host and target point on the target host.
+    '''
+
+    source_asset_id: str
+    source_instance_id: str
+    source_series_id: str
+    target_asset_id: str
+    target_instance_id: str
+    target_series_id: str
+    factor: float = 1.0
+
+    @property
+    def key(self) -> str:
+        '''
+        Checkpoint key of the pair.
+        '''
+        return f"{self.source_instance_id}/{self.source_series_id}->{self.target_instance_id}/{self.target_series_id}"
+
+    @classmethod
+    def forInstance(
+        cls,
+        source_asset_id: str,
+        source_instance_id: str,
+        target_asset_id: str,
+        target_instance_id: str,
+        series_ids: Union[Iterable[str], Dict[str, str]],
+        factor: float = 1.0,
+    ) -> List["ReplicationPair"]:
+        '''
+        Builds the pairs for all series of an instance.
+
+        Args:
+            series_ids: List of series IDs that are identical on both hosts, or a
+                dict {source_series_id: target_series_id} if the IDs differ.
+        '''
+        mapping = series_ids if isinstance(series_ids, dict) else {series_id: series_id for series_id in series_ids}
+        return [
+            cls(source_asset_id, source_instance_id, source_series_id, target_asset_id, target_instance_id, target_series_id, factor)
+            for source_series_id, target_series_id in mapping.items()
+        ]
+
+
+@dataclass
+class ReplicationSummary:
+    '''
+    Result of NaoToNaoReplicator.replicate.
+    '''
+
+    series: int = 0
+    finished_series: int = 0
+    failed_series: int = 0
+    copied_values: int = 0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+class NaoToNaoReplicator:
+    '''
+    Copies raw timeseries from one NAO host to another.
+
+    Up to max_workers series are copied in parallel. Each series is read in
+    windows of the given length from the source via
+    NaoApp.getRawTimeseriesColumns, while the next window is already being
+    fetched. Every window is written as Telegraf lines to the target; only
+    after the target confirmed it, the checkpoint in the SQLite file moves on.
+    With lines_per_second the write side is paced across all series.
+    '''
+
+    DEFAULT_WINDOW = timedelta(days=7)
+    DEFAULT_MAX_WORKERS = 4
+    DEFAULT_SEND_ATTEMPTS = 3
+    DEFAULT_ERROR_SLEEP_SECOND = 10
+
+    def __init__(
+        self,
+        source: NaoApp,
+        target: NaoApp,
+        checkpoints: ReplicationCheckpoints,
+        window: timedelta = DEFAULT_WINDOW,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        lines_per_second: Optional[float] = None,
+        send_attempts: int = DEFAULT_SEND_ATTEMPTS,
+    ) -> None:
+        '''
+        Args:
+            source (NaoApp): Client of the host to read from.
+            target (NaoApp): Client of the host to write to.
+            checkpoints (ReplicationCheckpoints): Local progress per series.
+            window (timedelta): Length of one read/write window.
+            max_workers (int): Number of series copied in parallel.
+            lines_per_second (float): Optional upper limit for written lines per second.
+            send_attempts (int): Attempts per window; retries only resend unaccepted chunks.
+        '''
+        self.source = source
+        self.target = target
+        self.checkpoints = checkpoints
+        self.window = window
+        self.max_workers = max(1, max_workers)
+        self.limiter = RateLimiter(lines_per_second) if lines_per_second else None
+        self.send_attempts = max(1, send_attempts)
+        for nao in (source, target):
+            get_connection_pool(nao.auth[NaoApp.NAME_HOST], local=nao.local, pool_size=self.max_workers)
+
+    def replicate(
+        self,
+        pairs: List[ReplicationPair],
+        start: datetime,
+        stop: Optional[datetime] = None,
+        logfile: Optional[Callable[[str], None]] = None,
+    ) -> ReplicationSummary:
+        '''
+        Copies all pairs from start (or their checkpoint) to stop (default: now).
+
+        A failing series does not stop the others; its error is recorded in the
+        summary and the next run continues at its checkpoint.
+        '''
+        if stop is None:
+            stop = datetime.now(timezone.utc)
+        summary = ReplicationSummary(series=len(pairs))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as reader, ThreadPoolExecutor(max_workers=self.max_workers) as writer:
+            futures = [(pair, writer.submit(self.replicateSeries, pair, start, stop, reader)) for pair in pairs]
+            for pair, future in futures:
+                try:
+                    copied = future.result()
+                except Exception:
+                    summary.failed_series += 1
+                    summary.errors[pair.key] = str(sys.exc_info()[1])
+                    if logfile: logfile(f"{pair.key}: {sys.exc_info()}")
+                    continue
+                summary.finished_series += 1
+                summary.copied_values += copied
+                if logfile: logfile(f"{pair.key}: {copied} data copied")
+        return summary
+
+    def replicateSeries(
+        self,
+        pair: ReplicationPair,
+        start: datetime,
+        stop: datetime,
+        reader: Optional[ThreadPoolExecutor] = None,
+    ) -> int:
+        '''
+        Copies a single pair window by window and returns the number of copied values.
+
+        With a reader executor the next window is read while the current one is written.
+        '''
+        start, stop = self._toUtc(start), self._toUtc(stop)
+        # Grenzwerte zwischen zwei Fenstern nur einmal senden
+        floor_ns = self._toNs(start) - 1
+        checkpoint = self.checkpoints.getCheckpoint(pair.key)
+        if checkpoint is not None and self._toUtc(checkpoint[0]) >= start:
+            # der Wert am Checkpoint gehört zum bereits bestätigten Fenster
+            start = self._toUtc(checkpoint[0])
+            floor_ns = self._toNs(start)
+        windows = split_time_range(start, stop, self.window)
+        copied = 0
+        pending = self._submitRead(reader, pair, windows[0]) if windows else None
+        for idx, (_, window_stop) in enumerate(windows):
+            times, values = pending.result()
+            pending = self._submitRead(reader, pair, windows[idx+1]) if idx+1 < len(windows) else None
+            keep = times > floor_ns
+            times, values = times[keep], values[keep]
+            if len(times):
+                self._writeWindow(pair, times, values)
+                floor_ns = int(times[-1])
+            self.checkpoints.updateCheckpoint(pair.key, window_stop, len(times))
+            copied += len(times)
+        return copied
+
+    def _submitRead(self, reader: Optional[ThreadPoolExecutor], pair: ReplicationPair, window: Tuple[datetime, datetime]):
+        if reader is not None:
+            return reader.submit(self._readWindow, pair, *window)
+        return _DoneFuture(self._readWindow(pair, *window))
+
+    def _readWindow(self, pair: ReplicationPair, start: datetime, stop: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        point = {
+            "id": pair.source_series_id,
+            "asset": pair.source_asset_id,
+            "instance": pair.source_instance_id,
+            "series": pair.source_series_id,
+        }
+        columns = self.source.getRawTimeseriesColumns([point], start, stop, window=stop-start, max_workers=1, factor=pair.factor)
+        return columns.get(pair.source_series_id, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+
+    def _writeWindow(self, pair: ReplicationPair, times: np.ndarray, values: np.ndarray) -> None:
+        prefix = f"{pair.target_asset_id},instance={pair.target_instance_id} {pair.target_series_id}="
+        lines = [f"{prefix}{value} {timestamp}" for value, timestamp in zip(values.tolist(), times.tolist())]
+        if self.limiter:
+            self.limiter.wait(len(lines))
+        result = self.target.sendTelegrafDataResumable(lines)
+        for _ in range(1, self.send_attempts):
+            if result.ok:
+                break
+            sleep(NaoToNaoReplicator.DEFAULT_ERROR_SLEEP_SECOND)
+            self.target.resumeTelegrafData(result)
+        if not result.ok:
+            raise ConnectionError(f"Statuscode from NAO {result.status}, {result.accepted_count}/{len(lines)} accepted") from result.error
+
+    @staticmethod
+    def _toUtc(timestamp: datetime) -> datetime:
+        '''
+        Naive timestamps are taken as UTC, aware ones are converted to UTC.
+        '''
+        if timestamp.tzinfo is None:
+            return timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.astimezone(timezone.utc)
+
+    @staticmethod
+    def _toNs(timestamp: datetime) -> int:
+        timestamp = NaoToNaoReplicator._toUtc(timestamp)
+        return int(timestamp.timestamp()) * 1000000000 + timestamp.microsecond * 1000
+
+
+class _DoneFuture:
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def result(self):
+        return self.value
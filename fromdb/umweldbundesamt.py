@@ -8,6 +8,7 @@ from copy import copy
 from naoconnect.TinyDb import TinyDb
 from datetime import datetime
 from naoconnect.Param import Param
+from naoconnect.nao.encoder import TelegrafEncoder
 
 class UmweldbundesamtV2 (Param):
     STATION = "station"
@@ -31,6 +32,7 @@ class UmweldbundesamtV2 (Param):
         self.db = TinyDb(tiny_db_name)
         self.transfere = self._getTransferChannels()
         self.confirm_time = time()
+        self.encoder = TelegrafEncoder()
         self.lasttimestamps = self._getLastTimestamps()
         self.marker_timestamps = None
         self.headers = {}
@@ -41,8 +43,8 @@ class UmweldbundesamtV2 (Param):
         ''' [ '<twin>,instance=<insatance>, <measurement>=<value> <timestamp>' ] '''
         print("getTelegrafData")
         self.marker_timestamps = copy(self.lasttimestamps)
-        data = []
-        data_add = data.append
+        self.encoder.take() # Reste eines abgebrochenen Aufrufs verwerfen
+        data_add = self.encoder.add_many
         count = 0
         for index in range(len(self.transfere)):
             try:
@@ -88,19 +90,19 @@ class UmweldbundesamtV2 (Param):
             if timeout:
                 continue
             self.marker_timestamps[str(index+1)] = max(self.isotimeToTimestamp(list(history[UmweldbundesamtV2.DATA][str(self.transfere[index][UmweldbundesamtV2.STATION])].keys())))
-            for time_key in history[UmweldbundesamtV2.DATA][str(self.transfere[index][UmweldbundesamtV2.STATION])]:
-                if history[UmweldbundesamtV2.DATA][str(self.transfere[index][UmweldbundesamtV2.STATION])][time_key][UmweldbundesamtV2.INDEX_VALUE] != None:
-                    count += 1
-                    data_add(UmweldbundesamtV2.FORMAT_TELEGRAFFRAMESTRUCT % (
-                        self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][0], 
-                        self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][1],
-                        self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][2],
-                        history[UmweldbundesamtV2.DATA][str(self.transfere[index][UmweldbundesamtV2.STATION])][time_key][UmweldbundesamtV2.INDEX_VALUE], 
-                        self.isotimeToTimestamp(time_key)*UmweldbundesamtV2.SECTONANO
-                    ))
+            station_data = history[UmweldbundesamtV2.DATA][str(self.transfere[index][UmweldbundesamtV2.STATION])]
+            count += data_add(
+                self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][0], 
+                self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][1],
+                self.transfere[index][UmweldbundesamtV2.NAME_TELEGRAF][2],
+                (
+                    (station_data[time_key][UmweldbundesamtV2.INDEX_VALUE], self.isotimeToTimestamp(time_key)*UmweldbundesamtV2.SECTONANO)
+                    for time_key in station_data if station_data[time_key][UmweldbundesamtV2.INDEX_VALUE] != None
+                )
+            )
             if count >= max_data_len: break
         self._disconnect()
-        return(data) 
+        return(self.encoder.take_lines()) 
 
     def isotimeToTimestamp(self, isotime):
         '''list or string'''
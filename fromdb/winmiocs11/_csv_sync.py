@@ -13,6 +13,8 @@ from typing import Any
 
 import pandas as pd
 
+from naoconnect.nao.coalesce import coalesce_lines
+
 
 CSV_ENCODING = "ISO-8859-1"
 CSV_DELIMITER = ";"
@@ -1097,6 +1099,7 @@ def sync_csv_series_from_schneid(
     legacy_sync_status_path: str | None = None,
     wrong_units: dict[str, dict[str, float]] | None = None,
     default_start_time: datetime = datetime(2010, 1, 1),
+    coalesce: bool = True,
 ) -> CsvSyncSummary:
     """
     Fuehrt den neuen CSV-Zeitreihensync fuer Schneid/Winmiocs11 aus.
@@ -1107,6 +1110,9 @@ def sync_csv_series_from_schneid(
     3. SQLite-Sync-Stand initialisieren bzw. einmalig aus altem JSON migrieren
     4. unbekannte Sensoren ueber die alte Grenzlogik freischalten
     5. Rohdaten inkrementell im Telegraf-Format an NAO senden
+
+    Mit `coalesce` werden die Sensoren eines Targets mit gleichem Zeitstempel
+    vor dem Senden zu einer Mehrfeld-Zeile zusammengefasst.
     """
     summary = CsvSyncSummary()
     wrong_units = wrong_units or {}
@@ -1224,7 +1230,7 @@ def sync_csv_series_from_schneid(
 
                 if payload_for_file:
                     status = nao_connect.sendTelegrafData(
-                        payload=payload_for_file,
+                        payload=coalesce_lines(payload_for_file) if coalesce else payload_for_file,
                         values_count=len(payload_for_file),
                     )
                     if status != 204:
@@ -61,6 +61,7 @@ class SyncSummary:
     changed_items: int = 0
     synced_items: int = 0
     skipped_controller_ids: int = 0
+    failed_items: int = 0
 
 
 @dataclass
@@ -708,6 +709,8 @@ def sync_station_metadata_from_postgres(
     summary = SyncSummary()
     stations_by_controller = _normalize_stations_nao(stations_nao)
     postgres_metadata, local_note_state = build_postgres_metadata(postgres)
+    meta_items = []
+    history_items = []
 
     for controller_id, metadata in postgres_metadata.items():
         summary.checked_controller_ids += 1
@@ -729,12 +732,9 @@ def sync_station_metadata_from_postgres(
                 if _canonical_note_history(postgres_history) == _canonical_note_history(nao_history):
                     continue
                 summary.changed_items += 1
-                nao_connect.patchInstanceMetaHistory(
-                    instance_id=instance_id,
-                    meta_id=meta_id,
-                    history=[{"start": item["start"], "value": item["value"]} for item in postgres_history],
+                history_items.append(
+                    (instance_id, meta_id, [{"start": item["start"], "value": item["value"]} for item in postgres_history])
                 )
-                summary.synced_items += 1
                 continue
 
             postgres_scalar = _normalize_scalar(postgres_value)
@@ -745,16 +745,25 @@ def sync_station_metadata_from_postgres(
                 continue
 
             summary.changed_items += 1
-            nao_connect.patchInstanceMeta(
-                instance_id=instance_id,
-                meta_id=meta_id,
-                value=postgres_scalar,
-            )
-            summary.synced_items += 1
+            meta_items.append((instance_id, meta_id, postgres_scalar))
 
         if str(controller_id) in local_note_state:
             meta_sync_info["notes"][str(controller_id)] = local_note_state[str(controller_id)]
 
+    # Alle Änderungen gebündelt und parallel an NAO senden statt einzeln nacheinander.
+    # Abgelehnte Patches zählen als failed_items, Ausnahmen werden wie zuvor weitergereicht.
+    outcomes = nao_connect.patchInstanceMetaMany(meta_items) + nao_connect.patchInstanceMetaHistoryMany(history_items)
+    errors = []
+    for outcome in outcomes:
+        if outcome.ok:
+            summary.synced_items += 1
+        elif outcome.error is not None:
+            errors.append(outcome.error)
+        else:
+            summary.failed_items += 1
+    if errors:
+        raise errors[0]
+
     return summary
 
 
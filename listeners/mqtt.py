@@ -1,6 +1,8 @@
 from http import client
 from naoconnect.TinyDb import TinyDb
 from naoconnect.Param import Param, Labling
+from naoconnect.nao.encoder import TelegrafEncoder
+from naoconnect.nao.ring_buffer import DROP_OLDEST, TelegrafRingBuffer
 from datetime import datetime, timezone
 from time import sleep, time
 from json import loads
@@ -11,7 +13,7 @@ import paho.mqtt.subscribe as subscribe
 class Mqtt(Param):
     SECTONANO = 1000000000
 
-    def __init__ (self, broker, tiny_db_name="mqtt.json", error_log=False, start_on_init=True, password="", username="", value_name=False, timestamp_name=False):
+    def __init__ (self, broker, tiny_db_name="mqtt.json", error_log=False, start_on_init=True, password="", username="", value_name=False, timestamp_name=False, max_buffer_bytes=TelegrafRingBuffer.DEFAULT_MAX_BYTES, drop=DROP_OLDEST):
         self.password = password
         self.username = username
         self.value_name = value_name
@@ -23,20 +25,14 @@ class Mqtt(Param):
         self.Client.on_disconnect = self.__on_disconnect
         self.broker = broker
         self.transfere = self._getTransferChannels()
-        self.data = []
-        self.add_data = self.data.append
+        # begrenzt, damit der Speicher nicht wächst, solange NAO nicht erreichbar ist (encoder.stats())
+        self.encoder = TelegrafEncoder(max_bytes=max_buffer_bytes, drop=drop)
         self.error_log=error_log
-        self.stop_add_data = False
         if start_on_init:
             self.startListenersFromConf()
 
     def getTelegrafData(self):
-        self.stop_add_data = True
-        data = self.data
-        self.data = []
-        self.stop_add_data = False
-        self.add_data = self.data.append
-        return(data)
+        return(self.encoder.take_lines())
 
     def refreshConnection(self):
         self.print("refresh mqtt")
@@ -79,7 +75,6 @@ class Mqtt(Param):
 
     def __on_message(self, client, userdata, msg):
         try:
-            while self.stop_add_data: sleep(1)
             if not self.value_name:
                 value = float(msg.payload)
                 timestamp = int(round(datetime.timestamp(datetime.utcnow()),0)*Mqtt.SECTONANO)
@@ -87,13 +82,13 @@ class Mqtt(Param):
                 payload = loads(msg.payload)
                 value = payload[self.value_name]
                 timestamp = int(datetime.fromisoformat(payload[self.timestamp_name]).timestamp()*Mqtt.SECTONANO)
-            self.add_data(Mqtt.FORMAT_TELEGRAFFRAMESTRUCT % (
+            self.encoder.add(
                     self.transfere[msg.topic][0], 
                     self.transfere[msg.topic][1], 
                     self.transfere[msg.topic][2],
                     value,
                     timestamp
-            ))
+            )
         except Exception as e:
             self.print(str(e))
             self.refreshConnection()
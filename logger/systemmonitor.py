@@ -5,6 +5,8 @@ from threading import Lock
 from collections import deque
 from typing import Optional
 
+from naoconnect.nao.encoder import TelegrafEncoder
+
 
 class ReturnInterface:
     def __init__(self, avg_cpu_percent: float, avg_ram_percent: float,
@@ -159,7 +161,7 @@ class Logger:
             disk2_path=disk2_path
         )
 
-        self.telegraf_frame = []
+        self.encoder = TelegrafEncoder()
         self._lock = Lock()
         self._stop_event = Event()
         self._thread = Thread(target=self._logLoop, args=(), daemon=True)
@@ -175,42 +177,34 @@ class Logger:
                 data = self.System.getAll()
                 timestamp = int(time.time() * 1e9)
 
-                line_parts = []
+                fields = []
                 if self.labling.avg_cpu_percent_id:
-                    line_parts.append(f"{self.labling.avg_cpu_percent_id}={data.avg_cpu_percent}")
+                    fields.append((self.labling.avg_cpu_percent_id, data.avg_cpu_percent))
                 if self.labling.avg_ram_percent_id:
-                    line_parts.append(f"{self.labling.avg_ram_percent_id}={data.avg_ram_percent}")
+                    fields.append((self.labling.avg_ram_percent_id, data.avg_ram_percent))
                 if self.labling.free_disk_gb_id:
-                    line_parts.append(f"{self.labling.free_disk_gb_id}={data.free_disk_gb}")
+                    fields.append((self.labling.free_disk_gb_id, data.free_disk_gb))
                 if self.labling.disk_usage_percent_id:
-                    line_parts.append(f"{self.labling.disk_usage_percent_id}={data.disk_usage_percent}")
+                    fields.append((self.labling.disk_usage_percent_id, data.disk_usage_percent))
                 if self.labling.disk_usage_absolute_id:
-                    line_parts.append(f"{self.labling.disk_usage_absolute_id}={data.disk_usage_absolute_gb}")
+                    fields.append((self.labling.disk_usage_absolute_id, data.disk_usage_absolute_gb))
                 if self.labling.max_cpu_percent_id:
-                    line_parts.append(f"{self.labling.max_cpu_percent_id}={data.max_cpu_percent}")
+                    fields.append((self.labling.max_cpu_percent_id, data.max_cpu_percent))
                 if self.labling.avg_net_rx_kbps_id and data.avg_net_rx_kbps is not None:
-                    line_parts.append(f"{self.labling.avg_net_rx_kbps_id}={data.avg_net_rx_kbps}")
+                    fields.append((self.labling.avg_net_rx_kbps_id, data.avg_net_rx_kbps))
                 if self.labling.avg_net_tx_kbps_id and data.avg_net_tx_kbps is not None:
-                    line_parts.append(f"{self.labling.avg_net_tx_kbps_id}={data.avg_net_tx_kbps}")
+                    fields.append((self.labling.avg_net_tx_kbps_id, data.avg_net_tx_kbps))
                 if self.labling.disk2_free_gb_id and data.disk2_free_gb is not None:
-                    line_parts.append(f"{self.labling.disk2_free_gb_id}={data.disk2_free_gb}")
+                    fields.append((self.labling.disk2_free_gb_id, data.disk2_free_gb))
                 if self.labling.disk2_usage_percent_id and data.disk2_usage_percent is not None:
-                    line_parts.append(f"{self.labling.disk2_usage_percent_id}={data.disk2_usage_percent}")
+                    fields.append((self.labling.disk2_usage_percent_id, data.disk2_usage_percent))
                 if self.labling.disk2_usage_absolute_id and data.disk2_usage_absolute_gb is not None:
-                    line_parts.append(f"{self.labling.disk2_usage_absolute_id}={data.disk2_usage_absolute_gb}")
-                if line_parts:
-                    line = (
-                        f"{self.labling.asset_id},instance={self.labling.instance_id} "
-                        + ",".join(line_parts)
-                        + f" {timestamp}"
-                    )
-                    self.telegraf_frame.append(line)
+                    fields.append((self.labling.disk2_usage_absolute_id, data.disk2_usage_absolute_gb))
+                self.encoder.add_fields(self.labling.asset_id, self.labling.instance_id, fields, timestamp)
 
     def getAndClearFrame(self):
         with self._lock:
-            frame_copy = self.telegraf_frame.copy()
-            self.telegraf_frame.clear()
-        return frame_copy
+            return self.encoder.take_lines()
 
     def stop(self):
         self._stop_event.set()
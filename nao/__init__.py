@@ -1,12 +1,61 @@
-
 from .asset_creator import NaoAssetCreator
 from .asset_creator import NaoAssetCreatorError
 from .instance_creator import NaoInstanceCreator
 from .api_reader import readNaoApi
+from .connection_pool import NaoConnectionPool
+from .connection_pool import NaoConnectionPoolError
+from .connection_pool import get_connection_pool
+from .async_connection_pool import AsyncNaoConnectionPool
+from .congestion import TelegrafCongestionControl
+from .token_manager import NaoLoginError
+from .token_manager import NaoTokenManager
+from .token_manager import get_token_manager
+from .telegraf import TelegrafSendResult
+from .telegraf import TelegrafSendError
+from .encoder import TelegrafEncoder
+from .metadata_cache import NaoMetadataCache
+from .query_cache import NaoQueryCache
+from .dedup import TelegrafDedupWindow
+from .coalesce import coalesce_lines
+from .spool import TelegrafSpool
+from .ring_buffer import TelegrafRingBuffer
+from .memory_governor import TelegrafMemoryGovernor
+from .memory_governor import get_memory_governor
+from .priority import TelegrafPriorityScheduler
+from .bulk import BulkOutcome
+from .bulk import RateLimiter
+from .bulk import run_bulk
+from .gap_audit import BackfillJob
+from .gap_audit import BackfillQueue
 
 __all__ = [
     "NaoAssetCreator",
     "NaoAssetCreatorError",
     "NaoInstanceCreator",
-    "readNaoApi"
+    "readNaoApi",
+    "NaoConnectionPool",
+    "NaoConnectionPoolError",
+    "get_connection_pool",
+    "AsyncNaoConnectionPool",
+    "TelegrafCongestionControl",
+    "NaoLoginError",
+    "NaoTokenManager",
+    "get_token_manager",
+    "TelegrafSendResult",
+    "TelegrafSendError",
+    "TelegrafEncoder",
+    "NaoMetadataCache",
+    "NaoQueryCache",
+    "TelegrafDedupWindow",
+    "coalesce_lines",
+    "TelegrafSpool",
+    "TelegrafRingBuffer",
+    "TelegrafMemoryGovernor",
+    "get_memory_governor",
+    "TelegrafPriorityScheduler",
+    "BulkOutcome",
+    "RateLimiter",
+    "run_bulk",
+    "BackfillJob",
+    "BackfillQueue",
 ]
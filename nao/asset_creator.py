@@ -8,12 +8,13 @@ einzeln oder über die High-Level-Funktion ``create_asset_template`` genutzt
 werden können.
 """
 
-import http.client
 from copy import copy
 from json import dumps, loads
 from time import sleep
 from typing import Dict, List, Optional
-from urllib.parse import quote
+
+from .connection_pool import get_connection_pool
+from .token_manager import NaoLoginError, get_token_manager
 
 
 class NaoAssetCreatorError(RuntimeError):
@@ -45,6 +46,9 @@ class NaoAssetCreator(object):
             verwendet. Standardmäßig wird HTTPS genutzt.
         timeout:
             Timeout pro HTTP-Anfrage in Sekunden.
+        pool_size:
+            Anzahl der Keep-Alive-Verbindungen im prozessweit geteilten
+            Verbindungspool für diesen Host.
     """
 
     URL_LOGIN = "/api/user/auth/login"
@@ -91,15 +95,14 @@ class NaoAssetCreator(object):
         password: str,
         local: bool = False,
         timeout: int = 120,
+        pool_size: Optional[int] = None,
     ) -> None:
         self.host = host
         self.local = local
         self.timeout = timeout
+        self._pool = get_connection_pool(host, local=local, pool_size=pool_size)
+        self._tokens = get_token_manager(host, email, password, local=local)
         self.headers = {"Authorization": "","Content-Type": "text/plain","Cookie": "" }
-        self._login_payload = "email=%s&password=%s" % (
-            quote(email),
-            quote(password),
-        )
 
     def list_assets(self, **filters) -> dict:
         """
@@ -732,87 +735,40 @@ class NaoAssetCreator(object):
             query_parts.append("%s=%s" % (key, value))
         return self.QUERY_GET + ",".join(query_parts)
 
-    def _connect(self):
-        if self.local:
-            return http.client.HTTPConnection(self.host, timeout=self.timeout)
-        return http.client.HTTPSConnection(self.host, timeout=self.timeout)
-
     def _login(self) -> None:
-        connection = self._connect()
-        try:
-            connection.request(
-                self.METHOD_POST,
-                self.URL_LOGIN,
-                self._login_payload,
-                self.LOGIN_HEADERS,
-            )
-            response = connection.getresponse()
-            raw_data = response.read()
-        except Exception as exc:
-            connection.close()
-            raise NaoAssetCreatorError("Login zu NAO fehlgeschlagen: %s" % exc)
-        finally:
-            try:
-                connection.close()
-            except Exception:
-                pass
-
-        if response.status >= 400:
-            raise NaoAssetCreatorError(
-                "Login zu NAO fehlgeschlagen: HTTP %s - %s"
-                % (response.status, raw_data.decode(self.NAME_UTF8, errors="replace"))
-            )
+        """
+        Übernimmt das Token aus dem prozessweiten Token-Cache. Ein echter
+        Login findet nur statt, wenn kein gültiges Token vorliegt.
+        """
 
         try:
-            data = loads(raw_data.decode(self.NAME_UTF8))
-        except Exception as exc:
-            raise NaoAssetCreatorError(
-                "Login-Antwort konnte nicht gelesen werden: %s" % exc
-            )
-
-        token = data.get(self.NAME_ACCESS_TOKEN)
-        if not token:
-            raise NaoAssetCreatorError(
-                "Login erfolgreich, aber kein Zugriffstoken erhalten: %r" % (data,)
-            )
-        self.headers[self.NAME_AUTHORIZATION] = self.QUERY_BEARER + token
+            self.headers[self.NAME_AUTHORIZATION] = self._tokens.authorization()
+        except NaoLoginError as exc:
+            raise NaoAssetCreatorError(str(exc))
 
     def _request_json(self, method: str, url: str, payload: Optional[dict] = None):
-        if not self.headers.get(self.NAME_AUTHORIZATION):
-            self._login()
-
         encoded_payload = dumps(payload) if payload is not None else None
         last_error = None
 
         for attempt in range(2):
-            connection = self._connect()
+            self._login()
             try:
                 headers = copy(self.headers)
                 headers[self.NAME_CONTENT_TYPE] = self.JSON_CONTENT_TYPE
-                connection.request(method, url, encoded_payload, headers)
-                response = connection.getresponse()
-                raw_data = response.read()
+                response, raw_data = self._pool.request(
+                    method, url, encoded_payload, headers, timeout=self.timeout
+                )
             except Exception as exc:
                 last_error = exc
-                try:
-                    connection.close()
-                except Exception:
-                    pass
                 if attempt == 0:
                     sleep(0.2)
-                    self._login()
                     continue
                 raise NaoAssetCreatorError(
                     "NAO-Anfrage %s %s fehlgeschlagen: %s" % (method, url, exc)
                 )
-            finally:
-                try:
-                    connection.close()
-                except Exception:
-                    pass
 
             if response.status in (401, 403) and attempt == 0:
-                self._login()
+                self._tokens.invalidate(headers[self.NAME_AUTHORIZATION])
                 continue
 
             if response.status >= 400:
@@ -0,0 +1,245 @@
+"""
+Asyncio-Gegenstück zu ``NaoConnectionPool``.
+
+Der Pool spricht HTTP/1.1 direkt über ``asyncio``-Streams, damit der
+asynchrone NAO-Client ohne zusätzliche Abhängigkeiten auskommt. Er deckt
+genau das ab, was die NAO-API benötigt: Keep-Alive, ``Content-Length`` und
+``Transfer-Encoding: chunked`` in Antworten sowie HTTPS über ``ssl``.
+"""
+
+import asyncio
+import ssl
+from time import monotonic
+from typing import List, Optional, Tuple
+
+
+class AsyncHTTPResponse(object):
+    """Vollständig gelesene Antwort mit derselben Schnittstelle wie ``http.client``."""
+
+    def __init__(self, status: int, reason: str, headers: dict, will_close: bool) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.will_close = will_close
+
+    def getheader(self, name: str, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class _AsyncConnection(object):
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.released_at = monotonic()
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class AsyncNaoConnectionPool(object):
+    """
+    Keep-Alive-Pool für genau einen Host und eine Event-Loop.
+
+    ``pool_size`` begrenzt zugleich die Anzahl paralleler Anfragen; weitere
+    Anfragen warten, bis eine Verbindung frei wird.
+    """
+
+    DEFAULT_POOL_SIZE = 16
+    DEFAULT_MAX_IDLE = 50.0
+    DEFAULT_TIMEOUT = 120
+    HTTP_VERSION = "HTTP/1.1"
+    LINE_END = b"\r\n"
+    STALE_CONNECTION_ERRORS = (
+        asyncio.IncompleteReadError,
+        ConnectionResetError,
+        ConnectionAbortedError,
+        BrokenPipeError,
+    )
+
+    def __init__(
+        self,
+        host: str,
+        local: bool = False,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_idle: float = DEFAULT_MAX_IDLE,
+    ) -> None:
+        if pool_size < 1:
+            raise ValueError("pool_size muss mindestens 1 sein.")
+        self.host = host
+        self.local = local
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self._address, self._port = self._split_host(host, local)
+        self._idle: List[_AsyncConnection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self._ssl_context = None if local else ssl.create_default_context()
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        body=None,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[AsyncHTTPResponse, bytes]:
+        """
+        Führt eine Anfrage aus und liefert ``(response, data)``.
+
+        Wie beim synchronen Pool wird eine Anfrage auf einer
+        wiederverwendeten, inzwischen vom Server geschlossenen Verbindung
+        einmal über eine neue Verbindung wiederholt. Ein Iterable von
+        ``bytes`` als ``body`` wird mit ``Transfer-Encoding: chunked``
+        gesendet.
+        """
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        replayable = body is None or isinstance(body, (bytes, bytearray)) or iter(body) is not body
+        timeout = self.timeout if timeout is None else timeout
+        async with self._slots:
+            for attempt in range(2):
+                connection, reused = await self._acquire()
+                try:
+                    response, data = await asyncio.wait_for(
+                        self._exchange(connection, method, url, body, headers or {}),
+                        timeout,
+                    )
+                except self.STALE_CONNECTION_ERRORS:
+                    connection.close()
+                    if reused and replayable and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    connection.released_at = monotonic()
+                    self._idle.append(connection)
+                return response, data
+        raise ConnectionError("Anfrage %s %s fehlgeschlagen." % (method, url))
+
+    async def close(self) -> None:
+        """Schließt alle Verbindungen im Leerlauf."""
+
+        idle = self._idle
+        self._idle = []
+        for connection in idle:
+            connection.close()
+        for connection in idle:
+            try:
+                await connection.writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _acquire(self) -> Tuple[_AsyncConnection, bool]:
+        while self._idle:
+            connection = self._idle.pop()
+            if (
+                monotonic() - connection.released_at <= self.max_idle
+                and not connection.reader.at_eof()
+                and not connection.writer.is_closing()
+            ):
+                return connection, True
+            connection.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self._address,
+                self._port,
+                ssl=self._ssl_context,
+                server_hostname=None if self.local else self._address,
+            ),
+            self.timeout,
+        )
+        return _AsyncConnection(reader, writer), False
+
+    async def _exchange(
+        self,
+        connection: _AsyncConnection,
+        method: str,
+        url: str,
+        body,
+        headers: dict,
+    ) -> Tuple[AsyncHTTPResponse, bytes]:
+        lines = ["%s %s %s" % (method, url, self.HTTP_VERSION), "Host: %s" % self.host]
+        names = set()
+        for name, value in headers.items():
+            lines.append("%s: %s" % (name, value))
+            names.add(name.lower())
+        chunked = body is not None and not isinstance(body, (bytes, bytearray))
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        elif "content-length" not in names and (body is not None or method in ("POST", "PUT", "PATCH")):
+            lines.append("Content-Length: %d" % (len(body) if body else 0))
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        if chunked:
+            connection.writer.write(head)
+            for block in body:
+                if block:
+                    connection.writer.write(b"%x\r\n%s\r\n" % (len(block), block))
+                    await connection.writer.drain()
+            connection.writer.write(b"0\r\n\r\n")
+        else:
+            connection.writer.write(head + body if body else head)
+        await connection.writer.drain()
+        return await self._read_response(connection.reader, method)
+
+    async def _read_response(
+        self,
+        reader: asyncio.StreamReader,
+        method: str,
+    ) -> Tuple[AsyncHTTPResponse, bytes]:
+        status_line = await reader.readuntil(self.LINE_END)
+        parts = status_line.decode("latin-1").strip().split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ConnectionError("Ungültige HTTP-Statuszeile: %r" % status_line)
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+        response_headers = {}
+        while True:
+            line = await reader.readuntil(self.LINE_END)
+            if line == self.LINE_END:
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        will_close = (
+            response_headers.get("connection", "").lower() == "close"
+            or parts[0] == "HTTP/1.0"
+        )
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            data = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked(reader)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            will_close = True
+        return AsyncHTTPResponse(status, reason, response_headers, will_close), data
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readuntil(self.LINE_END)
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                while await reader.readuntil(self.LINE_END) != self.LINE_END:
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(len(self.LINE_END))
+
+    @staticmethod
+    def _split_host(host: str, local: bool) -> Tuple[str, int]:
+        address, separator, port = host.rpartition(":")
+        if separator and address and port.isdigit():
+            return address.strip("[]"), int(port)
+        return host, 80 if local else 443
@@ -0,0 +1,88 @@
+"""
+Gebündelte Ausführung vieler kleiner NAO-Aufrufe.
+
+Meta-Synchronisationen patchen oft tausende Attribute einzeln und
+nacheinander. ``run_bulk`` führt solche Aufrufe mit begrenzter Parallelität
+und optionaler Ratenbegrenzung aus und liefert pro Eintrag ein
+``BulkOutcome`` in der Reihenfolge der Eingabe.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Iterable, List, Optional
+
+
+class BulkOutcome(object):
+    """Ergebnis eines einzelnen Eintrags von ``run_bulk``."""
+
+    __slots__ = ("item", "result", "error", "ok")
+
+    def __init__(self, item: Any, result: Any = None, error: Optional[BaseException] = None, ok: bool = False) -> None:
+        self.item = item
+        self.result = result
+        self.error = error
+        self.ok = ok
+
+    def __repr__(self) -> str:
+        return "BulkOutcome(item=%r, ok=%s, error=%r)" % (self.item, self.ok, self.error)
+
+
+class RateLimiter(object):
+    """
+    Thread-sicherer Takt: höchstens ``rate`` Aufrufe pro Sekunde, verteilt
+    über alle Threads. Mit ``wait(cost)`` zählt ein Aufruf ``cost``-fach,
+    z. B. als Anzahl gesendeter Zeilen.
+    """
+
+    def __init__(self, rate: float) -> None:
+        if rate <= 0:
+            raise ValueError("rate muss größer als 0 sein.")
+        self.interval = 1.0 / rate
+        self._next = monotonic()
+        self._lock = Lock()
+
+    def wait(self, cost: float = 1.0) -> None:
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval * cost
+        if start > now:
+            sleep(start - now)
+
+
+def run_bulk(
+    function: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 8,
+    rate_limit: Optional[float] = None,
+    is_ok: Optional[Callable[[Any], bool]] = None,
+) -> List[BulkOutcome]:
+    """
+    Führt ``function(item)`` für alle ``items`` aus.
+
+    Höchstens ``max_workers`` Aufrufe laufen gleichzeitig, mit
+    ``rate_limit`` starten höchstens so viele Aufrufe pro Sekunde.
+    Ausnahmen einzelner Einträge brechen den Lauf nicht ab, sondern landen in
+    ``BulkOutcome.error``. ``is_ok`` entscheidet anhand des Rückgabewerts, ob
+    ein Eintrag als erfolgreich gilt (Standard: keine Ausnahme).
+    """
+
+    if max_workers < 1:
+        raise ValueError("max_workers muss mindestens 1 sein.")
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    def run(item: Any) -> BulkOutcome:
+        if limiter:
+            limiter.wait()
+        try:
+            result = function(item)
+        except Exception as exc:
+            return BulkOutcome(item, error=exc)
+        return BulkOutcome(item, result=result, ok=is_ok(result) if is_ok else True)
+
+    items = list(items)
+    if max_workers == 1 or len(items) <= 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run, items))
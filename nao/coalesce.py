@@ -0,0 +1,96 @@
+"""
+Fasst Telegraf-Zeilen mit gleicher Messung, gleichen Tags und gleichem
+Zeitstempel zu einer Mehrfeld-Zeile zusammen.
+
+Die CSV-Synchronisationen (``SchneidTransferCsv``, winmiocs11), DesigoCC, DWD
+und OpenMuc erzeugen eine Zeile pro Sensor und Zeitstempel::
+
+    asset,instance=i s1=1.0 1700000000000000000
+    asset,instance=i s2=2.0 1700000000000000000
+
+``coalesce_lines`` gruppiert diese per Hash auf ``(Messung+Tags, Zeitstempel)``
+und liefert, wie ``AqotecJobExecutor.fetchAndFormat``, eine Zeile pro
+Station und Zeitpunkt::
+
+    asset,instance=i s1=1.0,s2=2.0 1700000000000000000
+
+Für NAO ist das gleichwertig; Zeilenanzahl und Parse-Aufwand sinken um die
+Anzahl der Sensoren pro Station. Die Reihenfolge innerhalb einer Reihe
+(Messung, Tags, Feld) bleibt erhalten. Bei doppeltem Feld zum selben
+Zeitstempel gilt wie in NAO der zuletzt gesendete Wert.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def coalesce_lines(lines: Iterable[str]) -> List[str]:
+    """
+    Mehrfeld-Zeilen aus ``lines``.
+
+    Steigen die Zeitstempel jeder Reihe monoton (der Normalfall: jeder Sensor
+    liefert seine Werte zeitlich sortiert), werden alle Zeilen eines
+    Zeitpunkts zusammengefasst und die Gruppen nach Zeitstempel sortiert
+    ausgegeben. Andernfalls wird eine Zeile nur dann in eine bestehende Gruppe
+    übernommen, wenn die Reihenfolge ihrer Reihe dadurch nicht verändert wird.
+    Zeilen ohne Zeitstempel oder mit String-Feldern bleiben unverändert.
+    """
+
+    parsed = [_parse(line) for line in lines if line]
+    groups: Dict[Tuple[str, str], Dict[str, str]] = {}
+    last: Dict[Tuple[str, str], int] = {}
+    ordered = True
+    for entry in parsed:
+        if entry[1] is None:
+            ordered = False
+            break
+        series, timestamp, fields = entry
+        timestamp_int = int(timestamp)
+        group = groups.get((series, timestamp))
+        if group is None:
+            group = groups[(series, timestamp)] = {}
+        for name, field in fields:
+            if last.get((series, name), timestamp_int) > timestamp_int:
+                ordered = False
+                break
+            last[(series, name)] = timestamp_int
+            group[name] = field
+        if not ordered:
+            break
+    if ordered:
+        keys = sorted(groups, key=lambda key: int(key[1]))
+        return ["%s %s %s" % (series, ",".join(groups[(series, timestamp)].values()), timestamp) for series, timestamp in keys]
+    return _coalesce_in_order(parsed)
+
+
+def _coalesce_in_order(parsed: List[tuple]) -> List[str]:
+    out: List[list] = []
+    index: Dict[Tuple[str, str], int] = {}
+    last: Dict[Tuple[str, str], int] = {}
+    for series, timestamp, fields in parsed:
+        if timestamp is None:
+            out.append([series, None, None])
+            continue
+        position = index.get((series, timestamp))
+        if position is None or any(last.get((series, name), -1) > position for name, _ in fields):
+            position = index[(series, timestamp)] = len(out)
+            out.append([series, timestamp, {}])
+        group = out[position][2]
+        for name, field in fields:
+            group[name] = field
+            last[(series, name)] = position
+    return [
+        series if timestamp is None else "%s %s %s" % (series, ",".join(group.values()), timestamp)
+        for series, timestamp, group in out
+    ]
+
+
+def _parse(line: str) -> Tuple[str, Optional[str], Optional[List[Tuple[str, str]]]]:
+    """``(Messung+Tags, Zeitstempel, [(feld, "feld=wert")])``, unverändert als ``(line, None, None)``."""
+
+    parts = line.strip().split(" ")
+    if len(parts) != 3 or not parts[2].isdigit() or '"' in parts[1]:
+        return (line.strip(), None, None)
+    series, fields, timestamp = parts
+    if "," not in fields:
+        return (series, timestamp, [(fields[:fields.find("=")], fields)])
+    return (series, timestamp, [(field[:field.find("=")], field) for field in fields.split(",")])
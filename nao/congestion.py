@@ -0,0 +1,184 @@
+"""
+AIMD-Staukontrolle für Telegraf-Uploads.
+
+Statt fester Blockgrößen (``STADARTD_DATA_PER_TELEGRAF`` bzw.
+``data_per_telegraf_push``) und linear wachsender Pausen passt
+``TelegrafCongestionControl`` Blockgröße und Anzahl paralleler Blöcke an
+die Antworten von NAO an:
+
+- Antwort 204 mit Latenz unter ``target_latency``: Blockgröße wächst
+  additiv um ``chunk_step``, nach einer vollen Runde erfolgreicher Blöcke
+  wächst das Fenster um eins.
+- 429, 5xx, Timeouts und Verbindungsabbrüche: Blockgröße und Fenster
+  werden multiplikativ verkleinert und weitere Uploads pausieren für
+  ``Retry-After`` bzw. einen exponentiell wachsenden Backoff.
+
+Eine Instanz kann von mehreren Clients geteilt werden und ist thread-sicher.
+"""
+
+import asyncio
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Lock
+from time import monotonic, sleep
+from typing import Optional
+
+
+class TelegrafCongestionControl(object):
+    """
+    Parameter:
+        chunk_size:
+            Startgröße eines Blocks in Zeilen.
+        min_chunk_size / max_chunk_size:
+            Grenzen der Blockgröße.
+        chunk_step:
+            Additive Vergrößerung pro erfolgreichem Block. Standard ist
+            ``min_chunk_size``.
+        max_window:
+            Höchstzahl gleichzeitig gesendeter Blöcke.
+        target_latency:
+            Antwortzeit in Sekunden, bis zu der die Verbindung als gesund gilt.
+        decrease_factor:
+            Faktor der multiplikativen Verkleinerung.
+        max_backoff:
+            Obergrenze der Pause nach Fehlern in Sekunden.
+    """
+
+    DEFAULT_CHUNK_SIZE = 10000
+    DEFAULT_MIN_CHUNK_SIZE = 1000
+    DEFAULT_MAX_CHUNK_SIZE = 50000
+    DEFAULT_MAX_WINDOW = 4
+    DEFAULT_TARGET_LATENCY = 2.0
+    DEFAULT_DECREASE_FACTOR = 0.5
+    DEFAULT_MAX_BACKOFF = 60.0
+    STATUS_GOOD = 204
+    STATUS_TOO_MANY_REQUESTS = 429
+    HEADER_RETRY_AFTER = "Retry-After"
+    CONGESTION_ERRORS = (TimeoutError, asyncio.TimeoutError, ConnectionError)
+
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE,
+        max_chunk_size: int = DEFAULT_MAX_CHUNK_SIZE,
+        chunk_step: Optional[int] = None,
+        max_window: int = DEFAULT_MAX_WINDOW,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+        decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ) -> None:
+        if not 0 < min_chunk_size <= chunk_size <= max_chunk_size:
+            raise ValueError("Es muss 0 < min_chunk_size <= chunk_size <= max_chunk_size gelten.")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor muss zwischen 0 und 1 liegen.")
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.chunk_step = chunk_step or min_chunk_size
+        self.max_window = max(1, max_window)
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.max_backoff = max_backoff
+        self._chunk_size = chunk_size
+        self._window = 1
+        self._successes = 0
+        self._backoff = 0.0
+        self._blocked_until = 0.0
+        self._last_decrease = float("-inf")
+        self._lock = Lock()
+
+    @property
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    def pause(self) -> float:
+        """Sekunden, die vor dem nächsten Upload noch gewartet werden muss."""
+
+        return max(0.0, self._blocked_until - monotonic())
+
+    def on_response(self, status: int, latency: float, retry_after: Optional[str] = None) -> None:
+        """Wertet die Antwort eines Uploads aus."""
+
+        if status == self.STATUS_TOO_MANY_REQUESTS or status >= 500:
+            self._decrease(retry_after)
+        elif status == self.STATUS_GOOD:
+            with self._lock:
+                self._backoff = 0.0
+                if latency > self.target_latency:
+                    return
+                self._chunk_size = min(self.max_chunk_size, self._chunk_size + self.chunk_step)
+                self._successes += 1
+                if self._successes >= self._window:
+                    self._successes = 0
+                    self._window = min(self.max_window, self._window + 1)
+
+    def on_error(self) -> None:
+        """Timeout oder Verbindungsabbruch während eines Uploads."""
+
+        self._decrease(None)
+
+    def send(self, request):
+        """
+        Führt ``request()`` unter Kontrolle aus: wartet eine laufende Pause
+        ab, misst die Latenz und meldet das Ergebnis zurück. ``request`` muss
+        ``(response, data)`` wie ``NaoConnectionPool.request`` liefern.
+        """
+
+        wait = self.pause()
+        if wait > 0:
+            sleep(wait)
+        start = monotonic()
+        try:
+            response, data = request()
+        except self.CONGESTION_ERRORS:
+            self.on_error()
+            raise
+        self.on_response(response.status, monotonic() - start, response.getheader(self.HEADER_RETRY_AFTER))
+        return response, data
+
+    async def send_async(self, request):
+        """Wie ``send``, für Koroutinen-Fabriken des asynchronen Pools."""
+
+        wait = self.pause()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        start = monotonic()
+        try:
+            response, data = await request()
+        except self.CONGESTION_ERRORS:
+            self.on_error()
+            raise
+        self.on_response(response.status, monotonic() - start, response.getheader(self.HEADER_RETRY_AFTER))
+        return response, data
+
+    def _decrease(self, retry_after: Optional[str]) -> None:
+        now = monotonic()
+        with self._lock:
+            self._successes = 0
+            # Parallel laufende Blöcke scheitern oft am selben Engpass. Pro
+            # Stauereignis wird deshalb nur einmal verkleinert.
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                self._chunk_size = max(self.min_chunk_size, int(self._chunk_size * self.decrease_factor))
+                self._window = max(1, int(self._window * self.decrease_factor))
+                self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+            wait = max(self._backoff, self._parse_retry_after(retry_after))
+            self._blocked_until = max(self._blocked_until, now + wait)
+
+    @staticmethod
+    def _parse_retry_after(retry_after: Optional[str]) -> float:
+        if not retry_after:
+            return 0.0
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return 0.0
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,244 @@
+"""
+Gemeinsamer Keep-Alive-Verbindungspool für die NAO-HTTP-Clients.
+
+Bisher hat jeder Client (``NaoApp``, ``naoappV2.NaoApp`` und
+``NaoAssetCreator``) nach jeder Anfrage seine Verbindung geschlossen. Damit
+kostet jeder Telegraf-Block und jeder Metadaten-Aufruf einen neuen TCP- und
+TLS-Handshake. Der Pool hält pro Host eine kleine Zahl warmer Verbindungen,
+prüft sie vor der Wiederverwendung und wird über ``get_connection_pool``
+von allen Clients eines Prozesses gemeinsam genutzt.
+"""
+
+import http.client
+import select
+from threading import Condition, Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple, Union
+
+
+HTTPConnectionType = Union[http.client.HTTPConnection, http.client.HTTPSConnection]
+
+
+class NaoConnectionPoolError(RuntimeError):
+    """Innerhalb des Timeouts war keine Verbindung aus dem Pool frei."""
+
+
+class NaoConnectionPool(object):
+    """
+    Thread-sicherer Pool von Keep-Alive-Verbindungen zu genau einem Host.
+
+    Parameter:
+        host:
+            Hostname der NAO-Instanz.
+        local:
+            Wenn ``True``, werden HTTP- statt HTTPS-Verbindungen aufgebaut.
+        timeout:
+            Standard-Timeout pro Anfrage in Sekunden.
+        pool_size:
+            Maximale Anzahl gleichzeitig genutzter und im Leerlauf
+            gehaltener Verbindungen.
+        max_idle:
+            Verbindungen, die länger als diese Zeit (Sekunden) ungenutzt
+            waren, werden verworfen statt wiederverwendet. Der Wert liegt
+            bewusst unter dem üblichen Keep-Alive-Timeout von Proxys.
+    """
+
+    DEFAULT_POOL_SIZE = 4
+    DEFAULT_MAX_IDLE = 50.0
+    DEFAULT_TIMEOUT = 120
+    STALE_CONNECTION_ERRORS = (
+        http.client.RemoteDisconnected,
+        http.client.CannotSendRequest,
+        ConnectionResetError,
+        ConnectionAbortedError,
+        BrokenPipeError,
+    )
+
+    def __init__(
+        self,
+        host: str,
+        local: bool = False,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_idle: float = DEFAULT_MAX_IDLE,
+    ) -> None:
+        if pool_size < 1:
+            raise ValueError("pool_size muss mindestens 1 sein.")
+        self.host = host
+        self.local = local
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self._idle: List[Tuple[HTTPConnectionType, float]] = []
+        self._in_use = 0
+        self._condition = Condition(Lock())
+
+    def resize(self, pool_size: int) -> None:
+        """Vergrößert oder verkleinert den Pool zur Laufzeit."""
+
+        if pool_size < 1:
+            raise ValueError("pool_size muss mindestens 1 sein.")
+        with self._condition:
+            self.pool_size = pool_size
+            while len(self._idle) > pool_size:
+                self._close(self._idle.pop(0)[0])
+            self._condition.notify_all()
+
+    def acquire(self, timeout: Optional[float] = None) -> HTTPConnectionType:
+        """
+        Gibt eine gesunde Leerlauf-Verbindung oder eine neue Verbindung
+        zurück. Sind bereits ``pool_size`` Verbindungen in Benutzung, wird
+        bis zu ``timeout`` Sekunden auf eine freie gewartet.
+        """
+
+        wait_timeout = self.timeout if timeout is None else timeout
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._in_use < self.pool_size, wait_timeout
+            ):
+                raise NaoConnectionPoolError(
+                    "Keine freie Verbindung zu %s im Pool (Größe %s)."
+                    % (self.host, self.pool_size)
+                )
+            self._in_use += 1
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if self._is_healthy(connection, released_at):
+                    return connection
+                self._close(connection)
+        return self._new_connection()
+
+    def release(self, connection: HTTPConnectionType, reusable: bool = True) -> None:
+        """
+        Gibt eine Verbindung an den Pool zurück. Nicht wiederverwendbare
+        Verbindungen (Fehler, ``Connection: close``) werden geschlossen.
+        """
+
+        with self._condition:
+            self._in_use -= 1
+            if (
+                reusable
+                and connection.sock is not None
+                and len(self._idle) < self.pool_size
+            ):
+                self._idle.append((connection, monotonic()))
+                connection = None
+            self._condition.notify()
+        if connection is not None:
+            self._close(connection)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body=None,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[http.client.HTTPResponse, bytes]:
+        """
+        Führt eine Anfrage über eine Pool-Verbindung aus und liest die
+        Antwort vollständig.
+
+        Schlägt eine wiederverwendete Verbindung fehl, weil der Server sie
+        inzwischen geschlossen hat, wird die Anfrage einmal über eine neue
+        Verbindung wiederholt. Rückgabe ist ``(response, data)``; Status und
+        Header bleiben über ``response`` lesbar.
+
+        ``body`` darf auch ein Iterable von ``bytes`` sein (z. B.
+        ``TelegrafStreamBody``); ``http.client`` sendet es dann mit
+        ``Transfer-Encoding: chunked``. Einmal-Iteratoren werden nach einem
+        Verbindungsfehler nicht wiederholt.
+        """
+
+        replayable = body is None or isinstance(body, (str, bytes, bytearray)) or iter(body) is not body
+        for attempt in range(2):
+            connection = self.acquire()
+            reused = connection.sock is not None
+            try:
+                self._apply_timeout(connection, timeout)
+                connection.request(method, url, body, headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except self.STALE_CONNECTION_ERRORS:
+                self.release(connection, reusable=False)
+                if reused and replayable and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self.release(connection, reusable=False)
+                raise
+            self.release(connection, reusable=not response.will_close)
+            return response, data
+        raise NaoConnectionPoolError("Anfrage %s %s fehlgeschlagen." % (method, url))
+
+    def close(self) -> None:
+        """Schließt alle Verbindungen im Leerlauf."""
+
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def _new_connection(self) -> HTTPConnectionType:
+        if self.local:
+            return http.client.HTTPConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+
+    def _apply_timeout(self, connection: HTTPConnectionType, timeout: Optional[float]) -> None:
+        timeout = self.timeout if timeout is None else timeout
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+    def _is_healthy(self, connection: HTTPConnectionType, released_at: float) -> bool:
+        if monotonic() - released_at > self.max_idle:
+            return False
+        if connection.sock is None:
+            return False
+        try:
+            # Eine ruhende Keep-Alive-Verbindung darf nichts zu lesen haben.
+            # Ist sie lesbar, hat der Server sie geschlossen (FIN/RST).
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    @staticmethod
+    def _close(connection: HTTPConnectionType) -> None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_POOLS: Dict[Tuple[str, bool], NaoConnectionPool] = {}
+_POOLS_LOCK = Lock()
+
+
+def get_connection_pool(
+    host: str,
+    local: bool = False,
+    pool_size: Optional[int] = None,
+) -> NaoConnectionPool:
+    """
+    Liefert den prozessweit geteilten Pool für ``host``.
+
+    Alle Clients auf denselben Host erhalten dieselbe Instanz. Fordert ein
+    Client eine größere ``pool_size`` an als bisher konfiguriert, wird der
+    Pool entsprechend vergrößert; verkleinert wird er hier nie.
+    """
+
+    key = (host, bool(local))
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = NaoConnectionPool(
+                host,
+                local=local,
+                pool_size=pool_size or NaoConnectionPool.DEFAULT_POOL_SIZE,
+            )
+            _POOLS[key] = pool
+        elif pool_size and pool_size > pool.pool_size:
+            pool.resize(pool_size)
+        return pool
@@ -0,0 +1,163 @@
+"""
+Unterdrückt bereits angenommene Telegraf-Zeilen vor dem erneuten Senden.
+
+Nach einem Absturz oder Teilfehler senden ``SchneidTransferCsv``,
+``AqotecTransferV2`` und die winmiocs11-CSV-Synchronisation überlappende
+Zeiträume erneut, weil ihre Wasserstände erst nach einem erfolgreichen Zyklus
+gespeichert werden. ``TelegrafDedupWindow`` merkt sich für ein begrenztes
+Zeitfenster die Schlüssel ``(Reihe, Instanz, Felder mit Werten, Zeitstempel)``
+der von NAO angenommenen Zeilen und verwirft exakte Wiederholungen, bevor sie
+gesendet werden. Der Wert gehört zum Schlüssel: Eine korrigierte Zeile mit
+gleichem Zeitstempel wird gesendet, damit NAO den alten Punkt überschreibt.
+
+Die Schlüssel werden als 64-Bit-Hash gehalten und optional in einer
+SQLite-Datei gespeichert, damit auch ein Neustart nach einem Absturz davon
+profitiert.
+"""
+
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, List, Optional
+
+
+class TelegrafDedupWindow(object):
+    """
+    Parameter:
+        window:
+            Sekunden, die ein angenommener Schlüssel gemerkt wird.
+        max_entries:
+            Höchstzahl gemerkter Schlüssel; die ältesten fallen zuerst heraus.
+        path:
+            Optionale SQLite-Datei; ohne Pfad nur im Speicher.
+
+    Ablauf beim Senden: ``filter`` vor dem Upload, ``accept`` für die von NAO
+    bestätigten Zeilen. ``suppressed`` zählt alle verworfenen Zeilen.
+    """
+
+    DEFAULT_WINDOW = 6 * 3600.0
+    DEFAULT_MAX_ENTRIES = 200000
+
+    def __init__(
+        self,
+        window: float = DEFAULT_WINDOW,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        path: Optional[str] = None,
+    ) -> None:
+        self.window = window
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self.suppressed = 0
+        self.accepted = 0
+        self._keys: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS dedup_window (key INTEGER PRIMARY KEY, accepted_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM dedup_window WHERE accepted_at <= ?", (time() - self.window,))
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT key, accepted_at FROM dedup_window ORDER BY accepted_at DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            for key, accepted_at in reversed(rows):
+                self._keys[key] = accepted_at
+
+    @staticmethod
+    def key(line: str) -> Optional[int]:
+        """
+        Hash aus Messung mit Tags, Feldern mit Werten und Zeitstempel einer Zeile.
+
+        Zeilen ohne Zeitstempel (Serverzeit) liefern ``None`` und werden nie
+        unterdrückt.
+        """
+
+        head, _, timestamp = line.strip().rpartition(" ")
+        series, _, fields = head.partition(" ")
+        if not fields or not timestamp:
+            return None
+        digest = hashlib.blake2b(" ".join((series, fields.strip(), timestamp)).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def filter(self, lines: Iterable[str]) -> List[str]:
+        """
+        Zeilen ohne die bereits angenommenen und ohne Wiederholungen innerhalb
+        von ``lines``; bei Wiederholungen bleibt die letzte stehen, die
+        Reihenfolge bleibt erhalten.
+        """
+
+        entries = [(line, self.key(line)) for line in lines if line]
+        last = {key: idx for idx, (_, key) in enumerate(entries) if key is not None}
+        ret = []
+        suppressed = 0
+        with self._lock:
+            self._expire(time())
+            for idx, (line, key) in enumerate(entries):
+                if key is not None and (key in self._keys or last[key] != idx):
+                    suppressed += 1
+                    continue
+                ret.append(line)
+            self.suppressed += suppressed
+        return ret
+
+    def accept(self, lines: Iterable[str]) -> None:
+        """Merkt sich die Schlüssel der von NAO angenommenen Zeilen."""
+
+        now = time()
+        keys = [key for key in map(self.key, lines) if key is not None]
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                self._keys[key] = now
+                self._keys.move_to_end(key)
+            self.accepted += len(keys)
+            evicted = []
+            while len(self._keys) > self.max_entries:
+                evicted.append(self._keys.popitem(last=False)[0])
+            if self._conn is not None:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO dedup_window (key, accepted_at) VALUES (?, ?)", ((key, now) for key in keys)
+                )
+                self._conn.executemany("DELETE FROM dedup_window WHERE key = ?", ((key,) for key in evicted))
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Unterdrückte und angenommene Zeilen sowie aktuell gemerkte Schlüssel."""
+
+        with self._lock:
+            return {
+                "suppressed": self.suppressed,
+                "accepted": self.accepted,
+                "entries": len(self._keys),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM dedup_window")
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _expire(self, now: float) -> None:
+        limit = now - self.window
+        expired = False
+        while self._keys:
+            key, accepted_at = next(iter(self._keys.items()))
+            if accepted_at > limit:
+                break
+            del self._keys[key]
+            expired = True
+        if expired and self._conn is not None:
+            self._conn.execute("DELETE FROM dedup_window WHERE accepted_at <= ?", (limit,))
+            self._conn.commit()
@@ -0,0 +1,219 @@
+"""
+Telegraf-Zeilen direkt als Bytes aufbauen.
+
+Die Listener und Logger formatieren für jeden Wert die komplette Vorlage
+``Param.FORMAT_TELEGRAFFRAMESTRUCT`` (``"%s,instance=%s %s=%f %.0f"``),
+obwohl sich Asset, Instanz und Reihe nie ändern. ``TelegrafEncoder`` kodiert
+den Präfix ``<asset>,instance=<instance> <series>=`` einmal pro Reihe und
+hängt nur noch Wert und Zeitstempel an einen wiederverwendeten
+``bytearray`` an. Den Puffer nimmt ``sendTelegrafData`` direkt als Body an;
+wer weiterhin eine Zeilenliste braucht, bekommt sie mit ``take_lines`` in
+einem Durchgang.
+
+Mit ``compact=True`` werden Werte wie ``format_field_value`` geschrieben
+(kürzeste Darstellung, optional Integer-Felder), mit ``precision`` die
+Zeitstempel in ``s``/``ms``/``us``; die gleiche ``precision`` muss dann an
+``sendTelegrafData`` übergeben werden.
+
+``max_bytes`` begrenzt den Puffer wie ``TelegrafRingBuffer`` (z. B. für den
+MQTT-Listener, wenn NAO nicht erreichbar ist).
+"""
+
+from threading import Lock
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .ring_buffer import DROP_NEWEST, DROP_OLDEST, check_drop_policy
+from .telegraf import format_field_value, precision_divisor
+
+
+TELEGRAF_LINE_SEPARATOR = b"\n"
+# wie FORMAT_TELEGRAFFRAMESTRUCT, der Zeitstempel aber als Ganzzahl: gleiche
+# Ausgabe für ganzzahlige Nanosekunden, ohne Umweg über float
+DEFAULT_VALUE_FORMAT = b"%f %d"
+COMPACT_VALUE_FORMAT = b"%s %d"
+
+
+class TelegrafEncoder(object):
+    """
+    Parameter:
+        value_format:
+            Bytes-Vorlage für Wert und Zeitstempel (ohne ``compact``).
+        compact:
+            Werte in kürzester Darstellung statt ``%f``.
+        precision:
+            Auflösung der Zeitstempel (``s``, ``ms``, ``us``, ``ns``); ``add``
+            erwartet weiterhin Nanosekunden.
+        integers:
+            Mit ``compact`` ganze Zahlen als Integer-Feld (``42i``).
+        max_bytes:
+            Höchstgröße des Puffers (``None``: unbegrenzt).
+        drop:
+            Bei Überlauf die ältesten (``"oldest"``) oder die neuesten
+            (``"newest"``) Zeilen verwerfen; gezählt in ``dropped``.
+
+    Pro Reihe wird der Präfix einmal zu einer Vorlage
+    ``<asset>,instance=<instance> <series>=%f %d\n`` kodiert; ``add`` ist
+    danach eine Formatierung und ein Anhängen an den Puffer. ``add`` ist
+    thread-sicher, so dass z. B. der MQTT-Callback schreiben kann, während der
+    Transfer-Thread mit ``take`` den Puffer übernimmt.
+    """
+
+    def __init__(
+        self,
+        value_format: bytes = DEFAULT_VALUE_FORMAT,
+        compact: bool = False,
+        precision: Optional[str] = None,
+        integers: bool = False,
+        max_bytes: Optional[int] = None,
+        drop: str = DROP_OLDEST,
+    ) -> None:
+        self.compact = compact
+        self.precision = precision
+        self.integers = integers
+        self.value_format = COMPACT_VALUE_FORMAT if compact else value_format
+        self._divisor = precision_divisor(precision)
+        self._plain = not compact and self._divisor == 1
+        self.max_bytes = max_bytes
+        self.drop = check_drop_policy(drop)
+        self.dropped = 0
+        self.high_water = 0
+        self._prefixes: Dict[Tuple[Hashable, Hashable, Hashable], bytes] = {}
+        self._templates: Dict[Tuple[Hashable, Hashable, Hashable], bytes] = {}
+        self._buffer = bytearray()
+        self._count = 0
+        self._lock = Lock()
+
+    def prefix(self, asset, instance, series=None) -> bytes:
+        """
+        ``<asset>,instance=<instance> <series>=`` als Bytes, pro Reihe nur
+        einmal kodiert. Ohne ``series`` nur ``<asset>,instance=<instance> ``,
+        ohne Asset und Instanz nur ``<series>=``.
+        """
+
+        key = (asset, instance, series)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            if series is None:
+                prefix = "%s,instance=%s " % (asset, instance)
+            elif asset is None and instance is None:
+                prefix = "%s=" % series
+            else:
+                prefix = "%s,instance=%s %s=" % key
+            prefix = prefix.encode("utf-8")
+            self._prefixes[key] = prefix
+        return prefix
+
+    def template(self, asset, instance, series) -> bytes:
+        """Vorlage ``<prefix><value_format>\n`` einer Reihe."""
+
+        key = (asset, instance, series)
+        template = self._templates.get(key)
+        if template is None:
+            template = self.prefix(asset, instance, series).replace(b"%", b"%%") + self.value_format + TELEGRAF_LINE_SEPARATOR
+            self._templates[key] = template
+        return template
+
+    def add(self, asset, instance, series, value, timestamp) -> None:
+        """Hängt eine Zeile an; ``timestamp`` in Nanosekunden."""
+
+        point = (value, timestamp) if self._plain else self._point(value, timestamp)
+        self._append(self.template(asset, instance, series) % point, 1)
+
+    def add_many(self, asset, instance, series, points: Iterable[Tuple[Any, Any]]) -> int:
+        """Hängt ``(value, timestamp)``-Paare einer Reihe an und liefert deren Anzahl."""
+
+        template = self.template(asset, instance, series)
+        if self._plain:
+            lines = [template % point for point in points]
+        else:
+            lines = [template % self._point(value, timestamp) for value, timestamp in points]
+        if not lines:
+            return 0
+        return self._append(b"".join(lines), len(lines))
+
+    def add_fields(self, asset, instance, fields, timestamp) -> None:
+        """
+        Hängt eine Mehrfeld-Zeile ``<asset>,instance=<instance> s1=v1,s2=v2 <timestamp>`` an.
+
+        ``fields`` ist eine Folge von ``(series, value)``; Werte werden wie
+        ``repr`` (bzw. kompakt) geschrieben. Ohne Felder wird nichts angehängt.
+        """
+
+        fields = [self.field(series) + self._value(value) for series, value in fields]
+        if not fields:
+            return
+        self._append(self.prefix(asset, instance) + b",".join(fields) + b" %d" % (int(timestamp) // self._divisor) + TELEGRAF_LINE_SEPARATOR, 1)
+
+    def field(self, series) -> bytes:
+        """``<series>=`` als Bytes."""
+
+        return self.prefix(None, None, series)
+
+    def take(self) -> bytearray:
+        """Übergibt den Puffer (ohne Kopie, ohne abschließenden Zeilenumbruch) und beginnt einen neuen."""
+
+        with self._lock:
+            buffer = self._buffer
+            self._buffer = bytearray()
+            self._count = 0
+        if buffer:
+            del buffer[-1:]
+        return buffer
+
+    def take_lines(self) -> List[str]:
+        """Wie ``take``, aber als Zeilenliste für Aufrufer, die eine Liste erwarten."""
+
+        buffer = self.take()
+        if not buffer:
+            return []
+        return buffer.decode("utf-8").split("\n")
+
+    def stats(self) -> Dict[str, int]:
+        """Verworfene Zeilen, Höchststand in Bytes, aktuelle Zeilen und Bytes."""
+
+        with self._lock:
+            return {
+                "dropped": self.dropped,
+                "high_water_bytes": self.high_water,
+                "depth": self._count,
+                "nbytes": len(self._buffer),
+            }
+
+    def _append(self, data: bytes, lines: int) -> int:
+        """Hängt ``lines`` fertige Zeilen an und hält ``max_bytes`` ein; liefert die aufgenommenen Zeilen."""
+
+        with self._lock:
+            if self.max_bytes is not None and self.drop == DROP_NEWEST and len(self._buffer) + len(data) > self.max_bytes:
+                cut = data.rfind(TELEGRAF_LINE_SEPARATOR, 0, max(0, self.max_bytes - len(self._buffer))) + 1
+                kept = data.count(TELEGRAF_LINE_SEPARATOR, 0, cut)
+                self.dropped += lines - kept
+                data, lines = data[:cut], kept
+            self._buffer += data
+            self._count += lines
+            if self.max_bytes is not None and len(self._buffer) > self.max_bytes:
+                # Löschen am Anfang eines bytearray verschiebt nur den Startzeiger
+                cut = self._buffer.find(TELEGRAF_LINE_SEPARATOR, len(self._buffer) - self.max_bytes - 1) + 1
+                dropped = self._buffer.count(TELEGRAF_LINE_SEPARATOR, 0, cut)
+                del self._buffer[:cut]
+                self._count -= dropped
+                self.dropped += dropped
+            if len(self._buffer) > self.high_water:
+                self.high_water = len(self._buffer)
+        return lines
+
+    def _value(self, value) -> bytes:
+        if self.compact:
+            return format_field_value(value, self.integers).encode("ascii")
+        return b"%r" % value
+
+    def _point(self, value, timestamp) -> Tuple[Any, int]:
+        if self.compact:
+            value = format_field_value(value, self.integers).encode("ascii")
+        return (value, int(timestamp) // self._divisor)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buffer)
+
+    def __len__(self) -> int:
+        return self._count
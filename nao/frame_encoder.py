@@ -0,0 +1,130 @@
+"""
+Spaltenweises Kodieren eines DataFrames als Telegraf-Line-Protocol.
+
+Die Konnektoren bauen ihre Zeilen bisher Zelle für Zelle (``iloc``,
+``pytz.localize`` pro Zeile oder ``DataFrame.apply(axis=1)``). Hier wird der
+Index einmal nach UTC-``int64``-Nanosekunden umgerechnet, jede Spalte einmal
+als numpy-String-Array formatiert und die Zeilen mit numpy-String-Operationen
+zusammengesetzt. Fehlende Werte (NaN, None) werden übersprungen.
+
+Die Reihenfolge entspricht den bisherigen Schleifen: zeilenweise, innerhalb
+eines Zeitstempels in Spaltenreihenfolge. Werte stehen in der kürzesten
+Darstellung, Zeitstempel als Ganzzahl in ``precision`` (Standard ``ns``).
+
+Anders als der Rest von ``naoconnect.nao`` benötigt dieses Modul numpy und
+pandas und wird deshalb nicht in ``naoconnect.nao`` re-exportiert.
+"""
+
+from datetime import timedelta, tzinfo
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .telegraf import precision_divisor
+
+
+TELEGRAF_LINE_SEPARATOR = "\n"
+# wie pytz.localize(is_dst=False): mehrdeutige Zeiten gelten als Normalzeit,
+# Zeiten in der Lücke der Sommerzeitumstellung werden um die Lücke verschoben
+DEFAULT_AMBIGUOUS = False
+DEFAULT_NONEXISTENT = timedelta(hours=1)
+
+
+def index_to_ns(
+    index,
+    tz: Union[str, tzinfo, None] = None,
+    ambiguous=DEFAULT_AMBIGUOUS,
+    nonexistent=DEFAULT_NONEXISTENT,
+) -> np.ndarray:
+    """
+    Zeitindex als UTC-Nanosekunden (``int64``).
+
+    Naive Zeitpunkte werden in ``tz`` interpretiert (ohne ``tz`` als UTC),
+    zeitzonenbehaftete direkt umgerechnet.
+    """
+
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        if tz is not None:
+            index = index.tz_localize(tz, ambiguous=ambiguous, nonexistent=nonexistent)
+        else:
+            index = index.tz_localize("UTC")
+    return index.tz_convert("UTC").as_unit("ns").asi8
+
+
+def format_values(values, integers: bool = False) -> np.ndarray:
+    """
+    Werte als numpy-String-Array.
+
+    Ganzzahlen ohne Nachkommastellen (mit ``integers`` als Integer-Feld mit
+    ``i``), Gleitkommazahlen in der kürzesten eindeutigen Darstellung (wie
+    ``str(float)``).
+    """
+
+    values = np.asarray(values)
+    if values.dtype.kind in "iub":
+        values = values.astype(np.int64).astype(str)
+        return np.char.add(values, "i") if integers else values
+    return values.astype(np.float64).astype(str)
+
+
+def encode_frame(
+    frame: pd.DataFrame,
+    series_ids: Union[Dict[str, str], Sequence[str]],
+    asset_id: str,
+    instance_id: str,
+    tz: Union[str, tzinfo, None] = None,
+    scale: Optional[Dict[str, float]] = None,
+    as_bytes: bool = False,
+    precision: Optional[str] = None,
+    integers: bool = False,
+) -> Union[List[str], bytes]:
+    """
+    Kodiert ``frame`` (Zeitindex, eine Spalte pro Reihe) als Telegraf-Zeilen.
+
+    Parameter:
+        series_ids:
+            ``{spalte: series_id}`` oder eine Liste von Series-IDs in
+            Spaltenreihenfolge. Spalten ohne ID werden ignoriert.
+        tz:
+            Zeitzone eines naiven Index, z. B. ``"Europe/Berlin"``.
+        scale:
+            Optionale Faktoren ``{series_id: faktor}`` (falsche Einheiten).
+        as_bytes:
+            Statt der Zeilenliste den fertigen UTF-8-Body liefern.
+        precision:
+            Auflösung der Zeitstempel (``s``, ``ms``, ``us``, ``ns``); beim
+            Senden dieselbe ``precision`` angeben.
+        integers:
+            Ganzzahlige Spalten als Integer-Feld (``42i``) schreiben.
+    """
+
+    if not isinstance(series_ids, dict):
+        if len(series_ids) != len(frame.columns):
+            raise ValueError("Anzahl der Series-IDs passt nicht zu den Spalten von instance-id: " + str(instance_id))
+        series_ids = dict(zip(frame.columns, series_ids))
+    columns = [column for column in frame.columns if column in series_ids]
+    if len(frame) == 0 or not columns:
+        return b"" if as_bytes else []
+
+    timestamps = np.char.add(" ", (index_to_ns(frame.index, tz) // precision_divisor(precision)).astype(str))
+    prefix = "%s,instance=%s " % (asset_id, instance_id)
+    lines = np.empty((len(frame), len(columns)), dtype=object)
+    valid = np.empty((len(frame), len(columns)), dtype=bool)
+    for position, column in enumerate(columns):
+        series_id = series_ids[column]
+        values = frame[column]
+        valid[:, position] = values.notna().to_numpy()
+        values = values.to_numpy()
+        if values.dtype == object:
+            values = pd.to_numeric(values, errors="coerce")
+            valid[:, position] &= ~np.isnan(values)
+        if scale and series_id in scale:
+            values = values.astype(np.float64) * scale[series_id]
+        column_lines = np.char.add(np.char.add(prefix + series_id + "=", format_values(values, integers)), timestamps)
+        lines[:, position] = column_lines
+    lines = lines[valid].tolist()
+    if as_bytes:
+        return TELEGRAF_LINE_SEPARATOR.join(lines).encode("utf-8")
+    return lines
@@ -0,0 +1,156 @@
+"""
+Lückenprüfung pro Tag und gezieltes Nachladen.
+
+Bisher half gegen Lücken in NAO nur das Zurücksetzen des gesamten
+Sync-Status, wodurch alle Daten erneut gesendet wurden. Stattdessen werden
+pro Reihe und Tag die Anzahl der Werte in der Quelle und in NAO
+(``/api/series/data/singlevalues`` mit dem Aggregat ``count``) verglichen.
+Nur Tage, an denen NAO weniger Werte hat, landen als ``BackfillJob`` in
+einer ``BackfillQueue`` und werden vom Konnektor einzeln nachgeladen.
+"""
+
+from collections import deque
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from threading import Lock
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .watermarks import NAME_ID, single_value_entries
+
+
+AGGREGATE_COUNT = "count"
+NAME_VALUE = "value"
+
+DayRange = Tuple[date, datetime, datetime]
+
+
+def day_ranges(start: date, stop: date, tz: tzinfo = timezone.utc) -> List[DayRange]:
+    """
+    Tage von ``start`` bis einschließlich ``stop`` als ``(tag, beginn, ende)``.
+
+    Beginn und Ende sind Mitternacht in ``tz`` (zeitzonenbehaftet), damit die
+    Tagesgrenzen in NAO und in der Quelle übereinstimmen, auch wenn die Quelle
+    in Ortszeit speichert.
+    """
+
+    if isinstance(start, datetime):
+        start = start.date()
+    if isinstance(stop, datetime):
+        stop = stop.date()
+    ranges = []
+    day = start
+    while day <= stop:
+        next_day = day + timedelta(days=1)
+        ranges.append((day, datetime.combine(day, time(), tz), datetime.combine(next_day, time(), tz)))
+        day = next_day
+    return ranges
+
+
+def parse_counts(response) -> Dict[str, int]:
+    """Liest ``{id: anzahl}`` aus einer Singlevalues-Antwort mit dem Aggregat ``count``."""
+
+    ret = {}
+    for entry in single_value_entries(response):
+        if entry.get(NAME_ID) is not None:
+            ret[entry[NAME_ID]] = int(entry.get(NAME_VALUE) or 0)
+    return ret
+
+
+def find_gap_days(source_counts: Dict[date, int], nao_counts: Dict[date, int], tolerance: int = 0) -> List[date]:
+    """Tage, an denen NAO mehr als ``tolerance`` Werte weniger hat als die Quelle."""
+
+    return sorted(
+        day for day, count in source_counts.items()
+        if count - nao_counts.get(day, 0) > tolerance
+    )
+
+
+class BackfillJob(object):
+    """
+    Ein nachzuladender Tag einer Reihe.
+
+    ``key`` ist konnektorspezifisch (z. B. Datenpunkt-ID oder
+    ``(database, table, column)``), ``start`` und ``stop`` begrenzen den Tag.
+    """
+
+    __slots__ = ("key", "day", "start", "stop", "source_count", "nao_count")
+
+    def __init__(self, key: Hashable, day: date, start: datetime, stop: datetime, source_count: int = 0, nao_count: int = 0) -> None:
+        self.key = key
+        self.day = day
+        self.start = start
+        self.stop = stop
+        self.source_count = source_count
+        self.nao_count = nao_count
+
+    @property
+    def missing(self) -> int:
+        return max(0, self.source_count - self.nao_count)
+
+    def __repr__(self) -> str:
+        return "BackfillJob(key=%r, day=%s, missing=%s)" % (self.key, self.day.isoformat(), self.missing)
+
+
+class BackfillQueue(object):
+    """Thread-sichere FIFO-Warteschlange für ``BackfillJob``, jeder ``(key, day)`` nur einmal."""
+
+    def __init__(self, jobs: Optional[Iterable[BackfillJob]] = None) -> None:
+        self._jobs: deque = deque()
+        self._keys = set()
+        self._lock = Lock()
+        for job in jobs or ():
+            self.put(job)
+
+    def put(self, job: BackfillJob) -> bool:
+        with self._lock:
+            if (job.key, job.day) in self._keys:
+                return False
+            self._keys.add((job.key, job.day))
+            self._jobs.append(job)
+            return True
+
+    def pop(self) -> Optional[BackfillJob]:
+        with self._lock:
+            if not self._jobs:
+                return None
+            job = self._jobs.popleft()
+            self._keys.discard((job.key, job.day))
+            return job
+
+    def jobs(self) -> List[BackfillJob]:
+        with self._lock:
+            return list(self._jobs)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+
+def enqueue_gaps(
+    queue: BackfillQueue,
+    key: Hashable,
+    days: Iterable[DayRange],
+    source_counts: Dict[date, int],
+    nao_counts: Dict[date, int],
+    tolerance: int = 0,
+) -> int:
+    """Legt für jeden Lückentag von ``key`` einen ``BackfillJob`` an und liefert deren Anzahl."""
+
+    gaps = set(find_gap_days(source_counts, nao_counts, tolerance))
+    added = 0
+    for day, start, stop in days:
+        if day in gaps:
+            added += queue.put(BackfillJob(key, day, start, stop, source_counts.get(day, 0), nao_counts.get(day, 0)))
+    return added
+
+
+def counts_by_day(rows: Iterable[Tuple[Any, int]]) -> Dict[date, int]:
+    """``[(tag oder datetime, anzahl), ...]`` aus einer SQL-Gruppierung als ``{date: anzahl}``, Tage summiert."""
+
+    ret: Dict[date, int] = {}
+    for day, count in rows:
+        if isinstance(day, datetime):
+            day = day.date()
+        elif isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+        ret[day] = ret.get(day, 0) + int(count or 0)
+    return ret
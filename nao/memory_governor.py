@@ -0,0 +1,172 @@
+"""
+Prozessweites Byte-Budget für Telegraf-Daten im Speicher.
+
+Jeder Konnektor wählt seine eigene Blockgröße (``DEFAULT_BREAK_TELEGRAF_LEN``
+bei Aqotec/Schneid, ``STANDARD_DATA_PER_FUNC_CALL`` in ``NaoApp``,
+``TELEGRAF_PUSH_LEN`` bei DesigoCC, ``max_data_len`` bei OpenMuc/Monisoft).
+Laufen mehrere in einem Prozess, ist der Spitzenverbrauch nicht vorhersagbar.
+
+``TelegrafMemoryGovernor`` verteilt ein gemeinsames Budget: Vor dem Abholen
+reserviert ein Konnektor mit ``lease`` eine Schätzung, korrigiert sie nach
+dem Abholen mit ``resize`` auf die tatsächliche Größe und gibt sie nach dem
+Upload frei. Ist das Budget ausgeschöpft, wartet ``lease``, bis andere
+Uploads fertig sind (Gegendruck statt Speicherwachstum). ``utilisation`` und
+``stats`` zeigen die Auslastung.
+
+Ein einzelner Block größer als das Budget wird zugelassen, sobald sonst
+nichts reserviert ist, und ein Thread, der bereits einen Block hält, wartet
+nie auf sich selbst.
+"""
+
+from threading import Condition, Lock, get_ident
+from time import monotonic
+from typing import Dict, Iterable, Optional, Union
+
+
+# Python-Overhead je Zeile in einer Liste: leerer str-Kopf plus Zeiger
+LINE_OVERHEAD_BYTES = 57
+# Schätzung je Zeile vor dem Abholen: Präfix, Wert und Zeitstempel plus Overhead
+DEFAULT_LINE_BYTES = 64 + LINE_OVERHEAD_BYTES
+
+
+def telegraf_nbytes(payload: Union[Iterable[str], str, bytes, bytearray]) -> int:
+    """Ungefährer Speicherbedarf eines Payloads (Zeilenliste, String oder Bytes)."""
+
+    if isinstance(payload, (str, bytes, bytearray)):
+        return len(payload)
+    return sum(len(line) + LINE_OVERHEAD_BYTES for line in payload)
+
+
+class TelegrafMemoryLease(object):
+    """Reservierter Anteil am Budget; als Kontextmanager wird er am Ende freigegeben."""
+
+    def __init__(self, governor: "TelegrafMemoryGovernor", nbytes: int, thread: int) -> None:
+        self.governor = governor
+        self.nbytes = nbytes
+        self.thread = thread
+        self.released = False
+
+    def resize(self, nbytes: int) -> None:
+        """Setzt die Reservierung auf die tatsächliche Größe (wartet nicht)."""
+
+        if not self.released:
+            self.governor._resize(self, max(0, int(nbytes)))
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.governor._release(self)
+
+    def __enter__(self) -> "TelegrafMemoryLease":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class TelegrafMemoryGovernor(object):
+    """
+    Parameter:
+        budget_bytes:
+            Gemeinsames Budget aller Konnektoren des Prozesses.
+    """
+
+    DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES) -> None:
+        if budget_bytes <= 0:
+            raise ValueError("budget_bytes muss größer als 0 sein.")
+        self.budget_bytes = budget_bytes
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.waiting = 0
+        self._holders: Dict[int, int] = {}
+        self._condition = Condition(Lock())
+
+    def lease(self, nbytes: int, timeout: Optional[float] = None) -> Optional[TelegrafMemoryLease]:
+        """
+        Reserviert ``nbytes`` und wartet dafür höchstens ``timeout`` Sekunden
+        (``None``: unbegrenzt). Liefert ``None``, wenn die Zeit abgelaufen ist.
+        """
+
+        nbytes = max(0, int(nbytes))
+        thread = get_ident()
+        with self._condition:
+            if not self._fits(nbytes, thread):
+                self.waits += 1
+                self.waiting += 1
+                start = monotonic()
+                try:
+                    if not self._condition.wait_for(lambda: self._fits(nbytes, thread), timeout):
+                        return None
+                finally:
+                    self.waiting -= 1
+                    self.wait_seconds += monotonic() - start
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+            self._holders[thread] = self._holders.get(thread, 0) + 1
+            return TelegrafMemoryLease(self, nbytes, thread)
+
+    @property
+    def utilisation(self) -> float:
+        """Anteil des reservierten Budgets (kann bei übergroßen Blöcken über 1 liegen)."""
+
+        return self.used / self.budget_bytes
+
+    def stats(self) -> Dict[str, float]:
+        """Budget, reservierte Bytes, Höchststand, Auslastung, wartende Threads und Wartezeit."""
+
+        with self._condition:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self.used,
+                "peak_bytes": self.peak,
+                "utilisation": self.used / self.budget_bytes,
+                "leases": sum(self._holders.values()),
+                "waiting": self.waiting,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+            }
+
+    def _fits(self, nbytes: int, thread: int) -> bool:
+        return self.used + nbytes <= self.budget_bytes or self.used == 0 or thread in self._holders
+
+    def _resize(self, lease: TelegrafMemoryLease, nbytes: int) -> None:
+        with self._condition:
+            self.used += nbytes - lease.nbytes
+            lease.nbytes = nbytes
+            self.peak = max(self.peak, self.used)
+            self._condition.notify_all()
+
+    def _release(self, lease: TelegrafMemoryLease) -> None:
+        with self._condition:
+            self.used -= lease.nbytes
+            count = self._holders.get(lease.thread, 0) - 1
+            if count > 0:
+                self._holders[lease.thread] = count
+            else:
+                self._holders.pop(lease.thread, None)
+            self._condition.notify_all()
+
+
+_GOVERNOR: Optional[TelegrafMemoryGovernor] = None
+_GOVERNOR_LOCK = Lock()
+
+
+def get_memory_governor(budget_bytes: Optional[int] = None) -> TelegrafMemoryGovernor:
+    """
+    Liefert den prozessweit geteilten Governor. ``budget_bytes`` setzt das
+    Budget (beim ersten Aufruf bzw. nachträglich für alle Konnektoren).
+    """
+
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        if _GOVERNOR is None:
+            _GOVERNOR = TelegrafMemoryGovernor(budget_bytes or TelegrafMemoryGovernor.DEFAULT_BUDGET_BYTES)
+        elif budget_bytes:
+            with _GOVERNOR._condition:
+                _GOVERNOR.budget_bytes = budget_bytes
+                _GOVERNOR._condition.notify_all()
+        return _GOVERNOR
@@ -0,0 +1,159 @@
+"""
+Read-Through-Cache für die Metadaten-Endpunkte der NAO-API.
+
+Labeling- und Meta-Synchronisation (``SchneidMeta``, ``AqotecMetaV2``,
+``DesigoCC``, ``BuildAssets`` ...) fragen innerhalb eines Laufs dieselben
+Workspaces, Assets, Instanzen, Serien und Einheiten immer wieder ab.
+``NaoMetadataCache`` hält die Antworten von GET-Aufrufen pro Host und URL
+(inklusive Query) für ``ttl`` Sekunden vor und kann sie optional als
+JSON-Datei zwischen Läufen aufbewahren.
+
+Schreibende Aufrufe (POST, PATCH, PUT, DELETE) auf eine Ressource verwerfen
+automatisch alle Einträge derselben und der abhängigen Ressourcen, z. B.
+``patchInstanceMeta`` alle Einträge unter ``/api/nao/instance``.
+"""
+
+import atexit
+import json
+import os
+from threading import Lock
+from time import time
+from typing import Dict, Optional, Tuple
+
+
+class NaoMetadataCache(object):
+    """
+    Parameter:
+        ttl:
+            Gültigkeit eines Eintrags in Sekunden.
+        path:
+            Optionale JSON-Datei für die Persistenz. Gültige Einträge werden
+            beim Anlegen geladen und höchstens alle ``save_interval``
+            Sekunden sowie beim Beenden des Prozesses geschrieben.
+        save_interval:
+            Mindestabstand zwischen zwei Schreibvorgängen in Sekunden.
+    """
+
+    DEFAULT_TTL = 300.0
+    DEFAULT_SAVE_INTERVAL = 30.0
+    CACHEABLE_PREFIXES = ("/api/nao/",)
+    RELATED_RESOURCES = {
+        "/api/nao/workspace": ("/api/nao/instance",),
+        "/api/nao/asset": ("/api/nao/part", "/api/nao/series"),
+        "/api/nao/part": ("/api/nao/asset", "/api/nao/series"),
+        "/api/nao/series": ("/api/nao/asset", "/api/nao/instance"),
+        "/api/nao/instance": ("/api/nao/series", "/api/nao/inputvalue"),
+        "/api/nao/inputvalue": ("/api/nao/instance",),
+        "/api/nao/input": ("/api/nao/instance", "/api/nao/inputvalue"),
+        "/api/nao/inputcontainer": ("/api/nao/input",),
+        "/log/attributevalue": ("/api/nao/instance",),
+    }
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        path: Optional[str] = None,
+        save_interval: float = DEFAULT_SAVE_INTERVAL,
+    ) -> None:
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], Tuple[float, bytes]] = {}
+        self._dirty = False
+        self._saved_at = time()
+        self._lock = Lock()
+        if path:
+            self._load()
+            atexit.register(self.save)
+
+    @classmethod
+    def resource(cls, url: str) -> str:
+        """Ressource einer URL, z. B. ``/api/nao/instance`` für ``/api/nao/instance/<id>?...``."""
+
+        segments = [segment for segment in url.split("?", 1)[0].split("/") if segment]
+        depth = 3 if segments[:1] == ["api"] else 2
+        return "/" + "/".join(segments[:depth])
+
+    @classmethod
+    def cacheable(cls, url: str) -> bool:
+        return url.startswith(cls.CACHEABLE_PREFIXES)
+
+    def get(self, host: str, url: str) -> Optional[bytes]:
+        """Rohdaten der gecachten Antwort oder ``None``."""
+
+        with self._lock:
+            entry = self._entries.get((host, url))
+            if entry is not None and entry[0] > time():
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[(host, url)]
+            self.misses += 1
+            return None
+
+    def put(self, host: str, url: str, data: bytes) -> None:
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            return
+        with self._lock:
+            self._entries[(host, url)] = (time() + self.ttl, data)
+            self._dirty = True
+        self._save_if_due()
+
+    def invalidate(self, host: str, url: str) -> None:
+        """Verwirft alle Einträge, die ein schreibender Aufruf auf ``url`` ändern kann."""
+
+        resource = self.resource(url)
+        if not self.cacheable(url) and resource not in self.RELATED_RESOURCES:
+            return
+        affected = (resource,) + self.RELATED_RESOURCES.get(resource, ())
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == host and self.resource(key[1]) in affected]:
+                del self._entries[key]
+                self._dirty = True
+        self._save_if_due()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+        self.save()
+
+    def save(self) -> None:
+        """Schreibt alle gültigen Einträge in ``path``."""
+
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time()
+            entries = [
+                [host, url, expires_at, data.decode("utf-8")]
+                for (host, url), (expires_at, data) in self._entries.items()
+                if expires_at > now
+            ]
+            self._dirty = False
+            self._saved_at = now
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(temp_path, self.path)
+
+    def _save_if_due(self) -> None:
+        if self.path and self._dirty and time() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time()
+        for host, url, expires_at, data in entries:
+            if expires_at > now:
+                self._entries[(host, url)] = (expires_at, data.encode("utf-8"))
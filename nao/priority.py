@@ -0,0 +1,170 @@
+"""
+Vorrangspuren für Telegraf-Uploads: aktuelle Werte vor Nachladungen.
+
+Plant Aqotec unsynchronisierte Jobs ab 2017 ein (``SyncPlanner.setJobsUnsynced``)
+oder läuft ``SchneidTransferCsv`` mit ``archiv_sync=True``, belegen die
+Nachladungen die Leitung und aktuelle Werte erscheinen erst Stunden später in
+den Dashboards.
+
+``TelegrafPriorityScheduler`` ordnet jeden Block einer von zwei Spuren zu:
+``"live"`` (mindestens ein Zeitstempel jünger als ``live_age``) oder
+``"backfill"``. Höchstens ``max_in_flight`` Blöcke sind gleichzeitig
+unterwegs; wird ein Platz frei, bekommt ihn der wartende Block mit dem
+kleinsten virtuellen Endzeitpunkt (gewichtetes Fair Queueing, selbstgetaktet).
+Bei Konkurrenz erhält die Live-Spur so den Anteil ``live_share`` der Bytes, die
+Backfill-Spur den Rest; ist eine Spur leer, nutzt die andere die ganze
+Leitung. Ein neuer Live-Block wartet höchstens, bis ein laufender Block fertig
+ist, solange die Live-Spur ihren Anteil nicht selbst ausschöpft.
+
+Eine Instanz wird von allen Clients eines Prozesses geteilt und ist
+thread-sicher.
+"""
+
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Condition, Lock
+from time import monotonic, time_ns
+from typing import Dict, List, Optional, Union
+
+from .telegraf import precision_divisor
+
+
+LANE_LIVE = "live"
+LANE_BACKFILL = "backfill"
+LANES = (LANE_LIVE, LANE_BACKFILL)
+
+
+def check_lane(lane: Optional[str]) -> Optional[str]:
+    if lane is not None and lane not in LANES:
+        raise ValueError("lane muss eine von %s sein." % ", ".join(LANES))
+    return lane
+
+
+def telegraf_has_newer(payload: Union[List[str], str, bytes, bytearray], threshold_ns: int, precision: Optional[str] = None) -> bool:
+    """``True``, sobald eine Zeile einen Zeitstempel ab ``threshold_ns`` trägt."""
+
+    if isinstance(payload, (bytes, bytearray)):
+        payload = bytes(payload).decode("utf-8")
+    if isinstance(payload, str):
+        payload = payload.split("\n")
+    threshold = -(-threshold_ns // precision_divisor(precision))
+    for line in reversed(payload):
+        # die neuesten Werte stehen meist am Ende
+        timestamp = line[line.rfind(" ")+1:].strip()
+        if timestamp.isdigit() and int(timestamp) >= threshold:
+            return True
+    return False
+
+
+class TelegrafPriorityScheduler(object):
+    """
+    Parameter:
+        live_age:
+            Alter in Sekunden, bis zu dem ein Wert als aktuell gilt (Standard
+            6 Stunden).
+        live_share:
+            Anteil der Bytes für die Live-Spur, solange beide Spuren warten
+            (zwischen 0 und 1, exklusiv).
+        max_in_flight:
+            Höchstzahl gleichzeitig gesendeter Blöcke aller Clients.
+
+    ``send`` wird von ``NaoApp`` je Block aufgerufen; ``lane`` ``None`` ordnet
+    den Block über ``classify`` zu. ``stats`` liefert je Spur gesendete Bytes
+    und Blöcke, Wartezeiten und den tatsächlichen Anteil.
+    """
+
+    DEFAULT_LIVE_AGE = 6 * 3600
+    DEFAULT_LIVE_SHARE = 0.8
+    DEFAULT_MAX_IN_FLIGHT = 2
+
+    def __init__(
+        self,
+        live_age: float = DEFAULT_LIVE_AGE,
+        live_share: float = DEFAULT_LIVE_SHARE,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ) -> None:
+        if not 0 < live_share < 1:
+            raise ValueError("live_share muss zwischen 0 und 1 liegen.")
+        self.live_age = live_age
+        self.max_in_flight = max(1, max_in_flight)
+        self.weights = {LANE_LIVE: live_share, LANE_BACKFILL: 1 - live_share}
+        self.in_flight = 0
+        self._virtual = 0.0
+        self._finish = {lane: 0.0 for lane in LANES}
+        self._queue: List[list] = []
+        self._sequence = count()
+        self._stats = {lane: {"requests": 0, "bytes": 0, "waiting": 0, "wait_seconds": 0.0, "max_wait": 0.0} for lane in LANES}
+        self._condition = Condition(Lock())
+
+    @property
+    def live_share(self) -> float:
+        return self.weights[LANE_LIVE]
+
+    def classify(self, payload: Union[List[str], str, bytes, bytearray], precision: Optional[str] = None) -> str:
+        """``"live"``, wenn mindestens eine Zeile jünger als ``live_age`` ist, sonst ``"backfill"``."""
+
+        threshold = time_ns() - int(self.live_age * 1e9)
+        return LANE_LIVE if telegraf_has_newer(payload, threshold, precision) else LANE_BACKFILL
+
+    def send(self, lane: str, nbytes: int, request):
+        """
+        Wartet auf einen freien Platz in ``lane``, führt ``request()`` aus und
+        gibt den Platz wieder frei. Liefert das Ergebnis von ``request()``.
+        """
+
+        self.acquire(lane, nbytes)
+        try:
+            return request()
+        finally:
+            self.release()
+
+    def acquire(self, lane: str, nbytes: int) -> float:
+        """Reserviert einen Platz für ``nbytes`` in ``lane``; liefert die Wartezeit in Sekunden."""
+
+        check_lane(lane)
+        with self._condition:
+            tag = max(self._virtual, self._finish[lane]) + max(1, nbytes) / self.weights[lane]
+            self._finish[lane] = tag
+            stats = self._stats[lane]
+            stats["requests"] += 1
+            stats["bytes"] += nbytes
+            if self.in_flight < self.max_in_flight and not self._queue:
+                self.in_flight += 1
+                self._virtual = tag
+                return 0.0
+            # [Endzeitpunkt, Reihenfolge, Spur, zugeteilt]
+            ticket = [tag, next(self._sequence), lane, False]
+            heappush(self._queue, ticket)
+            stats["waiting"] += 1
+            start = monotonic()
+            try:
+                self._condition.wait_for(lambda: ticket[3])
+            finally:
+                if not ticket[3]:
+                    self._queue.remove(ticket)
+                    heapify(self._queue)
+                stats["waiting"] -= 1
+                wait = monotonic() - start
+                stats["wait_seconds"] += wait
+                stats["max_wait"] = max(stats["max_wait"], wait)
+            return wait
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            while self.in_flight < self.max_in_flight and self._queue:
+                ticket = heappop(self._queue)
+                ticket[3] = True
+                self.in_flight += 1
+                self._virtual = ticket[0]
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, object]:
+        """Je Spur Blöcke, Bytes, Wartende und Wartezeiten sowie der Byte-Anteil (``share``)."""
+
+        with self._condition:
+            total = sum(stats["bytes"] for stats in self._stats.values())
+            ret: Dict[str, object] = {"in_flight": self.in_flight, "queued": len(self._queue)}
+            for lane, stats in self._stats.items():
+                ret[lane] = dict(stats, share=stats["bytes"] / total if total else 0.0)
+            return ret
@@ -0,0 +1,204 @@
+"""
+Read-Through-Cache für aggregierte Zeitreihenabfragen.
+
+Auswertungen fragen ``getSingelValues`` und ``getPlotformatetTimeseries``
+immer wieder mit denselben Reihen und Zeitfenstern ab. ``NaoQueryCache``
+speichert die Antworten pro Host, URL und normalisierter Abfrage (JSON mit
+sortierten Schlüsseln) im Speicher und optional in einer SQLite-Datei.
+
+Abgeschlossene historische Fenster (absolutes ``stop`` länger als
+``settle`` Sekunden in der Vergangenheit) ändern sich nicht mehr und bleiben
+unbegrenzt gültig. Fenster, die bis "jetzt" reichen oder relative Angaben wie
+``now()`` oder ``-1d`` enthalten, gelten nur ``recent_ttl`` Sekunden.
+"""
+
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from time import time
+from typing import Any, Dict, Optional, Tuple
+
+from .watermarks import to_utc_datetime
+
+
+class NaoQueryCache(object):
+    """
+    Parameter:
+        path:
+            Optionale SQLite-Datei; ohne Pfad nur im Speicher.
+        recent_ttl:
+            Gültigkeit in Sekunden für Fenster, die "jetzt" berühren.
+        settle:
+            Sekunden nach ``stop``, ab denen ein Fenster als abgeschlossen gilt
+            (spät eintreffende Werte).
+        max_memory_entries:
+            Anzahl der Einträge im Speicher (LRU); die SQLite-Datei ist unbegrenzt.
+    """
+
+    DEFAULT_RECENT_TTL = 60.0
+    DEFAULT_SETTLE = 3600.0
+    DEFAULT_MAX_MEMORY_ENTRIES = 1024
+    CACHEABLE_URLS = ("/api/series/data/singlevalues", "/api/series/data/plot")
+    NAME_RANGE = "range"
+    NAME_STOP = "stop"
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        recent_ttl: float = DEFAULT_RECENT_TTL,
+        settle: float = DEFAULT_SETTLE,
+        max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+    ) -> None:
+        self.path = path
+        self.recent_ttl = recent_ttl
+        self.settle = settle
+        self.max_memory_entries = max(1, max_memory_entries)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+        self._lock = Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, expires_at REAL, data BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    @classmethod
+    def cacheable(cls, url: str) -> bool:
+        return url.split("?", 1)[0] in cls.CACHEABLE_URLS
+
+    @staticmethod
+    def key(host: str, url: str, payload: Any) -> str:
+        """Schlüssel aus Host, URL und der normalisierten Abfrage."""
+
+        query = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256("\n".join((host, url, query)).encode("utf-8")).hexdigest()
+
+    def expires_at(self, payload: Any, now: Optional[float] = None) -> Optional[float]:
+        """``None`` für abgeschlossene Fenster (unbegrenzt gültig), sonst ``now + recent_ttl``."""
+
+        now = time() if now is None else now
+        stops = list(_range_stops(payload))
+        if stops:
+            stop_times = [_absolute_time(stop) for stop in stops]
+            if all(stop is not None and stop.timestamp() + self.settle <= now for stop in stop_times):
+                return None
+        return now + self.recent_ttl
+
+    def get(self, host: str, url: str, payload: Any) -> Optional[bytes]:
+        """Rohdaten der gecachten Antwort oder ``None``."""
+
+        key = self.key(host, url, payload)
+        now = time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT expires_at, data FROM query_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], bytes(row[1]))
+                    self._remember(key, entry)
+                    if entry[0] is None or entry[0] > now:
+                        self.disk_hits += 1
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+
+    def put(self, host: str, url: str, payload: Any, data: bytes) -> None:
+        key = self.key(host, url, payload)
+        entry = (self.expires_at(payload), data)
+        with self._lock:
+            self._remember(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, url, expires_at, data) VALUES (?, ?, ?, ?)",
+                    (key, url, entry[0], sqlite3.Binary(data)),
+                )
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Treffer, Fehlschläge, Treffer aus der SQLite-Datei, Trefferquote und Einträge im Speicher."""
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._entries),
+            }
+
+    def purge(self) -> None:
+        """Entfernt abgelaufene Einträge aus Speicher und SQLite-Datei."""
+
+        now = time()
+        with self._lock:
+            for key in [key for key, (expires_at, _) in self._entries.items() if expires_at is not None and expires_at <= now]:
+                del self._entries[key]
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM query_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM query_cache")
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _remember(self, key: str, entry: Tuple[Optional[float], bytes]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_memory_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+def _range_stops(payload: Any):
+    """Alle ``range.stop``-Angaben einer Abfrage, beliebig tief verschachtelt."""
+
+    if isinstance(payload, dict):
+        for name, value in payload.items():
+            if name == NaoQueryCache.NAME_RANGE and isinstance(value, dict):
+                yield value.get(NaoQueryCache.NAME_STOP)
+            else:
+                yield from _range_stops(value)
+    elif isinstance(payload, list):
+        for value in payload:
+            yield from _range_stops(value)
+
+
+def _absolute_time(value: Any) -> Optional[datetime]:
+    """Absoluter Zeitpunkt oder ``None`` für relative Angaben wie ``now()`` oder ``-1d``."""
+
+    if isinstance(value, (int, float, datetime)):
+        return to_utc_datetime(value)
+    if not isinstance(value, str) or not value[:1].isdigit():
+        return None
+    try:
+        return to_utc_datetime(value)
+    except ValueError:
+        return None
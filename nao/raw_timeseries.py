@@ -0,0 +1,117 @@
+"""
+Spaltenorientiertes Lesen der Raw-API ``/api/series/data/raw``.
+
+Statt pro Messwert ein Dictionary und einen ``pd.to_datetime``-Aufruf zu
+erzeugen, werden die Listen der Antwort (``"format": "list"``) direkt in
+numpy-Spalten umgewandelt: Zeitstempel als ``int64`` in Nanosekunden (UTC),
+Werte als ``float64``. Lange Zeiträume werden in Zeitfenster geteilt, die
+der Client parallel abfragen und hier ohne Python-Schleife pro Zeile
+zusammensetzen kann.
+
+Anders als der Rest von ``naoconnect.nao`` benötigt dieses Modul numpy und
+wird deshalb nicht in ``naoconnect.nao`` re-exportiert.
+"""
+
+import warnings
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+RawColumns = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAME_RESULT = "result"
+NAME_ID = "id"
+NAME_TIME = "time"
+NAME_VALUE = "value"
+
+
+def split_time_range(start: datetime, stop: datetime, window: timedelta) -> List[Tuple[datetime, datetime]]:
+    """Teilt ``[start, stop]`` in aufeinanderfolgende Fenster der Länge ``window``."""
+
+    if window <= timedelta(0):
+        raise ValueError("window muss positiv sein.")
+    windows = []
+    window_start = start
+    while window_start < stop:
+        window_stop = min(stop, window_start + window)
+        windows.append((window_start, window_stop))
+        window_start = window_stop
+    return windows
+
+
+def parse_raw_result(response, factor: float = 1.0, ids: Optional[Iterable[str]] = None) -> RawColumns:
+    """
+    Wandelt eine Raw-API-Antwort in ``{id: (time_ns, value)}``.
+
+    ``None``-Werte werden wie bisher verworfen. Mit ``ids`` werden nur diese
+    Reihen übernommen.
+    """
+
+    if isinstance(response, dict) and NAME_RESULT not in response:
+        raise RuntimeError(f"Raw API Antwort ohne result: {response}")
+    result = response.get(NAME_RESULT, []) if isinstance(response, dict) else []
+    ids = set(ids) if ids is not None else None
+    columns: RawColumns = {}
+    for series_result in result:
+        series_id = series_result.get(NAME_ID)
+        if ids is not None and series_id not in ids:
+            continue
+        times = _to_ns(series_result.get(NAME_TIME, []))
+        values = np.asarray(series_result.get(NAME_VALUE, []), dtype=np.float64)
+        valid = ~np.isnan(values)
+        if factor != 1.0:
+            values = values * factor
+        columns[series_id] = (times[valid], values[valid])
+    return columns
+
+
+def concat_columns(parts: Iterable[RawColumns]) -> RawColumns:
+    """
+    Setzt die Spalten zeitlich aufeinanderfolgender Fenster zusammen.
+
+    Zeitstempel, die ein Fenster an der Grenze doppelt mit dem vorherigen
+    liefert, werden verworfen.
+    """
+
+    pieces: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    last_time: Dict[str, int] = {}
+    for part in parts:
+        for series_id, (times, values) in part.items():
+            if series_id in last_time and len(times):
+                keep = times > last_time[series_id]
+                times, values = times[keep], values[keep]
+            if len(times):
+                last_time[series_id] = int(times[-1])
+            pieces.setdefault(series_id, []).append((times, values))
+    return {
+        series_id: (
+            np.concatenate([times for times, _ in series_pieces]),
+            np.concatenate([values for _, values in series_pieces]),
+        )
+        for series_id, series_pieces in pieces.items()
+    }
+
+
+def _to_ns(times: list) -> np.ndarray:
+    if not times:
+        return np.empty(0, dtype=np.int64)
+    if not isinstance(times[0], str):
+        return np.asarray(times, dtype=np.int64)
+    text = np.char.rstrip(np.asarray(times, dtype=str), "Z")
+    try:
+        with warnings.catch_warnings():
+            # numpy parst Offsets wie +01:00 nur mit Warnung; dann exakt per datetime
+            warnings.simplefilter("error")
+            return text.astype("datetime64[ns]").astype(np.int64)
+    except (ValueError, UserWarning, DeprecationWarning):
+        return np.array([_iso_to_ns(value) for value in times], dtype=np.int64)
+
+
+def _iso_to_ns(value: str) -> int:
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - EPOCH) // timedelta(microseconds=1) * 1000
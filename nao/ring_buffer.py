@@ -0,0 +1,150 @@
+"""
+Begrenzter, thread-sicherer Zwischenspeicher für Telegraf-Zeilen.
+
+Im Logging- und Listener-Modus sammelt ``NaoApp`` die Zeilen bisher in einer
+Liste, die ohne Lock ausgetauscht wird und deren Obergrenze
+(``STANDARD_DATA_PER_FUNC_CALL``) nie greift: Ist NAO nicht erreichbar, wächst
+der Speicher unbegrenzt. ``TelegrafRingBuffer`` begrenzt Zeilen und Bytes und
+verwirft bei Überlauf je nach ``drop`` die ältesten oder die neuesten Zeilen.
+``dropped``, ``high_water`` und ``depth`` machen sichtbar, wie knapp der
+Puffer war.
+"""
+
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Iterable, List, Optional
+
+
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+
+def check_drop_policy(drop: str) -> str:
+    if drop not in DROP_POLICIES:
+        raise ValueError("drop muss eine von %s sein." % ", ".join(DROP_POLICIES))
+    return drop
+
+
+class TelegrafRingBuffer(object):
+    """
+    Parameter:
+        max_lines:
+            Höchstzahl gepufferter Zeilen (``None``: unbegrenzt).
+        max_bytes:
+            Höchstgröße in Bytes (Zeilenlänge plus Zeilenumbruch; das
+            Line-Protocol ist ASCII, Zeichen zählen als Bytes).
+        drop:
+            ``"oldest"`` verwirft bei Überlauf die ältesten Zeilen (aktuelle
+            Werte haben Vorrang), ``"newest"`` nimmt keine neuen Zeilen mehr an.
+
+    ``extend`` wird von den Erzeugern aufgerufen, ``take`` übernimmt den
+    Inhalt zum Senden. Schlägt das Senden fehl, legt ``requeue`` die Zeilen
+    wieder vorne an; auch dabei gelten die Grenzen.
+    """
+
+    DEFAULT_MAX_LINES = 200000
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(
+        self,
+        max_lines: Optional[int] = DEFAULT_MAX_LINES,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+        drop: str = DROP_OLDEST,
+    ) -> None:
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.drop = check_drop_policy(drop)
+        self.dropped = 0
+        self.high_water = 0
+        self.high_water_bytes = 0
+        self._lines: Deque[str] = deque()
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def extend(self, lines: Iterable[str]) -> int:
+        """Hängt ``lines`` an und liefert die Anzahl der aufgenommenen Zeilen."""
+
+        accepted = 0
+        with self._lock:
+            for line in lines:
+                if not line:
+                    continue
+                size = len(line) + 1
+                if self.drop == DROP_NEWEST and self._full(1, size):
+                    self.dropped += 1
+                    continue
+                self._lines.append(line)
+                self._nbytes += size
+                accepted += 1
+            self._trim()
+            self._mark()
+        return accepted
+
+    def append(self, line: str) -> bool:
+        return self.extend((line,)) == 1
+
+    def requeue(self, lines: List[str]) -> None:
+        """Legt nicht gesendete Zeilen wieder vor die neuen (in ursprünglicher Reihenfolge)."""
+
+        with self._lock:
+            for line in reversed(lines):
+                if line:
+                    self._lines.appendleft(line)
+                    self._nbytes += len(line) + 1
+            self._trim()
+            self._mark()
+
+    def take(self, max_lines: Optional[int] = None) -> List[str]:
+        """Übernimmt (höchstens ``max_lines``) Zeilen in Reihenfolge und entfernt sie."""
+
+        with self._lock:
+            if max_lines is None or max_lines >= len(self._lines):
+                lines = list(self._lines)
+                self._lines.clear()
+                self._nbytes = 0
+                return lines
+            lines = [self._lines.popleft() for _ in range(max_lines)]
+            self._nbytes -= sum(len(line) + 1 for line in lines)
+            return lines
+
+    def stats(self) -> Dict[str, int]:
+        """Verworfene Zeilen, Höchststand (Zeilen und Bytes) und aktuelle Tiefe."""
+
+        with self._lock:
+            return {
+                "dropped": self.dropped,
+                "high_water": self.high_water,
+                "high_water_bytes": self.high_water_bytes,
+                "depth": len(self._lines),
+                "nbytes": self._nbytes,
+            }
+
+    @property
+    def depth(self) -> int:
+        return len(self._lines)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def _full(self, lines: int, size: int) -> bool:
+        return (self.max_lines is not None and len(self._lines) + lines > self.max_lines) or (
+            self.max_bytes is not None and self._nbytes + size > self.max_bytes
+        )
+
+    def _trim(self) -> None:
+        # bei "newest" trifft das nur noch wieder eingereihte Zeilen: die neuesten fallen heraus
+        pop = self._lines.popleft if self.drop == DROP_OLDEST else self._lines.pop
+        while self._lines and self._full(0, 0):
+            self._nbytes -= len(pop()) + 1
+            self.dropped += 1
+
+    def _mark(self) -> None:
+        if len(self._lines) > self.high_water:
+            self.high_water = len(self._lines)
+        if self._nbytes > self.high_water_bytes:
+            self.high_water_bytes = self._nbytes
@@ -0,0 +1,370 @@
+"""
+Festplatten-Puffer für Telegraf-Uploads, die NAO nicht erreichen.
+
+``NaoApp.__DataTransferLoggingBuffer`` hält nicht gesendete Daten nur im
+Speicher und verwirft sie nach ``MAXBUFFERTIME``. ``TelegrafSpool`` schreibt
+solche Blöcke stattdessen in Segmentdateien (nur anhängen) in einem
+Verzeichnis und sendet sie nach dem nächsten erfolgreichen Upload gedrosselt
+nach. Ein Ausfall von einigen Stunden kostet so weder Daten noch Speicher.
+
+Aufbau:
+
+* ``<seq>.seg``: Segmente mit Einträgen ``Kopf + Präzision + Body``; der Kopf
+  enthält Länge, CRC32, Zeilenzahl und Zeitpunkt. Ein Eintrag ist ein Block
+  mit durch ``"\\n"`` getrennten Zeilen.
+* ``cursor``: Segment und Offset des ersten noch nicht angenommenen Eintrags,
+  atomar über ``os.replace`` geschrieben.
+
+Nach einem Absturz werden beim Öffnen alle Segmente geprüft; ein
+abgeschnittener oder beschädigter Eintrag am Ende wird abgetrennt. Einträge
+werden sofort an das Betriebssystem übergeben (``flush``) und gebündelt mit
+``fsync`` auf die Platte geschrieben (``fsync_interval``, ``fsync_bytes``).
+Über ``max_bytes`` werden die ältesten Einträge verworfen, ebenso Einträge
+älter als ``max_age``; beides zählt ``dropped_lines``.
+"""
+
+import os
+import struct
+import zlib
+from collections import deque
+from threading import Lock
+from time import monotonic, time
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from .bulk import RateLimiter
+from .telegraf import TELEGRAF_PRECISIONS, TelegrafSendResult
+
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+# Länge, CRC32, Zeilen, Zeitpunkt, Länge der Präzision
+RECORD_HEADER = struct.Struct("<IIIdB")
+TELEGRAF_LINE_SEPARATOR = b"\n"
+
+
+class _Record(object):
+    __slots__ = ("seq", "offset", "end", "lines", "created")
+
+    def __init__(self, seq: int, offset: int, end: int, lines: int, created: float) -> None:
+        self.seq = seq
+        self.offset = offset
+        self.end = end
+        self.lines = lines
+        self.created = created
+
+
+class TelegrafSpool(object):
+    """
+    Parameter:
+        path:
+            Verzeichnis der Segmente; wird bei Bedarf angelegt.
+        segment_bytes:
+            Größe, ab der ein neues Segment begonnen wird.
+        max_bytes:
+            Höchstgröße aller offenen Einträge; darüber fallen die ältesten heraus.
+        max_age:
+            Sekunden, nach denen ein Eintrag nicht mehr nachgesendet wird
+            (``None``: unbegrenzt).
+        fsync_interval, fsync_bytes:
+            ``fsync`` spätestens nach so vielen Sekunden bzw. Bytes.
+        replay_rate:
+            Zeilen pro Sekunde beim Nachsenden (``None``: ungedrosselt).
+        replay_lines:
+            Zeilen pro Aufruf von ``replay``, damit der laufende Transfer nicht
+            blockiert.
+        retry_interval:
+            Sekunden nach einem Fehler, in denen ``online`` ``False`` liefert und
+            direkt in den Puffer geschrieben wird, statt auf Timeouts zu warten.
+    """
+
+    DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+    DEFAULT_MAX_AGE = 7 * 24 * 3600.0
+    DEFAULT_FSYNC_INTERVAL = 1.0
+    DEFAULT_FSYNC_BYTES = 4 * 1024 * 1024
+    DEFAULT_REPLAY_RATE = 20000.0
+    DEFAULT_REPLAY_LINES = 100000
+    DEFAULT_RETRY_INTERVAL = 60.0
+    # 401/403 sind keine vorübergehenden Fehler: mit falschen Zugangsdaten
+    # würde sonst alles gepuffert, quittiert und nach max_age verworfen
+    STATUS_CODES_TRANSIENT = (408, 429)
+
+    def __init__(
+        self,
+        path: str,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: Optional[float] = DEFAULT_MAX_AGE,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        fsync_bytes: int = DEFAULT_FSYNC_BYTES,
+        replay_rate: Optional[float] = DEFAULT_REPLAY_RATE,
+        replay_lines: int = DEFAULT_REPLAY_LINES,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.segment_bytes = max(1, segment_bytes)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        self.replay_lines = max(1, replay_lines)
+        self.retry_interval = retry_interval
+        self.spooled_lines = 0
+        self.replayed_lines = 0
+        self.dropped_lines = 0
+        self.recovered_records = 0
+        self._limiter = RateLimiter(replay_rate) if replay_rate else None
+        self._records: Deque[_Record] = deque()
+        self._pending_lines = 0
+        self._pending_bytes = 0
+        self._file = None
+        self._seq = 0
+        self._unsynced = 0
+        self._synced_at = monotonic()
+        self._offline_until = 0.0
+        self._lock = Lock()
+        self._replay_lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+
+    @classmethod
+    def transient(cls, status: Optional[int]) -> bool:
+        """Ob ein Fehlerstatus (oder eine Ausnahme, ``None``) gepuffert werden soll."""
+
+        return (
+            status is None
+            or status == TelegrafSendResult.STATUS_ERROR
+            or status >= 500
+            or status in cls.STATUS_CODES_TRANSIENT
+        )
+
+    @property
+    def online(self) -> bool:
+        """``False`` bis ``retry_interval`` Sekunden nach dem letzten Fehler."""
+
+        return monotonic() >= self._offline_until
+
+    @property
+    def pending_lines(self) -> int:
+        return self._pending_lines
+
+    def set_offline(self) -> None:
+        self._offline_until = monotonic() + self.retry_interval
+
+    def append(self, payload: Union[list, str, bytes, bytearray], precision: Optional[str] = None) -> int:
+        """Schreibt einen Block in den Puffer und liefert die Anzahl der Zeilen."""
+
+        body, lines = _encode(payload)
+        if not lines:
+            return 0
+        precision_bytes = (precision or "").encode("ascii")
+        if precision and precision not in TELEGRAF_PRECISIONS:
+            raise ValueError("precision muss eine von %s sein." % ", ".join(TELEGRAF_PRECISIONS))
+        created = time()
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body), lines, created, len(precision_bytes)) + precision_bytes + body
+        with self._lock:
+            self._expire(created)
+            if len(record) > self.max_bytes:
+                self.dropped_lines += lines
+                return 0
+            while self._records and self._pending_bytes + len(record) > self.max_bytes:
+                self._drop_oldest()
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            offset = self._file.tell()
+            self._file.write(record)
+            self._file.flush()
+            self._records.append(_Record(self._seq, offset, offset + len(record), lines, created))
+            self._pending_lines += lines
+            self._pending_bytes += len(record)
+            self.spooled_lines += lines
+            self._unsynced += len(record)
+            if self._unsynced >= self.fsync_bytes or monotonic() - self._synced_at >= self.fsync_interval:
+                self._fsync()
+        return lines
+
+    def replay(self, send: Callable[[List[str], Optional[str]], bool], max_lines: Optional[int] = None) -> int:
+        """
+        Sendet die ältesten Einträge mit ``send(lines, precision)`` nach, bis
+        ``max_lines`` (Standard ``replay_lines``) erreicht sind, ``send``
+        ``False`` liefert oder der Puffer leer ist. Liefert die Anzahl der
+        angenommenen Zeilen. Läuft bereits ein Nachsenden, kehrt der Aufruf
+        sofort zurück.
+        """
+
+        if not self._replay_lock.acquire(blocking=False):
+            return 0
+        try:
+            max_lines = self.replay_lines if max_lines is None else max_lines
+            replayed = 0
+            while replayed < max_lines:
+                with self._lock:
+                    self._expire(time())
+                    if not self._records:
+                        break
+                    record = self._records[0]
+                    lines, precision = self._read(record)
+                if self._limiter:
+                    self._limiter.wait(record.lines)
+                try:
+                    ok = send(lines, precision)
+                except Exception:
+                    ok = False
+                if not ok:
+                    self.set_offline()
+                    break
+                with self._lock:
+                    if self._records and self._records[0] is record:
+                        self._ack()
+                replayed += record.lines
+                self.replayed_lines += record.lines
+            return replayed
+        finally:
+            self._replay_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Offene Zeilen und Bytes, Segmente sowie gepufferte, nachgesendete, verworfene Zeilen."""
+
+        with self._lock:
+            return {
+                "pending_lines": self._pending_lines,
+                "pending_bytes": self._pending_bytes,
+                "segments": len({record.seq for record in self._records}),
+                "spooled_lines": self.spooled_lines,
+                "replayed_lines": self.replayed_lines,
+                "dropped_lines": self.dropped_lines,
+                "recovered_records": self.recovered_records,
+            }
+
+    def flush(self) -> None:
+        """Schreibt alle Einträge mit ``fsync`` auf die Platte."""
+
+        with self._lock:
+            if self._file is not None:
+                self._fsync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._fsync()
+                self._file.close()
+                self._file = None
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, "%020d%s" % (seq, SEGMENT_SUFFIX))
+
+    def _recover(self) -> None:
+        """Liest Cursor und Segmente ein und trennt beschädigte Enden ab."""
+
+        cursor_seq, cursor_offset = self._read_cursor()
+        segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for seq in segments:
+            segment_path = self._segment_path(seq)
+            if seq < cursor_seq:
+                os.remove(segment_path)
+                continue
+            offset = 0
+            with open(segment_path, "r+b") as segment:
+                data = segment.read()
+                while offset + RECORD_HEADER.size <= len(data):
+                    length, crc, lines, created, precision_length = RECORD_HEADER.unpack_from(data, offset)
+                    end = offset + RECORD_HEADER.size + precision_length + length
+                    if end > len(data) or zlib.crc32(data[end - length:end]) != crc:
+                        break
+                    if seq > cursor_seq or offset >= cursor_offset:
+                        self._records.append(_Record(seq, offset, end, lines, created))
+                        self._pending_lines += lines
+                        self._pending_bytes += end - offset
+                        self.recovered_records += 1
+                    offset = end
+                if offset < len(data):
+                    segment.truncate(offset)
+            if not any(record.seq == seq for record in self._records):
+                os.remove(segment_path)
+        # neue Segmente müssen hinter dem Cursor liegen, sonst gelten sie beim
+        # nächsten Öffnen als abgearbeitet und werden gelöscht
+        self._seq = max(segments[-1] if segments else 0, cursor_seq - 1)
+
+    def _read_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE), "r") as cursor:
+                seq, offset = cursor.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _write_cursor(self) -> None:
+        if self._records:
+            seq, offset = self._records[0].seq, self._records[0].offset
+        else:
+            seq, offset = self._seq + 1, 0
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        with open(cursor_path + ".tmp", "w") as cursor:
+            cursor.write("%d %d" % (seq, offset))
+        os.replace(cursor_path + ".tmp", cursor_path)
+
+    def _read(self, record: _Record) -> Tuple[List[str], Optional[str]]:
+        if self._file is not None and record.seq == self._seq:
+            self._file.flush()
+        with open(self._segment_path(record.seq), "rb") as segment:
+            segment.seek(record.offset)
+            data = segment.read(record.end - record.offset)
+        precision_length = RECORD_HEADER.unpack_from(data)[4]
+        precision = data[RECORD_HEADER.size : RECORD_HEADER.size + precision_length].decode("ascii") or None
+        body = data[RECORD_HEADER.size + precision_length :]
+        return body.decode("utf-8").split("\n"), precision
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._fsync()
+            self._file.close()
+        self._seq += 1
+        self._file = open(self._segment_path(self._seq), "ab")
+
+    def _fsync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = monotonic()
+
+    def _ack(self) -> None:
+        """Entfernt den ältesten Eintrag und löscht vollständig abgearbeitete Segmente."""
+
+        record = self._records.popleft()
+        self._pending_lines -= record.lines
+        self._pending_bytes -= record.end - record.offset
+        self._write_cursor()
+        if self._records and self._records[0].seq == record.seq:
+            return
+        if record.seq == self._seq and self._file is not None:
+            self._file.close()
+            self._file = None
+        os.remove(self._segment_path(record.seq))
+
+    def _drop_oldest(self) -> None:
+        self.dropped_lines += self._records[0].lines
+        self._ack()
+
+    def _expire(self, now: float) -> None:
+        if self.max_age is None:
+            return
+        while self._records and self._records[0].created < now - self.max_age:
+            self._drop_oldest()
+
+
+def _encode(payload: Union[list, str, bytes, bytearray]) -> Tuple[bytes, int]:
+    """Body als UTF-8 und Anzahl der Zeilen."""
+
+    if isinstance(payload, list):
+        payload = [line for line in payload if line]
+        return "\n".join(payload).encode("utf-8"), len(payload)
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    body = bytes(payload).strip(TELEGRAF_LINE_SEPARATOR)
+    if not body:
+        return b"", 0
+    return body, body.count(TELEGRAF_LINE_SEPARATOR) + 1
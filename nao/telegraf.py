@@ -0,0 +1,279 @@
+"""
+Hilfsfunktionen für Telegraf-Line-Protocol-Uploads an ``/api/telegraf``.
+
+Die Zeilen der Schneid- und Aqotec-Synchronisation wiederholen fast
+vollständig denselben Präfix (``<asset>,instance=<instance> <series>=``).
+Mit gzip komprimiert schrumpft ein Upload dadurch typischerweise auf einen
+Bruchteil, was auf getakteten LTE-Verbindungen direkt Bandbreite spart.
+
+``TelegrafStreamBody`` kodiert große Blöcke erst beim Senden, damit neben der
+Zeilenliste keine weitere Kopie der Daten als String im Speicher liegt.
+
+Kompakte Kodierung: ``format_field_value`` schreibt Gleitkommazahlen in der
+kürzesten eindeutigen Darstellung statt mit ``%f`` (immer sechs
+Nachkommastellen) und ganzzahlige Zähler optional als Integer-Feld (``i``).
+Zeitstempel bleiben Ganzzahlen; für Quellen mit Minuten- oder
+Sekundenauflösung kann mit ``precision`` (``s``, ``ms``, ``us``) gröber
+geschrieben werden, NAO erhält die Auflösung über ``?precision=`` an der
+Schreib-URL.
+"""
+
+import zlib
+from numbers import Integral
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+TELEGRAF_LINE_SEPARATOR = "\n"
+TELEGRAF_BODY_TYPES = (str, bytes, bytearray)
+HEADER_CONTENT_ENCODING = "Content-Encoding"
+CONTENT_ENCODING_GZIP = "gzip"
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+GZIP_LINES_PER_BLOCK = 2000
+TELEGRAF_CHUNK_BYTES = 2 * 1024 * 1024
+TELEGRAF_PRECISIONS = {"ns": 1, "us": 1000, "ms": 1000000, "s": 1000000000}
+QUERY_PRECISION = "?precision=%s"
+
+
+def precision_divisor(precision: Optional[str]) -> int:
+    """Teiler von Nanosekunden auf ``precision``; ``None`` entspricht ``ns``."""
+
+    if precision is None:
+        return 1
+    if precision not in TELEGRAF_PRECISIONS:
+        raise ValueError("precision muss eine von %s sein." % ", ".join(TELEGRAF_PRECISIONS))
+    return TELEGRAF_PRECISIONS[precision]
+
+
+def telegraf_url(url: str, precision: Optional[str]) -> str:
+    """Schreib-URL mit ``?precision=``; ohne bzw. mit ``ns`` unverändert."""
+
+    if precision_divisor(precision) == 1:
+        return url
+    return url + QUERY_PRECISION % precision
+
+
+def format_field_value(value, integers: bool = False) -> str:
+    """
+    Feldwert in kompakter Darstellung.
+
+    Gleitkommazahlen in der kürzesten Darstellung, die beim Einlesen denselben
+    Wert ergibt (``repr``). Mit ``integers`` werden ganze Zahlen als
+    Integer-Feld (``42i``) geschrieben; das ist nur für Reihen sinnvoll, die
+    in NAO als Zähler angelegt sind, sonst entstehen Typkonflikte.
+    """
+
+    if integers and isinstance(value, Integral) and not isinstance(value, bool):
+        return "%di" % value
+    return repr(float(value))
+
+
+def gzip_telegraf_body(
+    payload: Union[str, bytes, Iterable[str]],
+    level: int = 6,
+) -> bytes:
+    """
+    Komprimiert einen Telegraf-Body als gzip-Stream.
+
+    Listen werden blockweise an den Kompressor übergeben, statt vorher den
+    kompletten String zu bauen. ``bytearray`` (z. B. von ``TelegrafEncoder``)
+    wird wie ``bytes`` behandelt. ``level`` entspricht der zlib-Stufe 1-9.
+    """
+
+    if not 1 <= level <= 9:
+        raise ValueError("gzip level muss zwischen 1 und 9 liegen.")
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if isinstance(payload, (bytes, bytearray)):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+        return compressor.compress(payload) + compressor.flush()
+    return b"".join(_iter_telegraf_blocks(payload, level))
+
+
+class TelegrafStreamBody(object):
+    """
+    Telegraf-Body, der erst beim Senden blockweise kodiert (und optional
+    komprimiert) wird.
+
+    ``http.client`` und ``AsyncNaoConnectionPool`` senden solche Bodies mit
+    ``Transfer-Encoding: chunked``; der vollständige Body-String entsteht nie.
+    Jede Iteration beginnt von vorn, so dass Wiederholungen nach
+    Verbindungsfehlern möglich bleiben, solange ``lines`` eine Liste ist.
+    """
+
+    def __init__(self, lines: Iterable[str], gzip_level: Optional[int] = None) -> None:
+        if gzip_level and not 1 <= gzip_level <= 9:
+            raise ValueError("gzip level muss zwischen 1 und 9 liegen.")
+        self.lines = lines
+        self.gzip_level = gzip_level
+
+    def __iter__(self) -> Iterator[bytes]:
+        return _iter_telegraf_blocks(self.lines, self.gzip_level)
+
+
+def telegraf_line_count(payload: Union[str, bytes, bytearray]) -> int:
+    """Anzahl der Zeilen eines fertigen Telegraf-Bodys."""
+
+    if not payload:
+        return 0
+    if isinstance(payload, str):
+        return payload.count(TELEGRAF_LINE_SEPARATOR) + 1
+    return payload.count(TELEGRAF_LINE_SEPARATOR.encode("ascii")) + 1
+
+
+def telegraf_headers(headers: dict, gzip_level: Optional[int]) -> dict:
+    """Ergänzt ``Content-Encoding: gzip``, wenn gzip aktiv ist."""
+
+    if gzip_level:
+        headers = dict(headers)
+        headers[HEADER_CONTENT_ENCODING] = CONTENT_ENCODING_GZIP
+    return headers
+
+
+def telegraf_chunk_end(payload: list, start: int, stop: int, max_bytes: Optional[int]) -> int:
+    """
+    Ende des Blocks ab ``start``, dessen serialisierter Body (UTF-8 inkl.
+    Zeilentrenner, vor gzip) höchstens ``max_bytes`` groß ist.
+
+    ``stop`` ist die Obergrenze aus der Zeilenzahl. Ohne ``max_bytes`` wird
+    ``stop`` zurückgegeben; eine einzelne Zeile über ``max_bytes`` bildet
+    einen eigenen Block.
+    """
+
+    if not max_bytes:
+        return stop
+    size = -len(TELEGRAF_LINE_SEPARATOR)
+    for position in range(start, stop):
+        line = payload[position]
+        size += len(TELEGRAF_LINE_SEPARATOR) + (len(line) if line.isascii() else len(line.encode("utf-8")))
+        if size > max_bytes and position > start:
+            return position
+    return stop
+
+
+def _iter_telegraf_blocks(lines: Iterable[str], gzip_level: Optional[int]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, GZIP_WBITS) if gzip_level else None
+    block = []
+    first = True
+    for line in lines:
+        block.append(line)
+        if len(block) >= GZIP_LINES_PER_BLOCK:
+            data = _encode_block(block, first)
+            block = []
+            first = False
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    if block:
+        data = _encode_block(block, first)
+        data = compressor.compress(data) if compressor else data
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def _encode_block(block: list, first: bool) -> bytes:
+    text = TELEGRAF_LINE_SEPARATOR.join(block)
+    if not first:
+        text = TELEGRAF_LINE_SEPARATOR + text
+    return text.encode("utf-8")
+
+
+class TelegrafSendError(ConnectionError):
+    """
+    Upload eines Iterators ist fehlgeschlagen. ``result`` enthält den nicht
+    angenommenen Abschnitt und die noch nicht gelesenen Zeilen und kann mit
+    ``resumeTelegrafData`` fortgesetzt werden.
+    """
+
+    def __init__(self, result: "TelegrafSendResult") -> None:
+        super().__init__("Telegraf-Upload fehlgeschlagen (Status %s)" % result.status)
+        self.result = result
+        self.status = result.status
+
+
+class TelegrafSendResult(object):
+    """
+    Ergebnis eines blockweisen Telegraf-Uploads mit den von NAO angenommenen
+    Zeilenbereichen.
+
+    ``accepted`` enthält sortierte, nicht überlappende ``(start, stop)``-
+    Bereiche (``stop`` exklusiv) bezogen auf ``payload``. ``status`` ist 204,
+    wenn der letzte Versuch vollständig erfolgreich war, sonst der erste
+    Fehlerstatus. Mit ``pending_ranges`` bzw. ``pending_lines`` lässt sich
+    genau der noch nicht angenommene Rest erneut senden.
+
+    Ist der erste Fehler eine Ausnahme (Timeout, Verbindungsabbruch), steht
+    ``status`` auf ``STATUS_ERROR`` und die Ausnahme in ``error``.
+    ``precision`` ist die Zeitstempel-Auflösung der Zeilen und gilt auch für
+    Wiederholungen. ``spooled`` zählt Zeilen, die statt an NAO in einen
+    ``TelegrafSpool`` geschrieben wurden (sie gelten als angenommen).
+    ``lane`` legt die Spur eines ``TelegrafPriorityScheduler`` fest
+    (``None``: nach Alter der Zeitstempel).
+
+    Bei Iteratoren ist ``payload`` der zuletzt gelesene Abschnitt und
+    ``remaining`` der Iterator mit den noch nicht gelesenen Zeilen;
+    ``streamed`` zählt die Zeilen der bereits vollständig angenommenen
+    Abschnitte. ``resumeTelegrafData`` sendet erst den Rest des Abschnitts und
+    liest dann aus ``remaining`` weiter.
+    """
+
+    STATUS_GOOD = 204
+    STATUS_ERROR = -1
+
+    def __init__(self, payload: list, status: int = STATUS_GOOD, precision: Optional[str] = None, lane: Optional[str] = None) -> None:
+        self.payload = payload
+        self.status = status
+        self.precision = precision
+        self.lane = lane
+        self.error: Optional[BaseException] = None
+        self.accepted: List[Tuple[int, int]] = []
+        self.spooled = 0
+        self.remaining: Optional[Iterator[str]] = None
+        self.streamed = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == self.STATUS_GOOD and self.accepted_count == len(self.payload)
+
+    @property
+    def accepted_count(self) -> int:
+        return sum(stop - start for start, stop in self.accepted)
+
+    def accept(self, start: int, stop: int) -> None:
+        """Markiert ``payload[start:stop]`` als angenommen."""
+
+        if start >= stop:
+            return
+        merged = []
+        for range_start, range_stop in sorted(self.accepted + [(start, stop)]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_stop))
+            else:
+                merged.append((range_start, range_stop))
+        self.accepted = merged
+
+    def pending_ranges(self) -> List[Tuple[int, int]]:
+        """Noch nicht angenommene ``(start, stop)``-Bereiche."""
+
+        pending = []
+        position = 0
+        for start, stop in self.accepted:
+            if start > position:
+                pending.append((position, start))
+            position = stop
+        if position < len(self.payload):
+            pending.append((position, len(self.payload)))
+        return pending
+
+    def pending_lines(self) -> list:
+        """Noch nicht angenommene Zeilen in ursprünglicher Reihenfolge."""
+
+        return [line for start, stop in self.pending_ranges() for line in self.payload[start:stop]]
+
+    def __repr__(self) -> str:
+        return "TelegrafSendResult(status=%s, accepted=%s/%s)" % (
+            self.status,
+            self.accepted_count,
+            len(self.payload),
+        )
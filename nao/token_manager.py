@@ -0,0 +1,158 @@
+"""
+Prozessweiter Token-Cache für NAO-Logins.
+
+Bisher hat jede Client-Instanz (``NaoApp``, ``NaoLoggerMessage``,
+``NaoAssetCreator`` ...) ihr eigenes Token gehalten und nach jedem Fehler
+einen vollständigen Login ausgeführt. ``NaoTokenManager`` hält pro Host und
+Benutzer genau ein Token, erneuert es kurz vor dem Ablauf des JWT und
+meldet sich nur dann neu an, wenn der Server das aktuelle Token mit 401 oder
+403 abgelehnt hat.
+"""
+
+import base64
+from json import loads
+from threading import Lock
+from time import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from .connection_pool import NaoConnectionPool, get_connection_pool
+
+
+class NaoLoginError(RuntimeError):
+    """Der Login bei NAO ist fehlgeschlagen."""
+
+
+class NaoTokenManager(object):
+    """
+    Verwaltet das Zugriffstoken eines Benutzers auf einem Host.
+
+    Parameter:
+        pool:
+            Verbindungspool des Hosts, über den der Login läuft.
+        email / password:
+            Zugangsdaten.
+        refresh_margin:
+            So viele Sekunden vor dem ``exp`` des JWT wird proaktiv neu
+            angemeldet.
+    """
+
+    URL_LOGIN = "/api/user/auth/login"
+    LOGIN_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+    NAME_ACCESS_TOKEN = "accessToken"
+    QUERY_BEARER = "Bearer "
+    DEFAULT_REFRESH_MARGIN = 120
+
+    def __init__(
+        self,
+        pool: NaoConnectionPool,
+        email: str,
+        password: str,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+    ) -> None:
+        self.pool = pool
+        self.email = email
+        self.refresh_margin = refresh_margin
+        self._login_payload = "email=%s&password=%s" % (quote(email), quote(password))
+        self._token: Optional[str] = None
+        self._expires_at: Optional[float] = None
+        self._lock = Lock()
+        self.login_count = 0
+
+    def set_password(self, password: str) -> None:
+        self._login_payload = "email=%s&password=%s" % (quote(self.email), quote(password))
+
+    def token(self) -> str:
+        """Gibt ein gültiges Token zurück und meldet sich bei Bedarf an."""
+
+        token = self._token
+        if token is not None and not self._expiring():
+            return token
+        with self._lock:
+            if self._token is None or self._expiring():
+                self._login()
+            return self._token
+
+    def authorization(self) -> str:
+        """Wert für den ``Authorization``-Header."""
+
+        return self.QUERY_BEARER + self.token()
+
+    def cached_authorization(self) -> Optional[str]:
+        """Wie ``authorization``, aber ohne Login; ``None``, wenn keiner gültig ist."""
+
+        token = self._token
+        if token is None or self._expiring():
+            return None
+        return self.QUERY_BEARER + token
+
+    def invalidate(self, rejected: Optional[str] = None) -> None:
+        """
+        Verwirft das Token nach einer 401/403-Antwort.
+
+        ``rejected`` ist das abgelehnte Token bzw. der abgelehnte
+        ``Authorization``-Wert. Hat ein anderer Client inzwischen bereits ein
+        neues Token geholt, bleibt dieses erhalten.
+        """
+
+        with self._lock:
+            if rejected is None or rejected in (self._token, self.QUERY_BEARER + str(self._token)):
+                self._token = None
+                self._expires_at = None
+
+    def _expiring(self) -> bool:
+        return self._expires_at is not None and time() >= self._expires_at - self.refresh_margin
+
+    def _login(self) -> None:
+        try:
+            response, raw_data = self.pool.request(
+                "POST", self.URL_LOGIN, self._login_payload, self.LOGIN_HEADERS
+            )
+        except Exception as exc:
+            raise NaoLoginError("Login zu NAO fehlgeschlagen: %s" % exc)
+        if response.status >= 400:
+            raise NaoLoginError(
+                "Login zu NAO fehlgeschlagen: HTTP %s - %s"
+                % (response.status, raw_data.decode("utf-8", errors="replace"))
+            )
+        try:
+            token = loads(raw_data.decode("utf-8"))[self.NAME_ACCESS_TOKEN]
+        except Exception as exc:
+            raise NaoLoginError("Login-Antwort konnte nicht gelesen werden: %s" % exc)
+        if not token:
+            raise NaoLoginError("Login erfolgreich, aber kein Zugriffstoken erhalten.")
+        self._token = token
+        self._expires_at = self._jwt_expiry(token)
+        self.login_count += 1
+
+    @staticmethod
+    def _jwt_expiry(token: str) -> Optional[float]:
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            return float(loads(base64.urlsafe_b64decode(payload))["exp"])
+        except Exception:
+            return None
+
+
+_MANAGERS: Dict[Tuple[str, bool, str], NaoTokenManager] = {}
+_MANAGERS_LOCK = Lock()
+
+
+def get_token_manager(
+    host: str,
+    email: str,
+    password: str,
+    local: bool = False,
+) -> NaoTokenManager:
+    """Liefert den prozessweit geteilten Token-Manager für Host und Benutzer."""
+
+    key = (host, bool(local), email)
+    with _MANAGERS_LOCK:
+        manager = _MANAGERS.get(key)
+        if manager is None:
+            manager = NaoTokenManager(get_connection_pool(host, local=local), email, password)
+            _MANAGERS[key] = manager
+        else:
+            manager.set_password(password)
+        return manager
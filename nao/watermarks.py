@@ -0,0 +1,100 @@
+"""
+Server-seitige Wasserstände für den Neustart von Konnektoren.
+
+Geht der lokale Sync-Zustand eines Konnektors verloren (TinyDB, SQLite oder
+JSON-Datei), beginnt er wieder beim Standard-Startdatum und lädt Jahre an
+Daten erneut hoch. Stattdessen kann der letzte in NAO gespeicherte
+Zeitstempel jeder Reihe gebündelt über ``/api/series/data/singlevalues`` mit
+dem Aggregat ``last`` abgefragt und als Sync-Zustand übernommen werden.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+AGGREGATE_LAST = "last"
+WATERMARK_BATCH_SIZE = 500
+WATERMARK_RANGE_START = "-3650d"
+NAME_RESULT = "result"
+NAME_ID = "id"
+NAME_TIME = "time"
+
+
+def batch_points(points: Iterable[dict], size: int = WATERMARK_BATCH_SIZE) -> Iterator[List[dict]]:
+    """Teilt die Punkte in Listen mit höchstens ``size`` Einträgen."""
+
+    if size < 1:
+        raise ValueError("size muss mindestens 1 sein.")
+    batch: List[dict] = []
+    for point in points:
+        batch.append(point)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def single_value_entries(response) -> List[dict]:
+    """
+    Einträge einer Singlevalues-Antwort als Liste von Dictionaries mit ``"id"``.
+
+    Akzeptiert eine Liste von ``{"id", "time", "value"}``, dieselbe Liste unter
+    ``"result"`` oder ein Dictionary ``{id: {"time", "value"}}``.
+    """
+
+    if isinstance(response, dict) and NAME_RESULT in response:
+        response = response[NAME_RESULT]
+    if isinstance(response, dict):
+        return [dict(entry, **{NAME_ID: series_id}) for series_id, entry in response.items() if isinstance(entry, dict)]
+    if isinstance(response, list):
+        return [entry for entry in response if isinstance(entry, dict)]
+    raise RuntimeError(f"Singlevalues Antwort nicht lesbar: {response}")
+
+
+def parse_last_timestamps(response) -> Dict[str, datetime]:
+    """
+    Liest ``{id: letzter Zeitstempel (UTC)}`` aus einer Singlevalues-Antwort.
+
+    Reihen ohne Zeitstempel (noch keine Daten in NAO) fehlen im Ergebnis.
+    """
+
+    ret = {}
+    for entry in single_value_entries(response):
+        timestamp = to_utc_datetime(entry.get(NAME_TIME))
+        if entry.get(NAME_ID) is not None and timestamp is not None:
+            ret[entry[NAME_ID]] = timestamp
+    return ret
+
+
+def to_utc_datetime(value) -> Optional[datetime]:
+    """ISO-String, Unix-Zeit (s, ms oder ns) oder ``datetime`` als zeitzonenbehaftetes UTC-``datetime``."""
+
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        timestamp = value
+    elif isinstance(value, (int, float)):
+        seconds = float(value)
+        while abs(seconds) > 1e11:
+            seconds /= 1000
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+    else:
+        timestamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def newer_watermark(local: Optional[datetime], server: Optional[datetime]) -> Optional[datetime]:
+    """
+    Der spätere der beiden Zeitpunkte.
+
+    Ein lokaler Stand wird nie zurückgesetzt; naive Zeitpunkte gelten als UTC.
+    """
+
+    if server is None:
+        return local
+    if local is None:
+        return server
+    return server if to_utc_datetime(server) > to_utc_datetime(local) else local
@@ -0,0 +1,287 @@
+import asyncio
+from urllib.parse import quote
+from json import loads, dumps
+from copy import copy
+from datetime import datetime, timezone
+from collections import deque
+from itertools import islice
+from naoconnect.naoappV2 import NaoApp
+from naoconnect.nao.async_connection_pool import AsyncNaoConnectionPool
+from naoconnect.nao.telegraf import TELEGRAF_BODY_TYPES, TelegrafSendError, TelegrafSendResult, TelegrafStreamBody, gzip_telegraf_body, telegraf_chunk_end, telegraf_headers, telegraf_line_count, telegraf_url
+from naoconnect.nao.congestion import TelegrafCongestionControl
+from naoconnect.nao.token_manager import get_token_manager
+'''
+Asyncio-Variante von naoappV2.NaoApp. Gleiche Rückgabewerte wie V2, aber alle
+Aufrufe sind Koroutinen und teilen sich einen Pool mit max_concurrency
+parallelen Verbindungen, so dass viele Uploads und Metadaten-Aufrufe in einer
+Event-Loop überlappen können:
+
+    async with AsyncNaoApp(host, email, password) as nao:
+        await asyncio.gather(*(nao.patchInstanceMeta(i, m, v) for i, m, v in items))
+'''
+
+class AsyncNaoApp():
+    DEFAULT_MAX_CONCURRENCY = 16
+
+    def __init__(self, host, email, password, local=False, data_per_telegraf_push:int=10000, Messager=False, timeout=120, max_concurrency:int=DEFAULT_MAX_CONCURRENCY, gzip_level:int=None, telegraf_window:int=1, congestion_control:TelegrafCongestionControl=None, telegraf_chunk_bytes:int=None): # type: ignore
+        self.auth = {
+            NaoApp.NAME_HOST:host,
+            NaoApp.NAME_PAYLOAD:NaoApp.NAME_EMAIL+"="+quote(email)+"&"+NaoApp.NAME_PASSWD+"="+quote(password)
+        }
+        self.timeout = timeout
+        self.headers = {"Authorization": "", 'Content-Type': 'text/plain', 'Cookie': ""}
+        self.data_per_telegraf_push=data_per_telegraf_push
+        self._pool = AsyncNaoConnectionPool(host, local=local, timeout=timeout, pool_size=max_concurrency)
+        self._tokens = get_token_manager(host, email, password, local=local)
+        self.local=local
+        self.Messager=Messager
+        self.gzip_level=gzip_level
+        self.telegraf_window=max(1, telegraf_window)
+        self.congestion_control=congestion_control
+        self.telegraf_chunk_bytes=telegraf_chunk_bytes
+
+    async def __aenter__(self):
+        return(self)
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._pool.close()
+
+    async def _loginNao(self):
+        '''
+        Token aus dem prozessweiten Token-Cache, den sich AsyncNaoApp mit den
+        synchronen Clients teilt. Nur wenn kein gültiges Token vorliegt, wird der
+        (seltene, blockierende) Login in einem Thread ausgeführt.
+        '''
+        authorization = self._tokens.cached_authorization()
+        if authorization is None:
+            try:
+                authorization = await asyncio.to_thread(self._tokens.authorization)
+            except:
+                await asyncio.sleep(1)
+                authorization = await asyncio.to_thread(self._tokens.authorization)
+        self.headers[NaoApp.NAME_WEBAUTH] = authorization
+
+    async def sendSingleData(self, asset:str, instance:str, sensor:str, value:float, timestamp_use:datetime=None) -> int:
+        if not timestamp_use: timestamp_use=datetime.now(timezone.utc)
+        time_int = str(int(timestamp_use.timestamp()*1000000000))
+        return(await self._sendTelegrafData(NaoApp.TELEGRAF_FORMATER%(asset,instance,sensor,value,time_int)))
+
+    async def _sendDataToNaoJson(self, method, url, payload) -> dict:
+        if payload != None:
+            payload = dumps(payload)
+        for attempt in range(2):
+            await self._loginNao()
+            header = copy(self.headers)
+            header[NaoApp.NAME_CONTENT_HEADER] = NaoApp.QUERY_HEADER_JSON
+            try:
+                res, data = await self._pool.request(method, url, payload, header, timeout=self.timeout)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if res.status not in NaoApp.STATUS_CODES_AUTH:
+                break
+            self._tokens.invalidate(header[NaoApp.NAME_WEBAUTH])
+        if data == b'':
+            return('') # type: ignore
+        else:
+            try:
+                return(loads(data))
+            except:
+                return(-1) # type: ignore
+
+    async def patchInstanceMeta(self, instance_id, meta_id, value, start:datetime=None):
+        if not start: start=datetime.now(timezone.utc)
+        payload = {
+            "history": [
+                {
+                    "value": value,
+                    "start": start.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                }
+            ]
+        }
+        return(await self._sendDataToNaoJson(NaoApp.NAME_PATCH, NaoApp.URL_PATCH_META_INSTANCE%(instance_id, meta_id), payload))
+
+    async def patchInstanceMetaHistory(self, instance_id:str,  meta_id:str, history:list) -> dict:
+        '''
+        history = [
+            {
+                "value": <value>,
+                "start": <datetime>
+            }
+        ]
+        '''
+        for hist in history:
+            if isinstance(hist["start"], datetime):
+                hist["start"] = hist["start"].strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        payload = {
+            "history": history
+        }
+        return(await self._sendDataToNaoJson(NaoApp.NAME_PATCH, NaoApp.URL_PATCH_META_INSTANCE%(instance_id, meta_id), payload))
+
+    async def patchInstanceData(self, instance_id:str, payload:dict):
+        return(await self._sendDataToNaoJson(NaoApp.NAME_PATCH, NaoApp.URL_PATCH_INSTANCE%(instance_id), payload))
+
+    async def sendTelegrafData(self, payload:list, max_sleep:float=2, values_count:int=None, precision:str=None):
+        '''
+        [ '<asset_id>,instance=<insatance-id> <series-id>=<value> <timestamp-nano-second>' ]
+                                      or
+          '<asset_id>,instance=<insatance-id> <series-id>=<value> <timestamp-nano-second>'
+                                      or
+          Iterator/Generator solcher Zeilen (wird blockweise gelesen und gestreamt;
+          bei einem Fehler wird TelegrafSendError mit dem nicht gesendeten Rest
+          in error.result ausgelöst, weiter mit resumeTelegrafData)
+        '''
+        if not isinstance(payload, (list,)+TELEGRAF_BODY_TYPES):
+            result = await self.sendTelegrafDataResumable(payload, max_sleep=max_sleep, values_count=values_count, precision=precision)
+            if not result.ok:
+                raise TelegrafSendError(result) from result.error
+            return(result.status)
+        elif type(payload) != list:
+            sta = await self._sendTelegrafData(payload=payload, precision=precision)
+            if self.Messager:
+                count = telegraf_line_count(payload)
+                await asyncio.to_thread(self.Messager.sendCount, count)
+            return(sta)
+        else:
+            result = await self.sendTelegrafDataResumable(payload, max_sleep=max_sleep, values_count=values_count, precision=precision)
+            if result.error is not None:
+                raise result.error
+            return(result.status)
+
+    async def sendTelegrafDataResumable(self, payload:list, max_sleep:float=2, values_count:int=None, precision:str=None) -> TelegrafSendResult:
+        '''
+        Wie naoappV2.NaoApp.sendTelegrafDataResumable.
+        '''
+        if not isinstance(payload, (list,)+TELEGRAF_BODY_TYPES):
+            result = TelegrafSendResult([], precision=precision)
+            result.remaining = iter(payload)
+            return(await self.resumeTelegrafData(result, max_sleep=max_sleep, values_count=values_count))
+        return(await self.resumeTelegrafData(TelegrafSendResult(payload, precision=precision), max_sleep=max_sleep, values_count=values_count))
+
+    async def resumeTelegrafData(self, result:TelegrafSendResult, max_sleep:float=2, values_count:int=None) -> TelegrafSendResult:
+        '''
+        Wie naoappV2.NaoApp.resumeTelegrafData: sendet nur die noch nicht
+        angenommenen Zeilen von result.
+        '''
+        if result.remaining is not None:
+            return(await self._sendTelegrafIterable(result, max_sleep=max_sleep, values_count=values_count))
+        result.status = NaoApp.STATUS_CODE_GOOD
+        result.error = None
+        await self._sendTelegrafRanges(result, (
+            chunk for start, stop in result.pending_ranges() for chunk in self._telegrafChunkRanges(result.payload, start, stop)
+        ), max_sleep)
+        if result.ok and self.Messager:
+            await asyncio.to_thread(self.Messager.sendCount, values_count if values_count else len(result.payload))
+        return(result)
+
+    async def _sendTelegrafIterable(self, result:TelegrafSendResult, max_sleep:float=2, values_count:int=None) -> TelegrafSendResult:
+        '''
+        Wie naoappV2.NaoApp._sendTelegrafIterable.
+        '''
+        result.status = NaoApp.STATUS_CODE_GOOD
+        result.error = None
+        while True:
+            if result.pending_ranges():
+                await self._sendTelegrafRanges(result, (
+                    chunk for start, stop in result.pending_ranges() for chunk in self._telegrafChunkRanges(result.payload, start, stop)
+                ), max_sleep)
+                if not result.ok:
+                    return(result)
+            result.streamed += len(result.payload)
+            size = self.congestion_control.chunk_size*self.congestion_control.max_window if self.congestion_control else self.data_per_telegraf_push*self.telegraf_window
+            chunk = list(islice(result.remaining, size))
+            if not chunk:
+                break
+            result.payload = chunk
+            result.accepted = []
+        result.remaining = None
+        if self.Messager:
+            await asyncio.to_thread(self.Messager.sendCount, values_count if values_count else result.streamed)
+        return(result)
+
+    async def _sendTelegrafRanges(self, result:TelegrafSendResult, ranges, max_sleep:float) -> None:
+        '''
+        Wie naoappV2.NaoApp._sendTelegrafRanges: bis zu telegraf_window Blöcke
+        gleichzeitig, bestätigte Blöcke landen in result.accepted, nach dem ersten
+        Fehler wird kein weiterer Block gestartet.
+        '''
+        in_flight = deque()
+        pace = not self.congestion_control and self.telegraf_window == 1
+        try:
+            for idx, (start, stop) in enumerate(ranges):
+                if len(in_flight) >= self._currentTelegrafWindow():
+                    if not await self._collectTelegrafRange(result, *in_flight.popleft()):
+                        break
+                    if pace:
+                        await asyncio.sleep(min(max_sleep, 0.1+(idx-1)*0.04))
+                in_flight.append((start, stop, asyncio.ensure_future(self._sendTelegrafData(result.payload[start:stop], result.precision))))
+            while in_flight:
+                await self._collectTelegrafRange(result, *in_flight.popleft())
+        finally:
+            for _, _, task in in_flight:
+                task.cancel()
+
+    async def _collectTelegrafRange(self, result:TelegrafSendResult, start:int, stop:int, task) -> bool:
+        try:
+            sta = await task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            sta = TelegrafSendResult.STATUS_ERROR
+            if result.status == NaoApp.STATUS_CODE_GOOD:
+                result.error = e
+        if sta == NaoApp.STATUS_CODE_GOOD:
+            result.accept(start, stop)
+            return(True)
+        if result.status == NaoApp.STATUS_CODE_GOOD:
+            result.status = sta
+        return(False)
+
+    def _currentTelegrafWindow(self) -> int:
+        if self.congestion_control:
+            return(self.congestion_control.window)
+        return(self.telegraf_window)
+
+    def _telegrafChunkRanges(self, payload:list, start:int, stop:int):
+        while start < stop:
+            size = self.congestion_control.chunk_size if self.congestion_control else self.data_per_telegraf_push
+            end = telegraf_chunk_end(payload, start, min(stop, start+size), self.telegraf_chunk_bytes)
+            yield (start, end)
+            start = end
+
+    async def _sendTelegrafData(self, payload, precision:str=None):
+        if type(payload) == list:
+            payload = TelegrafStreamBody(payload, self.gzip_level)
+        elif self.gzip_level:
+            payload = gzip_telegraf_body(payload, self.gzip_level)
+        for attempt in range(2):
+            await self._loginNao()
+            try:
+                status = await self._postTelegraf(payload, precision)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if status == NaoApp.STATUS_CODE_GOOD:
+                break
+            if status in NaoApp.STATUS_CODES_AUTH:
+                self._tokens.invalidate(self.headers[NaoApp.NAME_WEBAUTH])
+        return(status)
+
+    async def _postTelegraf(self, payload, precision:str=None) -> int:
+        request = lambda: self._pool.request(NaoApp.NAME_POST, telegraf_url(NaoApp.URL_TELEGRAF, precision), payload, telegraf_headers(self.headers, self.gzip_level), timeout=self.timeout)
+        if self.congestion_control:
+            res, _ = await self.congestion_control.send_async(request)
+        else:
+            res, _ = await request()
+        return(res.status)
+
+    async def getPlotformatetTimeseries(self, select):
+        return(await self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_PLOT_TIMESERIES, payload=select))
+
+    async def getRawformatetTimeseries(self, select):
+        return(await self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_RAW_TIMESERIES, payload=select))
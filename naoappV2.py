@@ -1,12 +1,27 @@
 'Autor: Rupert Wieser -- Naotilus -- 20232209'
-import http.client
 from urllib.parse import quote
 from json import loads, dumps
 from copy import copy
 from time import sleep
-from datetime import datetime, timezone
-from math import ceil
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+from naoconnect.nao.connection_pool import get_connection_pool
+from naoconnect.nao.telegraf import TELEGRAF_BODY_TYPES, TelegrafSendError, TelegrafSendResult, TelegrafStreamBody, gzip_telegraf_body, telegraf_chunk_end, telegraf_headers, telegraf_line_count, telegraf_url
+from naoconnect.nao.congestion import TelegrafCongestionControl
+from naoconnect.nao.token_manager import get_token_manager
+from naoconnect.nao.metadata_cache import NaoMetadataCache
+from naoconnect.nao.query_cache import NaoQueryCache
+from naoconnect.nao.dedup import TelegrafDedupWindow
+from naoconnect.nao.spool import TelegrafSpool
+from naoconnect.nao.priority import LANE_BACKFILL, TelegrafPriorityScheduler, check_lane
+from naoconnect.nao.bulk import run_bulk
+from naoconnect.nao.raw_timeseries import concat_columns, parse_raw_result, split_time_range
+from naoconnect.nao.watermarks import AGGREGATE_LAST, WATERMARK_BATCH_SIZE, WATERMARK_RANGE_START, batch_points, parse_last_timestamps
+from naoconnect.nao.gap_audit import AGGREGATE_COUNT, parse_counts
 
 class NaoApp():
     NAME_HOST = "host"
@@ -41,6 +56,7 @@ class NaoApp():
     URL_PLOT_TIMESERIES = "/api/series/data/plot"
     URL_RAW_TIMESERIES = "/api/series/data/raw"
     URL_RAW_ALIGNED_TIMESERIES = "/api/series/data/raw/instance-aligned"
+    URL_SINGELVALUES = "/api/series/data/singlevalues"
     URL_INSTANCE_MORE = "/api/nao/instance/more/%s"
     URL_WORKSPACE = "/api/nao/workspace"
     URL_ACTIVATE_DATAPOINT = "/api/nao/instance/%s/datapoints"
@@ -55,10 +71,14 @@ class NaoApp():
     URL_LOGIN = "/api/user/auth/login"
     FORMAT_TELEFRAF_FRAME_SEPERATOR = "\n"
     STATUS_CODE_GOOD = 204
+    STATUS_CODES_AUTH = (401, 403)
+    DEFAULT_BULK_WORKERS = 8
+    DEFAULT_RAW_WINDOW = timedelta(days=30)
+    DEFAULT_RAW_WORKERS = 4
     QUERY_GET = "?query="
     TELEGRAF_FORMATER = "%s,instance=%s %s=%s %s"
 
-    def __init__(self, host, email, password, local=False, data_per_telegraf_push:int=10000, Messager=False, timeout=120): # type: ignore
+    def __init__(self, host, email, password, local=False, data_per_telegraf_push:int=10000, Messager=False, timeout=120, pool_size:int=None, gzip_level:int=None, telegraf_window:int=1, congestion_control:TelegrafCongestionControl=None, telegraf_chunk_bytes:int=None, metadata_cache:NaoMetadataCache=None, query_cache:NaoQueryCache=None, dedup_window:TelegrafDedupWindow=None, spool:TelegrafSpool=None, priority_scheduler:TelegrafPriorityScheduler=None): # type: ignore
         self.auth = {
             NaoApp.NAME_HOST:host,
             NaoApp.NAME_PAYLOAD:NaoApp.NAME_EMAIL+"="+quote(email)+"&"+NaoApp.NAME_PASSWD+"="+quote(password)
@@ -66,9 +86,20 @@ class NaoApp():
         self.timeout = timeout
         self.headers = {"Authorization": "", 'Content-Type': 'text/plain', 'Cookie': ""}
         self.data_per_telegraf_push=data_per_telegraf_push
-        self._conneciton = None # type: ignore
+        self.telegraf_window=max(1, telegraf_window)
+        self.congestion_control=congestion_control
+        self.telegraf_chunk_bytes=telegraf_chunk_bytes
+        self.metadata_cache=metadata_cache
+        self.query_cache=query_cache
+        self.dedup_window=dedup_window
+        self.spool=spool
+        self.priority_scheduler=priority_scheduler
+        max_window = max(self.telegraf_window, congestion_control.max_window if congestion_control else 1)
+        self._pool = get_connection_pool(host, local=local, pool_size=max(pool_size or 0, max_window) if max_window > 1 else pool_size)
+        self._tokens = get_token_manager(host, email, password, local=local)
         self.local=local
         self.Messager=Messager
+        self.gzip_level=gzip_level
 
     def sendSingleData(self, asset:str, instance:str, sensor:str, value:float, timestamp_use:datetime=None) -> int:
         if not timestamp_use: timestamp_use=datetime.now(timezone.utc)
@@ -76,10 +107,16 @@ class NaoApp():
         return(self._sendTelegrafData(NaoApp.TELEGRAF_FORMATER%(asset,instance,sensor,value,time_int)))
 
     def _loginNao(self):
-        if self.local:
-            self._loginNaoLocal()
-        else:
-            self._loginNaoCloud()
+        '''
+        Übernimmt das Token aus dem prozessweiten Token-Cache (pro Host und Benutzer).
+        Ein echter Login findet nur statt, wenn noch kein Token existiert, das JWT
+        kurz vor dem Ablauf steht oder das Token nach 401/403 verworfen wurde.
+        '''
+        try:
+            self.headers[NaoApp.NAME_WEBAUTH] = self._tokens.authorization()
+        except:
+            sleep(1) # type: ignore
+            self.headers[NaoApp.NAME_WEBAUTH] = self._tokens.authorization()
     
     def getUserId(self):
         ret = self._sendDataToNaoJson(NaoApp.NAME_GET,NaoApp.URL_GET_USER_INFO,{})
@@ -90,36 +127,6 @@ class NaoApp():
         ret = self._sendDataToNaoJson(NaoApp.NAME_POST,url=NaoApp.URL_PUT_NOTE,payload=data_note)
         return(ret[NaoApp.NAME__ID])
 
-    def _loginNaoLocal(self):
-        try:
-            self._conneciton = http.client.HTTPConnection(self.auth[NaoApp.NAME_HOST],timeout=self.timeout)
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_LOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.QUERY_LOGINHEADER)
-            res = self._conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.QUERY_BEARER + data[NaoApp.NAME_TOKENAC]
-        except:
-            sleep(1) # type: ignore
-            self._conneciton = http.client.HTTPConnection(self.auth[NaoApp.NAME_HOST],timeout=self.timeout)
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_LOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.QUERY_LOGINHEADER)
-            res = self._conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.QUERY_BEARER + data[NaoApp.NAME_TOKENAC]
-
-    def _loginNaoCloud(self):
-        try:
-            self._conneciton = http.client.HTTPSConnection(self.auth[NaoApp.NAME_HOST],timeout=self.timeout)
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_LOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.QUERY_LOGINHEADER)
-            res = self._conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.QUERY_BEARER + data[NaoApp.NAME_TOKENAC]
-        except:
-            sleep(1) # type: ignore
-            self._conneciton = http.client.HTTPSConnection(self.auth[NaoApp.NAME_HOST],timeout=self.timeout)
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_LOGIN, self.auth[NaoApp.NAME_PAYLOAD], NaoApp.QUERY_LOGINHEADER)
-            res = self._conneciton.getresponse()
-            data = loads(res.read().decode(NaoApp.NAME_UTF8))
-            self.headers[NaoApp.NAME_WEBAUTH] = NaoApp.QUERY_BEARER + data[NaoApp.NAME_TOKENAC]
-
     def createWorkspace(self, name, avatar=None):
         payload = {
             NaoApp.NAME_NAME: name,
@@ -156,29 +163,46 @@ class NaoApp():
         }
         return(self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_ACTIVATE_DATAPOINT%(instance_id), payload))
 
-    def _sendDataToNaoJson(self, method, url, payload) -> dict:
-        header = copy(self.headers)
-        header[NaoApp.NAME_CONTENT_HEADER] = NaoApp.QUERY_HEADER_JSON
+    def _sendDataToNaoJson(self, method, url, payload, use_cache:bool=True) -> dict:
+        cache = self.metadata_cache if self.metadata_cache and method == NaoApp.NAME_GET and self.metadata_cache.cacheable(url) else None
+        if cache:
+            data = cache.get(self.auth[NaoApp.NAME_HOST], url)
+            if data is not None:
+                return(loads(data))
+        query = payload if use_cache and self.query_cache and method == NaoApp.NAME_POST and self.query_cache.cacheable(url) else None
+        if query is not None:
+            data = self.query_cache.get(self.auth[NaoApp.NAME_HOST], url, query)
+            if data is not None:
+                return(loads(data))
         if payload != None:
             payload = dumps(payload)
-        try:
-            self._conneciton.request(method, url, payload, header) # type: ignore
-            data = self._conneciton.getresponse().read() # type: ignore
-            self._conneciton.close() # type: ignore
-        except:
+        for attempt in range(2):
             self._loginNao()
             header = copy(self.headers)
             header[NaoApp.NAME_CONTENT_HEADER] = NaoApp.QUERY_HEADER_JSON
-            self._conneciton.request(method, url, payload, header) # type: ignore
-            data = self._conneciton.getresponse().read() # type: ignore
-            self._conneciton.close() # type: ignore
+            try:
+                res, data = self._pool.request(method, url, payload, header, timeout=self.timeout)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if res.status not in NaoApp.STATUS_CODES_AUTH:
+                break
+            self._tokens.invalidate(header[NaoApp.NAME_WEBAUTH])
+        if self.metadata_cache and method != NaoApp.NAME_GET:
+            self.metadata_cache.invalidate(self.auth[NaoApp.NAME_HOST], url)
         if data == b'':
             return('') # type: ignore
         else:
             try:
-                return(loads(data))
+                ret = loads(data)
             except:
                 return(-1) # type: ignore
+            if cache and res.status < 300:
+                cache.put(self.auth[NaoApp.NAME_HOST], url, data)
+            if query is not None and res.status < 300:
+                self.query_cache.put(self.auth[NaoApp.NAME_HOST], url, query, data)
+            return(ret)
             
     def patchInstanceMeta(self, instance_id, meta_id, value, start:datetime=datetime.now(timezone.utc)):
         '''
@@ -212,67 +236,316 @@ class NaoApp():
     
     def patchInstanceData(self, instance_id:str, payload:dict):
         return(self._sendDataToNaoJson(NaoApp.NAME_PATCH, NaoApp.URL_PATCH_INSTANCE%(instance_id), payload))
+
+    def patchInstanceMetaMany(self, items:list, max_workers:int=DEFAULT_BULK_WORKERS, rate_limit:float=None) -> list:
+        '''
+        items = [ (instance_id, meta_id, value) ] oder [ (instance_id, meta_id, value, start) ]
+
+        Patcht viele Attribute mit höchstens max_workers parallelen Anfragen und
+        höchstens rate_limit Anfragen pro Sekunde. Rückgabe ist pro Eintrag ein
+        BulkOutcome (item, result, error, ok) in der Reihenfolge von items; ok ist
+        True, wenn NAO das Attribut mit _id zurückgeliefert hat.
+        '''
+        start = datetime.now(timezone.utc)
+        return(self._runBulk(lambda item: self.patchInstanceMeta(*item) if len(item) > 3 else self.patchInstanceMeta(*item, start=start), items, max_workers, rate_limit))
+
+    def patchInstanceMetaHistoryMany(self, items:list, max_workers:int=DEFAULT_BULK_WORKERS, rate_limit:float=None) -> list:
+        '''
+        items = [ (instance_id, meta_id, history) ], history wie bei patchInstanceMetaHistory
+        '''
+        return(self._runBulk(lambda item: self.patchInstanceMetaHistory(*item), items, max_workers, rate_limit))
+
+    def _runBulk(self, function, items:list, max_workers:int, rate_limit:float) -> list:
+        if self._pool.pool_size < max_workers:
+            self._pool.resize(max_workers)
+        return(run_bulk(function, items, max_workers=max_workers, rate_limit=rate_limit, is_ok=lambda ret: isinstance(ret, dict) and NaoApp.NAME__ID in ret))
     
-    def sendTelegrafData(self, payload:list, max_sleep:float=2, values_count:int=None):
+    def sendTelegrafData(self, payload:list, max_sleep:float=2, values_count:int=None, precision:str=None, lane:str=None):
         ''' 
         [ '<asset_id>,instance=<insatance-id> <series-id>=<value> <timestamp-nano-second>' ] 
                                       or
           '<asset_id>,instance=<insatance-id> <series-id>=<value> <timestamp-nano-second>'
+                                      or
+          Iterator/Generator solcher Zeilen (wird blockweise gelesen und gestreamt;
+          bei einem Fehler wird TelegrafSendError mit dem nicht gesendeten Rest
+          in error.result ausgelöst, weiter mit resumeTelegrafData)
+                                      or
+          bytes/bytearray mit durch "\n" getrennten Zeilen (z. B. TelegrafEncoder.take())
+
+        Mit dedup_window werden bereits angenommene Zeilen (gleiche Reihe,
+        Instanz und Zeitstempel) vor dem Senden verworfen; die Anzahl liefert
+        dedup_window.stats()["suppressed"].
+
+        precision ("s", "ms", "us") gibt die Auflösung der Zeitstempel an, wenn
+        die Zeilen gröber als in Nanosekunden kodiert sind (?precision= an der URL).
+
+        Mit spool werden Blöcke, die NAO wegen eines vorübergehenden Fehlers
+        (Timeout, 5xx, 429, ...) nicht annimmt, auf die Festplatte geschrieben und
+        gelten als gesendet (204). Nach dem nächsten erfolgreichen Upload sendet
+        replaySpool sie gedrosselt nach.
+
+        Mit priority_scheduler teilen sich aktuelle Werte ("live") und
+        Nachladungen ("backfill") die Leitung gewichtet; lane legt die Spur fest,
+        ohne lane wird jeder Block nach dem Alter seiner Zeitstempel zugeordnet.
         '''
-        if type(payload) != list:
-            sta = self._sendTelegrafData(payload=payload)
+        check_lane(lane)
+        if self.dedup_window and isinstance(payload, TELEGRAF_BODY_TYPES):
+            payload = (payload if isinstance(payload, str) else payload.decode(NaoApp.NAME_UTF8)).split(NaoApp.FORMAT_TELEFRAF_FRAME_SEPERATOR)
+        if not isinstance(payload, (list,)+TELEGRAF_BODY_TYPES):
+            result = self.sendTelegrafDataResumable(payload, max_sleep=max_sleep, values_count=values_count, precision=precision, lane=lane)
+            if not result.ok:
+                raise TelegrafSendError(result) from result.error
+            return(result.status)
+        elif type(payload) != list:
+            sta = self._sendTelegrafBody(payload, precision, lane)
             if self.Messager:
-                count = len(payload.split("\n"))
+                count = telegraf_line_count(payload)
                 self.Messager.sendCount(count)
             return(sta)
         else:
-            count = len(payload)
-            if count > self.data_per_telegraf_push:
-                for idx in range(int(ceil(len(payload)/self.data_per_telegraf_push))):
-                    start = int(idx*self.data_per_telegraf_push)
-                    stop = start+self.data_per_telegraf_push
-                    sta = self._sendTelegrafData(payload[start:stop])
-                    if sta != 204:
-                        return(sta)
-                    if 0.1+idx*0.04 > max_sleep:
-                        sleep(max_sleep)
-                    else:
-                        sleep(0.1+idx*0.04)
+            result = self.sendTelegrafDataResumable(payload, max_sleep=max_sleep, values_count=values_count, precision=precision, lane=lane)
+            if result.error is not None:
+                raise result.error
+            return(result.status)
+
+    def sendTelegrafDataResumable(self, payload:list, max_sleep:float=2, values_count:int=None, precision:str=None, lane:str=None) -> TelegrafSendResult:
+        '''
+        Wie sendTelegrafData, liefert aber ein TelegrafSendResult mit den von NAO
+        angenommenen Zeilenbereichen (result.accepted) statt nur eines Status.
+        Nach einem Teilfehler sendet resumeTelegrafData nur den Rest:
+
+            result = nao.sendTelegrafDataResumable(lines)
+            if not result.ok:
+                sleep(10)
+                nao.resumeTelegrafData(result)
+
+        Iteratoren werden abschnittsweise gelesen; nach einem Fehler stehen die
+        noch nicht gelesenen Zeilen in result.remaining.
+        '''
+        if not isinstance(payload, (list,)+TELEGRAF_BODY_TYPES):
+            result = TelegrafSendResult([], precision=precision, lane=check_lane(lane))
+            result.remaining = iter(payload)
+            return(self.resumeTelegrafData(result, max_sleep=max_sleep, values_count=values_count))
+        if self.dedup_window:
+            payload = self.dedup_window.filter(payload)
+        return(self.resumeTelegrafData(TelegrafSendResult(payload, precision=precision, lane=check_lane(lane)), max_sleep=max_sleep, values_count=values_count))
+
+    def resumeTelegrafData(self, result:TelegrafSendResult, max_sleep:float=2, values_count:int=None) -> TelegrafSendResult:
+        '''
+        Sendet nur die noch nicht angenommenen Zeilen von result erneut und
+        aktualisiert result (status, error, accepted). Der Messager zählt den
+        Payload erst, wenn er vollständig angenommen wurde.
+        '''
+        if result.remaining is not None:
+            return(self._sendTelegrafIterable(result, max_sleep=max_sleep, values_count=values_count))
+        result.status = NaoApp.STATUS_CODE_GOOD
+        result.error = None
+        self._sendTelegrafResult(result, (
+            chunk for start, stop in result.pending_ranges() for chunk in self._telegrafChunkRanges(result.payload, start, stop)
+        ), max_sleep)
+        if result.ok and self.Messager:
+            if values_count:
+                self.Messager.sendCount(values_count)
             else:
-                sta = self._sendTelegrafData(payload)
-            if self.Messager:
-                if values_count:
-                    self.Messager.sendCount(values_count)
-                else:
-                    self.Messager.sendCount(count)
-            return(sta)
-        
+                self.Messager.sendCount(len(result.payload))
+        if result.ok and not result.spooled:
+            self._replaySpoolPending()
+        return(result)
 
-    def _sendTelegrafData(self, payload):
-        if type(payload) == list:
-            payload = NaoApp.FORMAT_TELEFRAF_FRAME_SEPERATOR.join(payload)
+    def _sendTelegrafIterable(self, result:TelegrafSendResult, max_sleep:float=2, values_count:int=None) -> TelegrafSendResult:
+        '''
+        Liest result.remaining in Abschnitten von Blockgröße mal Fenster und
+        sendet jeden Abschnitt wie eine Liste. So liegen nie mehr Zeilen im
+        Speicher, als gerade unterwegs sind. Beim ersten Fehler wird
+        abgebrochen: result.payload enthält den Abschnitt mit den angenommenen
+        Bereichen, result.remaining die noch nicht gelesenen Zeilen.
+        '''
+        result.status = NaoApp.STATUS_CODE_GOOD
+        result.error = None
+        while True:
+            if result.pending_ranges():
+                self._sendTelegrafResult(result, (
+                    chunk for start, stop in result.pending_ranges() for chunk in self._telegrafChunkRanges(result.payload, start, stop)
+                ), max_sleep)
+                if not result.ok:
+                    return(result)
+            result.streamed += len(result.payload)
+            size = self.congestion_control.chunk_size*self.congestion_control.max_window if self.congestion_control else self.data_per_telegraf_push*self.telegraf_window
+            chunk = list(islice(result.remaining, size))
+            if not chunk:
+                break
+            result.payload = self.dedup_window.filter(chunk) if self.dedup_window else chunk
+            result.accepted = []
+        result.remaining = None
+        if self.Messager:
+            if values_count:
+                self.Messager.sendCount(values_count)
+            else:
+                self.Messager.sendCount(result.streamed)
+        if not result.spooled:
+            self._replaySpoolPending()
+        return(result)
+
+    def replaySpool(self, max_lines:int=None) -> int:
+        '''
+        Sendet die im spool gepufferten Blöcke gedrosselt nach (höchstens
+        max_lines bzw. spool.replay_lines Zeilen) und liefert die Anzahl der
+        angenommenen Zeilen. Wird nach jedem erfolgreichen Upload automatisch
+        aufgerufen, solange der spool nicht leer ist.
+        '''
+        if not self.spool:
+            return(0)
+        return(self.spool.replay(self._sendSpooled, max_lines=max_lines))
+
+    def _replaySpoolPending(self):
+        if self.spool and self.spool.pending_lines and self.spool.online:
+            self.replaySpool()
+
+    def _sendSpooled(self, lines:list, precision:str=None) -> bool:
+        # nachgesendete Blöcke sind Nachladungen und dürfen aktuelle Werte nicht verdrängen
+        result = TelegrafSendResult(lines, precision=precision, lane=LANE_BACKFILL)
+        self._sendTelegrafRanges(result, self._telegrafChunkRanges(lines, 0, len(lines)), 2)
+        return(result.ok)
+
+    def _sendTelegrafResult(self, result:TelegrafSendResult, ranges, max_sleep:float) -> None:
+        '''
+        Wie _sendTelegrafRanges; mit spool wird der nicht angenommene Rest bei
+        einem vorübergehenden Fehler gepuffert und als angenommen markiert.
+        Solange der spool nach einem Fehler offline ist, wird direkt gepuffert.
+        '''
+        if self.spool and not self.spool.online:
+            result.status = TelegrafSendResult.STATUS_ERROR
+        else:
+            self._sendTelegrafRanges(result, ranges, max_sleep)
+        if not self.spool or result.ok or not self.spool.transient(result.status):
+            return
+        self.spool.set_offline()
+        for start, stop in result.pending_ranges():
+            result.spooled += self.spool.append(result.payload[start:stop], result.precision)
+            result.accept(start, stop)
+        result.status = NaoApp.STATUS_CODE_GOOD
+        result.error = None
+
+    def _sendTelegrafBody(self, payload, precision:str=None, lane:str=None) -> int:
+        if not self.spool:
+            return(self._sendTelegrafData(payload=payload, precision=precision, lane=lane))
+        if self.spool.online:
+            try:
+                sta = self._sendTelegrafData(payload=payload, precision=precision, lane=lane)
+            except Exception:
+                sta = TelegrafSendResult.STATUS_ERROR
+            if sta == NaoApp.STATUS_CODE_GOOD:
+                self._replaySpoolPending()
+                return(sta)
+            if not self.spool.transient(sta):
+                return(sta)
+            self.spool.set_offline()
+        self.spool.append(payload, precision)
+        return(NaoApp.STATUS_CODE_GOOD)
+
+    def _sendTelegrafRanges(self, result:TelegrafSendResult, ranges, max_sleep:float) -> None:
+        '''
+        Sendet die Blöcke result.payload[start:stop] mit bis zu telegraf_window
+        Blöcken gleichzeitig (bzw. so vielen, wie die congestion_control gerade
+        erlaubt). Jeder mit 204 bestätigte Block landet in result.accepted, auch
+        wenn ein früherer Block fehlgeschlagen ist. Nach dem ersten Fehler wird
+        kein weiterer Block mehr gestartet. Ohne Fenster und Regler wird wie
+        bisher zwischen den Blöcken kurz pausiert.
+        '''
+        in_flight = deque()
+        max_workers = self.congestion_control.max_window if self.congestion_control else self.telegraf_window
+        pace = not self.congestion_control and self.telegraf_window == 1
+        executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
         try:
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_TELEGRAF, payload, self.headers) # type: ignore
-            status = self._conneciton.getresponse().status # type: ignore
-            self._conneciton.close() # type: ignore
-
-            if status != NaoApp.STATUS_CODE_GOOD:
-                self._loginNao()
-                self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_TELEGRAF, payload, self.headers) # type: ignore
-                status = self._conneciton.getresponse().status # type: ignore
-                self._conneciton.close() # type: ignore
-
-                if status != NaoApp.STATUS_CODE_GOOD:
-                    raise RuntimeError("....")
-                
-        except:
-            self._loginNao()
-            self._conneciton.request(NaoApp.NAME_POST, NaoApp.URL_TELEGRAF, payload, self.headers) # type: ignore
-            status = self._conneciton.getresponse().status # type: ignore
-            self._conneciton.close() # type: ignore
+            for idx, (start, stop) in enumerate(ranges):
+                if len(in_flight) >= self._currentTelegrafWindow():
+                    if not self._collectTelegrafRange(result, *in_flight.popleft()):
+                        break
+                    if pace:
+                        sleep(min(max_sleep, 0.1+(idx-1)*0.04))
+                in_flight.append((start, stop, self._submitTelegrafData(executor, result.payload[start:stop], result.precision, result.lane)))
+            while in_flight:
+                self._collectTelegrafRange(result, *in_flight.popleft())
+        finally:
+            if executor:
+                executor.shutdown()
+
+    def _submitTelegrafData(self, executor:ThreadPoolExecutor, chunk:list, precision:str=None, lane:str=None) -> Future:
+        if executor:
+            return(executor.submit(self._sendTelegrafData, chunk, precision, lane))
+        future = Future()
+        try:
+            future.set_result(self._sendTelegrafData(chunk, precision, lane))
+        except Exception as e:
+            future.set_exception(e)
+        return(future)
 
+    def _collectTelegrafRange(self, result:TelegrafSendResult, start:int, stop:int, future:Future) -> bool:
+        try:
+            sta = future.result()
+        except Exception as e:
+            sta = TelegrafSendResult.STATUS_ERROR
+            if result.status == NaoApp.STATUS_CODE_GOOD:
+                result.error = e
+        if sta == NaoApp.STATUS_CODE_GOOD:
+            result.accept(start, stop)
+            if self.dedup_window:
+                self.dedup_window.accept(result.payload[start:stop])
+            return(True)
+        if result.status == NaoApp.STATUS_CODE_GOOD:
+            result.status = sta
+        return(False)
+
+    def _currentTelegrafWindow(self) -> int:
+        if self.congestion_control:
+            return(self.congestion_control.window)
+        return(self.telegraf_window)
+
+    def _telegrafChunkRanges(self, payload:list, start:int, stop:int):
+        # mit Regler wird die Blockgröße erst beim Abholen gelesen und folgt so dem Regler
+        # telegraf_chunk_bytes begrenzt zusätzlich die Bytes pro Block (breite Mehrfeld-Zeilen)
+        while start < stop:
+            size = self.congestion_control.chunk_size if self.congestion_control else self.data_per_telegraf_push
+            end = telegraf_chunk_end(payload, start, min(stop, start+size), self.telegraf_chunk_bytes)
+            yield (start, end)
+            start = end
+
+    def _sendTelegrafData(self, payload, precision:str=None, lane:str=None):
+        nbytes = 0
+        if self.priority_scheduler:
+            # Spur und Größe werden am unkomprimierten Block bestimmt
+            lane = lane or self.priority_scheduler.classify(payload, precision)
+            nbytes = sum(len(line)+1 for line in payload) if type(payload) == list else len(payload)
+        if type(payload) == list:
+            payload = TelegrafStreamBody(payload, self.gzip_level)
+        elif self.gzip_level:
+            payload = gzip_telegraf_body(payload, self.gzip_level)
+        for attempt in range(2):
+            self._loginNao()
+            try:
+                status = self._postTelegraf(payload, precision, lane, nbytes)
+            except:
+                if attempt == 1:
+                    raise
+                continue
+            if status == NaoApp.STATUS_CODE_GOOD:
+                break
+            if status in NaoApp.STATUS_CODES_AUTH:
+                self._tokens.invalidate(self.headers[NaoApp.NAME_WEBAUTH])
         return(status)
 
+    def _postTelegraf(self, payload, precision:str=None, lane:str=None, nbytes:int=0) -> int:
+        request = lambda: self._pool.request(NaoApp.NAME_POST, telegraf_url(NaoApp.URL_TELEGRAF, precision), payload, telegraf_headers(self.headers, self.gzip_level), timeout=self.timeout)
+        if self.congestion_control:
+            send = lambda: self.congestion_control.send(request)
+        else:
+            send = request
+        if self.priority_scheduler:
+            res, _ = self.priority_scheduler.send(lane, nbytes, send)
+        else:
+            res, _ = send()
+        return(res.status)
+
 
     '''
     GET SOME DATA FROM  NAO
@@ -314,6 +587,83 @@ class NaoApp():
     def getRawformatetTimeseries(self, select):
         return(self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_RAW_TIMESERIES, payload=select))
 
+    def getSingelValues(self, organizationId, first_time="-365d", last_time="now()", points=[{"id":"all"}], validates=False, aggregate="mean", use_cache:bool=True):
+        '''
+        points ->   {
+                        "id": str,
+                        "asset": str,
+                        "instance": str,
+                        "series": str,
+                    }
+        use_cache=False umgeht einen gesetzten query_cache.
+        '''
+        payload = {
+            "select": {
+                "organizationId": organizationId,
+                "points": points,
+                "range": {
+                    "start": first_time,
+                    "stop": last_time
+                },
+                "validates": validates,
+            },
+            "aggregate": aggregate
+        }
+        return(self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_SINGELVALUES, payload=payload, use_cache=use_cache))
+
+    def getLastTimestamps(self, organizationId:str, points:list, batch_size:int=WATERMARK_BATCH_SIZE, first_time:str=WATERMARK_RANGE_START, max_workers:int=DEFAULT_BULK_WORKERS) -> dict:
+        '''
+        Letzter in NAO gespeicherter Zeitstempel je Reihe, z. B. um einen verlorenen
+        lokalen Sync-Zustand wiederherzustellen.
+
+        points = [ {"id": str, "asset": str, "instance": str, "series": str} ]
+
+        Die Punkte werden in Blöcken zu batch_size mit dem Aggregat "last" abgefragt,
+        bis zu max_workers Blöcke parallel. Rückgabe ist {<id>: datetime (UTC)};
+        Reihen ohne Daten in NAO fehlen. Schlägt ein Block fehl, wird der Fehler geworfen.
+        '''
+        def fetch(batch):
+            response = self.getSingelValues(organizationId, first_time=first_time, points=batch, aggregate=AGGREGATE_LAST, use_cache=False)
+            return(parse_last_timestamps(response))
+
+        if self._pool.pool_size < max_workers:
+            self._pool.resize(max_workers)
+        ret = {}
+        for outcome in run_bulk(fetch, batch_points(points, batch_size), max_workers=max_workers):
+            if outcome.error is not None:
+                raise outcome.error
+            ret.update(outcome.result)
+        return(ret)
+
+    def getDailyCounts(self, organizationId:str, points:list, days:list, batch_size:int=WATERMARK_BATCH_SIZE, max_workers:int=DEFAULT_BULK_WORKERS) -> dict:
+        '''
+        Anzahl der in NAO gespeicherten Werte je Reihe und Tag, z. B. für die Lückenprüfung.
+
+        points = [ {"id": str, "asset": str, "instance": str, "series": str} ]
+        days = [ (date, start, stop) ], siehe naoconnect.nao.gap_audit.day_ranges
+
+        Jeder Tag wird in Blöcken zu batch_size Punkten mit dem Aggregat "count"
+        abgefragt, bis zu max_workers Anfragen parallel. Rückgabe ist
+        {<id>: {date: count}}; Tage ohne Werte fehlen.
+        '''
+        def fetch(item):
+            day, start, stop, batch = item
+            response = self.getSingelValues(organizationId, first_time=start.isoformat(), last_time=stop.isoformat(), points=batch, aggregate=AGGREGATE_COUNT, use_cache=False)
+            return(day, parse_counts(response))
+
+        if self._pool.pool_size < max_workers:
+            self._pool.resize(max_workers)
+        items = [(day, start, stop, batch) for day, start, stop in days for batch in batch_points(points, batch_size)]
+        ret = {}
+        for outcome in run_bulk(fetch, items, max_workers=max_workers):
+            if outcome.error is not None:
+                raise outcome.error
+            day, counts = outcome.result
+            for point_id, count in counts.items():
+                if count > 0:
+                    ret.setdefault(point_id, {})[day] = count
+        return(ret)
+
     def getRawAlignedTimeseriesNaoToNao(
         self,
         source_asset_id: str,
@@ -330,75 +680,78 @@ class NaoApp():
         Liest eine Raw-Zeitreihe ueber die nicht paginierte Raw-API und
         formatiert sie fuer einen NAO-zu-NAO-Transfer auf den Zielserver.
         """
-        values = []
-        last_time = None
-
-        payload = {
-            "select": {
-                "points": [
-                    {
-                        "id": source_series_id,
-                        "asset": source_asset_id,
-                        "instance": source_instance_id,
-                        "series": source_series_id,
-                    }
-                ],
-                "range": {
-                    "start": start.isoformat(),
-                    "stop": stop.isoformat(),
-                },
-            },
-            "format": "list",
+        point = {
+            "id": source_series_id,
+            "asset": source_asset_id,
+            "instance": source_instance_id,
+            "series": source_series_id,
         }
-
-        response = self._sendDataToNaoJson(
-            NaoApp.NAME_POST,
-            NaoApp.URL_RAW_TIMESERIES,
-            payload=payload,
+        times, values = self.getRawTimeseriesColumns([point], start, stop, factor=factor).get(
+            source_series_id, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
         )
-        if isinstance(response, dict) and "result" not in response:
-            raise RuntimeError(f"Raw API Antwort ohne result: {response}")
-        result = response.get("result", []) if isinstance(response, dict) else []
 
-        for series_result in result:
-            if series_result.get("id") != source_series_id:
-                continue
-            time_values = series_result.get("time", [])
-            raw_values = series_result.get("value", [])
-            for timestamp, value in zip(time_values, raw_values):
-                if value is None:
-                    continue
-                values.append(
-                    {
-                        "time": pd.to_datetime(timestamp, utc=True),
-                        "value": float(value) * factor,
-                    }
-                )
-                last_time = timestamp
-
-        if not values:
+        if not len(times):
             return {
                 "last_time": None,
                 "dataframe": pd.DataFrame(columns=["time", "value"]),
                 "telegraf": [],
             }
 
-        dataframe = pd.DataFrame(values)
-        timestamps = [
-            int(timestamp.timestamp()*1000000000)
-            for timestamp in dataframe["time"]
-        ]
+        dataframe = pd.DataFrame({"time": pd.to_datetime(times, utc=True), "value": values})
         telegraf = [
             f"{target_asset_id},instance={target_instance_id} {target_series_id}={value} {timestamp}"
-            for value, timestamp in zip(dataframe["value"].to_list(), timestamps)
+            for value, timestamp in zip(values.tolist(), times.tolist())
         ]
 
         return {
-            "last_time": pd.to_datetime(last_time, utc=True).to_pydatetime(),
+            "last_time": pd.to_datetime(int(times[-1]), utc=True).to_pydatetime(),
             "dataframe": dataframe,
             "telegraf": telegraf,
         }
 
+    def getRawTimeseriesColumns(
+        self,
+        points: list,
+        start: datetime,
+        stop: datetime,
+        window: timedelta = DEFAULT_RAW_WINDOW,
+        max_workers: int = DEFAULT_RAW_WORKERS,
+        factor: float = 1.0,
+    ) -> dict:
+        """
+        Liest Raw-Zeitreihen spaltenorientiert.
+
+        points = [ {"id": str, "asset": str, "instance": str, "series": str} ]
+
+        Der Zeitraum wird in Fenster der Länge window geteilt, die mit bis zu
+        max_workers parallelen Anfragen geholt werden. Rückgabe ist
+        {<id>: (time, value)} mit time als int64-numpy-Array in Nanosekunden
+        (UTC) und value als float64-Array; None-Werte sind entfernt.
+        """
+        ids = [point["id"] for point in points]
+
+        def fetch(time_range):
+            payload = {
+                "select": {
+                    "points": points,
+                    "range": {
+                        "start": time_range[0].isoformat(),
+                        "stop": time_range[1].isoformat(),
+                    },
+                },
+                "format": "list",
+            }
+            response = self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_RAW_TIMESERIES, payload=payload)
+            return parse_raw_result(response, factor=factor, ids=ids)
+
+        windows = split_time_range(start, stop, window)
+        if len(windows) <= 1 or max_workers <= 1:
+            return concat_columns(fetch(time_range) for time_range in windows)
+        if self._pool.pool_size < max_workers:
+            self._pool.resize(max_workers)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+            return concat_columns(executor.map(fetch, windows))
+
 
 class NaoLoggerMessage(NaoApp):
 
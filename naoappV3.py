@@ -6,6 +6,7 @@ from copy import copy
 from time import sleep
 from datetime import datetime, timezone
 from math import ceil
+from naoconnect.nao.telegraf import gzip_telegraf_body, telegraf_headers, telegraf_line_count
 '''
 Ähnlich wie V2, wird nur benötigt falls von einem Kritischem Netzwertk heraus Server überwacht werden sollen.
 '''
@@ -56,7 +57,7 @@ class NaoApp():
     QUERY_GET = "?query="
     TELEGRAF_FORMATER = "%s,instance=%s %s=%s %s"
 
-    def __init__(self, host, email, password, local=False, data_per_telegraf_push=10000, Messager=False, timeout=120):
+    def __init__(self, host, email, password, local=False, data_per_telegraf_push=10000, Messager=False, timeout=120, gzip_level=None):
         self.auth = {
             NaoApp.NAME_HOST: host,
             NaoApp.NAME_EMAIL: email,
@@ -68,6 +69,7 @@ class NaoApp():
         self.timeout = timeout
         self.local = local
         self.Messager = Messager
+        self.gzip_level = gzip_level
         self.session = requests.Session()
 
     def _loginNao(self):
@@ -184,10 +186,15 @@ class NaoApp():
         return self._sendDataToNaoJson(NaoApp.NAME_POST, NaoApp.URL_RAW_TIMESERIES, payload=select)
 
     def _sendTelegrafData(self, payload):
-        if isinstance(payload, list):
+        if self.gzip_level:
+            payload = gzip_telegraf_body(payload, self.gzip_level)
+        elif isinstance(payload, list):
             payload = NaoApp.FORMAT_TELEFRAF_FRAME_SEPERATOR.join(payload)
+        elif isinstance(payload, bytearray):
+            # requests würde einen bytearray als Stream Byte für Byte lesen
+            payload = bytes(payload)
 
-        headers = copy(self.headers)
+        headers = telegraf_headers(copy(self.headers), self.gzip_level)
         try:
             response = self.session.post(
                 self.base_url + NaoApp.URL_TELEGRAF,
@@ -196,7 +203,7 @@ class NaoApp():
             )
             if response.status_code != NaoApp.STATUS_CODE_GOOD:
                 self._loginNao()
-                headers = copy(self.headers)
+                headers = telegraf_headers(copy(self.headers), self.gzip_level)
                 response = self.session.post(
                     self.base_url + NaoApp.URL_TELEGRAF,
                     headers=headers,
@@ -205,7 +212,7 @@ class NaoApp():
             return response.status_code
         except requests.RequestException:
             self._loginNao()
-            headers = copy(self.headers)
+            headers = telegraf_headers(copy(self.headers), self.gzip_level)
             response = self.session.post(
                 self.base_url + NaoApp.URL_TELEGRAF,
                 headers=headers,
@@ -222,7 +229,7 @@ class NaoApp():
         if not isinstance(payload, list):
             sta = self._sendTelegrafData(payload=payload)
             if self.Messager:
-                count = len(payload.split("\n"))
+                count = telegraf_line_count(payload)
                 self.Messager.sendCount(count)
             return sta
         else: